@@ -0,0 +1,390 @@
+import os
+import re
+import csv
+import json
+import time
+import threading
+
+import numpy as np
+
+from omr_layout import NUM_QUESTIONS, NUM_OPTS, OPTION_LETTERS, SECTION_RANGES
+from scoring_engine import SECTION_NAMES
+from responses import POPCOUNT, as_bits, pattern_counts, option_counts
+from fileio import atomic_write
+
+PERCENTILES = (10, 25, 50, 75, 90)
+# Snapshots are rewritten after this many recorded sheets or seconds (and on shutdown)
+SAVE_EVERY = int(os.getenv("OMR_ANALYTICS_SAVE_EVERY", "50"))
+SAVE_SECONDS = float(os.getenv("OMR_ANALYTICS_SAVE_SECONDS", "10"))
+
+
+class ScoreSketch:
+    """Streaming percentile sketch: a sparse fixed-width histogram.
+
+    Scores are bounded and usually land on a coarse grid (whole or quarter marks),
+    so bins of `resolution` marks give exact-to-resolution percentiles in memory
+    proportional to the number of distinct scores, and sketches merge by addition.
+    """
+
+    def __init__(self, resolution=0.25):
+        self.resolution = resolution
+        self.bins = {}
+        self.count = 0
+
+    def add(self, value, count=1):
+        """Add (or, with count=-1, retract) one observation."""
+        b = int(round(float(value) / self.resolution))
+        c = self.bins.get(b, 0) + count
+        if c > 0:
+            self.bins[b] = c
+        else:
+            self.bins.pop(b, None)
+        self.count += count
+
+    def add_many(self, values, count=1):
+        """add() for an array of observations, binned in one pass."""
+        bins, counts = np.unique(np.round(np.asarray(values, dtype=np.float64) / self.resolution).astype(np.int64),
+                                 return_counts=True)
+        for b, c in zip(bins.tolist(), counts.tolist()):
+            c = self.bins.get(b, 0) + count * c
+            if c > 0:
+                self.bins[b] = c
+            else:
+                self.bins.pop(b, None)
+        self.count += count * len(np.asarray(values).reshape(-1))
+
+    def merge(self, other):
+        for b, c in other.bins.items():
+            self.bins[b] = self.bins.get(b, 0) + c
+        self.count += other.count
+
+    def percentiles(self, qs=PERCENTILES):
+        if not self.count:
+            return {}
+        keys = sorted(self.bins)
+        cum = np.cumsum([self.bins[k] for k in keys])
+        out = {}
+        for q in qs:
+            idx = int(np.searchsorted(cum, q / 100 * self.count, side="left"))
+            out[f"p{q}"] = round(keys[min(idx, len(keys) - 1)] * self.resolution, 2)
+        return out
+
+    def to_dict(self):
+        return {"resolution": self.resolution, "bins": {str(k): v for k, v in self.bins.items()}}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data.get("resolution", 0.25))
+        sketch.bins = {int(k): v for k, v in data.get("bins", {}).items()}
+        sketch.count = sum(sketch.bins.values())
+        return sketch
+
+
+class SetAggregate:
+    """Running item-analysis sums for one answer key set; O(1) per scored sheet."""
+
+    def __init__(self):
+        self.n = 0
+        # sheets whose responses were folded in; backfilled CSV rows only carry scores
+        self.item_n = 0
+        self.option_counts = np.zeros((NUM_QUESTIONS, NUM_OPTS), dtype=np.int64)
+        self.blank_counts = np.zeros(NUM_QUESTIONS, dtype=np.int64)
+        self.multi_counts = np.zeros(NUM_QUESTIONS, dtype=np.int64)
+        # item score x (0..1 credit) and total score y: sum x, sum x*y for point-biserial r
+        self.item_sum = np.zeros(NUM_QUESTIONS, dtype=np.float64)
+        self.item_sq_sum = np.zeros(NUM_QUESTIONS, dtype=np.float64)
+        self.item_total_sum = np.zeros(NUM_QUESTIONS, dtype=np.float64)
+        # sum y, sum y*y over the item_n sheets with responses
+        self.item_y_sum = 0.0
+        self.item_y_sq_sum = 0.0
+        self.total_sum = 0.0
+        self.total_sq_sum = 0.0
+        self.section_sum = np.zeros(len(SECTION_NAMES), dtype=np.float64)
+        self.total_sketch = ScoreSketch()
+        self.section_sketches = [ScoreSketch() for _ in SECTION_NAMES]
+        self.max_total = 0.0
+        self.max_sections = None  # unknown until a sheet (or its key) says
+        self.key_bits = None
+
+    def update(self, marked, result, key_bits=None, weight=1):
+        """Fold in a batch of sheets: their responses (anything score_responses accepts) and
+        its score_responses result. weight=-1 retracts sheets that were folded in earlier
+        (e.g. a superseded rescan)."""
+        patterns = pattern_counts(as_bits(marked))
+        marks = np.asarray(result["question_marks"], dtype=np.float64).reshape(-1, NUM_QUESTIONS)
+        totals = np.asarray(result["total"], dtype=np.float64).reshape(-1)
+        qmax = np.asarray(result["question_max"], dtype=np.float64)
+        items = np.clip(np.divide(marks, qmax, out=np.zeros_like(marks), where=qmax > 0), 0, 1)
+
+        self.update_scores(result["section_scores"], totals, result["max_total"], result["max_section_scores"], weight)
+        self.item_n += weight * len(totals)
+        self.option_counts += weight * option_counts(patterns)
+        self.blank_counts += weight * patterns[:, 0]
+        self.multi_counts += weight * patterns[:, POPCOUNT > 1].sum(axis=1)
+        self.item_sum += weight * items.sum(axis=0)
+        self.item_sq_sum += weight * (items * items).sum(axis=0)
+        self.item_total_sum += weight * (items * totals[:, None]).sum(axis=0)
+        self.item_y_sum += weight * totals.sum()
+        self.item_y_sq_sum += weight * (totals * totals).sum()
+        if key_bits is not None:
+            self.key_bits = np.asarray(key_bits, dtype=np.uint8)
+
+    def update_scores(self, section_scores, totals, max_total, max_section_scores=None, weight=1):
+        """Fold in scores only (no per-question responses), e.g. rows of an existing results CSV.
+        max_section_scores may be None when the section maxima are not known."""
+        sections = np.asarray(section_scores, dtype=np.float64).reshape(-1, len(SECTION_NAMES))
+        totals = np.asarray(totals, dtype=np.float64).reshape(-1)
+        self.n += weight * len(totals)
+        self.total_sum += weight * totals.sum()
+        self.total_sq_sum += weight * (totals * totals).sum()
+        self.section_sum += weight * sections.sum(axis=0)
+        self.total_sketch.add_many(totals, weight)
+        for sketch, values in zip(self.section_sketches, sections.T):
+            sketch.add_many(values, weight)
+        self.max_total = float(max_total)
+        if max_section_scores is not None:
+            self.max_sections = np.asarray(max_section_scores, dtype=np.float64)
+
+    def discrimination(self):
+        """Point-biserial (item-total) correlation per question, from the running sums."""
+        n = max(self.item_n, 1)
+        mean_x = self.item_sum / n
+        mean_y = self.item_y_sum / n
+        cov = self.item_total_sum / n - mean_x * mean_y
+        var_x = self.item_sq_sum / n - mean_x ** 2
+        var_y = self.item_y_sq_sum / n - mean_y ** 2
+        denom = np.sqrt(np.clip(var_x, 0, None) * max(var_y, 0))
+        return np.divide(cov, denom, out=np.zeros_like(cov), where=denom > 1e-12)
+
+    def summary(self, include_questions=True):
+        n = max(self.n, 1)
+        mean = self.total_sum / n
+        report = {
+            "students": self.n,
+            "max_total": self.max_total,
+            "mean": round(mean, 2),
+            "std": round(float(np.sqrt(max(self.total_sq_sum / n - mean ** 2, 0))), 2),
+            "percentiles": self.total_sketch.percentiles(),
+            "highest": self._extreme(max),
+            "lowest": self._extreme(min),
+            "sections": {}
+        }
+        item_n = max(self.item_n, 1)
+        difficulty = self.item_sum / item_n
+        for i, name in enumerate(SECTION_NAMES):
+            startq, endq = SECTION_RANGES[name]
+            report["sections"][name] = {
+                "mean": round(self.section_sum[i] / n, 2),
+                "max": None if self.max_sections is None else float(self.max_sections[i]),
+                "percentiles": self.section_sketches[i].percentiles(),
+                "mean_difficulty": round(float(difficulty[startq - 1:endq].mean()), 3)
+            }
+        if self.item_n < self.n:
+            report["students_with_responses"] = self.item_n
+        if include_questions and self.item_n:
+            disc = self.discrimination()
+            report["questions"] = [{
+                "question": f"Q{q + 1}",
+                "key": self._key_letters(q),
+                "difficulty": round(float(difficulty[q]), 3),
+                "discrimination": round(float(disc[q]), 3),
+                "options": {OPTION_LETTERS[o]: round(self.option_counts[q, o] / item_n, 3) for o in range(NUM_OPTS)},
+                "blank": round(self.blank_counts[q] / item_n, 3),
+                "multi_marked": round(self.multi_counts[q] / item_n, 3)
+            } for q in range(NUM_QUESTIONS)]
+        return report
+
+    def _extreme(self, fn):
+        if not self.total_sketch.bins:
+            return None
+        return round(fn(self.total_sketch.bins) * self.total_sketch.resolution, 2)
+
+    def _key_letters(self, q):
+        if self.key_bits is None:
+            return None
+        return ",".join(OPTION_LETTERS[o] for o in range(NUM_OPTS) if self.key_bits[q] >> o & 1)
+
+    def to_dict(self):
+        return {
+            "n": self.n,
+            "item_n": self.item_n,
+            "option_counts": self.option_counts.tolist(),
+            "blank_counts": self.blank_counts.tolist(),
+            "multi_counts": self.multi_counts.tolist(),
+            "item_sum": self.item_sum.tolist(),
+            "item_sq_sum": self.item_sq_sum.tolist(),
+            "item_total_sum": self.item_total_sum.tolist(),
+            "item_y_sum": self.item_y_sum,
+            "item_y_sq_sum": self.item_y_sq_sum,
+            "total_sum": self.total_sum,
+            "total_sq_sum": self.total_sq_sum,
+            "section_sum": self.section_sum.tolist(),
+            "total_sketch": self.total_sketch.to_dict(),
+            "section_sketches": [s.to_dict() for s in self.section_sketches],
+            "max_total": self.max_total,
+            "max_sections": None if self.max_sections is None else self.max_sections.tolist(),
+            "key_bits": None if self.key_bits is None else self.key_bits.tolist()
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        agg = cls()
+        agg.n = data["n"]
+        agg.item_n = data.get("item_n", agg.n)
+        for name in ("option_counts", "blank_counts", "multi_counts"):
+            setattr(agg, name, np.array(data[name], dtype=np.int64))
+        for name in ("item_sum", "item_sq_sum", "item_total_sum", "section_sum"):
+            setattr(agg, name, np.array(data[name], dtype=np.float64))
+        if data.get("max_sections") is not None:
+            agg.max_sections = np.array(data["max_sections"], dtype=np.float64)
+        agg.total_sum = data["total_sum"]
+        agg.total_sq_sum = data["total_sq_sum"]
+        agg.item_y_sum = data.get("item_y_sum", agg.total_sum)
+        agg.item_y_sq_sum = data.get("item_y_sq_sum", agg.total_sq_sum)
+        agg.max_total = data["max_total"]
+        agg.total_sketch = ScoreSketch.from_dict(data["total_sketch"])
+        agg.section_sketches = [ScoreSketch.from_dict(s) for s in data["section_sketches"]]
+        if data.get("key_bits") is not None:
+            agg.key_bits = np.array(data["key_bits"], dtype=np.uint8)
+        return agg
+
+
+class CohortAnalytics:
+    """Per exam (results CSV) and per set aggregates, persisted as small JSON snapshots.
+
+    `backfill(exam)`, if given, seeds an exam that has no snapshot yet (results scored before
+    analytics existed) and returns {set name: SetAggregate}.
+
+    Snapshots are saved every `save_every` sheets or `save_seconds`, and by flush(). Sheets
+    recorded since the last save are kept and applied again on top of a newer snapshot
+    written by another process, so deferring the save loses nothing to the other writers.
+    Writers (record, flush) are expected to be serialised between processes by the caller.
+    """
+
+    def __init__(self, directory, backfill=None, save_every=SAVE_EVERY, save_seconds=SAVE_SECONDS):
+        self.directory = directory
+        self.backfill = backfill
+        self.save_every = save_every
+        self.save_seconds = save_seconds
+        self._exams = {}
+        self._mtimes = {}
+        self._pending = {}   # exam -> [(set name, marked, result, key_bits, replaces)] not saved yet
+        self._saved_at = {}
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, exam):
+        return os.path.join(self.directory, re.sub(r"[^A-Za-z0-9_\-\.]", "_", exam) + ".json")
+
+    def _load(self, exam):
+        """Cached aggregates, reloaded when another process has written a newer snapshot."""
+        path = self._path(exam)
+        mtime = os.stat(path).st_mtime_ns if os.path.exists(path) else None
+        sets = self._exams.get(exam)
+        if sets is None or self._mtimes.get(exam) != mtime:
+            sets = {}
+            if mtime is not None:
+                with open(path, "r", encoding="utf-8") as f:
+                    sets = {name: SetAggregate.from_dict(d) for name, d in json.load(f).items()}
+                for sheet in self._pending.get(exam, ()):
+                    self._apply(sets, *sheet)
+            elif self.backfill is not None and exam not in self._exams:
+                sets = self.backfill(exam)
+                if sets:
+                    self._save(exam, sets)
+                    mtime = self._mtimes[exam]
+            self._exams[exam] = sets
+            self._mtimes[exam] = mtime
+        return sets
+
+    @staticmethod
+    def _apply(sets, set_name, marked, result, key_bits, replaces):
+        agg = sets.setdefault(set_name, SetAggregate())
+        if replaces is not None:
+            agg.update(*replaces, weight=-1)
+        agg.update(marked, result, key_bits)
+
+    def record(self, exam, set_name, marked, result, key_bits=None, replaces=None):
+        """Update the running aggregates with newly scored sheet(s). `replaces` is an optional
+        (marked, result) pair for a superseded scan whose contribution is retracted first."""
+        with self._lock:
+            sets = self._load(exam)
+            self._apply(sets, set_name, marked, result, key_bits, replaces)
+            pending = self._pending.setdefault(exam, [])
+            pending.append((set_name, marked, result, key_bits, replaces))
+            # an exam's first snapshot is written at once: until then other processes would backfill
+            if (self._mtimes.get(exam) is None or len(pending) >= self.save_every
+                    or time.monotonic() - self._saved_at.get(exam, 0) >= self.save_seconds):
+                self._save(exam, sets)
+
+    def flush(self):
+        """Save every exam with sheets recorded since its last snapshot (e.g. on shutdown)."""
+        with self._lock:
+            for exam in [e for e, pending in self._pending.items() if pending]:
+                self._save(exam, self._load(exam))
+
+    def _save(self, exam, sets):
+        snapshot = {name: agg.to_dict() for name, agg in sets.items()}
+        with atomic_write(self._path(exam), "w", encoding="utf-8") as f:
+            json.dump(snapshot, f)
+        self._mtimes[exam] = os.stat(self._path(exam)).st_mtime_ns
+        self._pending.pop(exam, None)
+        self._saved_at[exam] = time.monotonic()
+
+    def report(self, exam, set_name=None, include_questions=True):
+        with self._lock:
+            sets = self._load(exam)
+            if set_name is not None:
+                agg = sets.get(set_name)
+                return {set_name: agg.summary(include_questions)} if agg else {}
+            return {name: agg.summary(include_questions) for name, agg in sorted(sets.items())}
+
+    def overall(self, exam):
+        """Whole-exam score summary across sets (question stats only make sense per set)."""
+        with self._lock:
+            return overall_summary(self._load(exam).values())
+
+
+def csv_aggregates(path, skip=(), section_maxima=None):
+    """Score-only SetAggregates from the rows of a results CSV, for sets not in `skip`.
+    The CSV carries section scores and totals but not responses, so question stats stay empty;
+    section_maxima(set name) gives a set's maximum per section, or None if unknown."""
+    sets = {}
+    if not os.path.exists(path):
+        return sets
+    with open(path, "r", newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            name = row.get("Set Name")
+            if not name or name in skip:
+                continue
+            try:
+                sections = [float(row[s]) for s in SECTION_NAMES]
+                total, max_total = float(row["Marks Obtained"]), float(row["Total Marks"])
+            except (KeyError, TypeError, ValueError):
+                continue  # partial or foreign row
+            if name not in sets:
+                sets[name] = SetAggregate()
+                maxima = section_maxima(name) if section_maxima else None
+                if maxima is not None:
+                    sets[name].max_sections = np.asarray(maxima, dtype=np.float64)
+            sets[name].update_scores(sections, total, max_total)
+    return sets
+
+
+def overall_summary(aggregates):
+    """Score summary over several SetAggregates."""
+    merged = ScoreSketch()
+    n, total = 0, 0.0
+    for agg in aggregates:
+        merged.merge(agg.total_sketch)
+        n += agg.n
+        total += agg.total_sum
+    if not n:
+        return {"students": 0}
+    return {
+        "students": n,
+        "mean": round(total / n, 2),
+        "percentiles": merged.percentiles(),
+        "highest": round(max(merged.bins) * merged.resolution, 2),
+        "lowest": round(min(merged.bins) * merged.resolution, 2)
+    }
@@ -0,0 +1,275 @@
+import os
+import io
+import re
+import csv
+import json
+
+import numpy as np
+
+from omr_layout import SECTION_RANGES, OPTION_LETTERS, NUM_QUESTIONS, NUM_OPTS
+from fileio import atomic_write
+
+SECTION_NAMES = list(SECTION_RANGES)
+# Header spellings seen in pasted blocks and in the bundled key workbook
+ALIASES = {
+    "PowerBI": "Power BI", "Power Bi": "Power BI", "adv stats": "Statistics",
+    "Adv Stats": "Statistics", "statastics": "Statistics", "Statistics": "Statistics",
+    "Satistics": "Statistics", "Stats": "Statistics", "Data Analysis": "EDA",
+    "MySQL": "SQL"
+}
+COMPILED_EXT = ".npy"
+
+# "1 - a", "16 - a,b,c,d", "81. a", "12- b", "11 -  a"
+_ANSWER_RE = re.compile(r"^\s*(\d+)\s*[\-\.:)]*\s*([a-dA-D](?:[\s,]*[a-dA-D])*)\s*$")
+# "Set - A", "Set A", "set_b", "A"
+_SET_RE = re.compile(r"^\s*(?:set)?[\s\-_:]*([A-Za-z0-9]+)\s*$", re.I)
+_OPTION_BITS = {letter: 1 << i for i, letter in enumerate(OPTION_LETTERS)}
+
+
+def _section_key(text):
+    return re.sub(r"[^a-z]", "", str(text).lower())
+
+
+_SECTION_LOOKUP = {_section_key(s): s for s in SECTION_NAMES}
+_SECTION_LOOKUP.update({_section_key(k): v for k, v in ALIASES.items()})
+
+
+def resolve_section(text):
+    """Map a header cell / line to its canonical section name, or None."""
+    return _SECTION_LOOKUP.get(_section_key(text))
+
+
+def normalize_set_name(name):
+    """'Set - A', 'set a', 'A' -> 'A'."""
+    m = _SET_RE.match(str(name))
+    return (m.group(1) if m else re.sub(r"[^A-Za-z0-9]", "", str(name))).upper()
+
+
+def section_for_question(qnum):
+    for section, (startq, endq) in SECTION_RANGES.items():
+        if startq <= qnum <= endq:
+            return section
+    return None
+
+
+def parse_answer(cell):
+    """Parse one '16 - a,b,c,d' style entry into (qnum, 'a,b,c,d'), or None."""
+    m = _ANSWER_RE.match(str(cell))
+    if not m:
+        return None
+    letters = sorted(set(re.sub(r"[\s,]", "", m.group(2)).lower()))
+    return int(m.group(1)), ",".join(letters)
+
+
+def _add_answer(key, section, qnum, ans):
+    # Fall back to the layout when there is no header above the answer
+    section = section or section_for_question(qnum) or "Unassigned"
+    key.setdefault(section, {})[f"Q{qnum}"] = ans
+
+
+def parse_sectionwise_block(text):
+    """Parse a pasted text block into a sectionwise key {section: {"Qn": "a,b"}}."""
+    key = {}
+    current_section = None
+    for line in text.splitlines():
+        line = line.strip().lstrip("\ufeff")
+        if not line:
+            continue
+        section = resolve_section(line.rstrip(":"))
+        if section:
+            current_section = section
+            continue
+        parsed = parse_answer(line)
+        if parsed:
+            _add_answer(key, current_section, *parsed)
+    return {sec: v for sec, v in key.items() if v}
+
+
+def parse_grid(rows):
+    """Parse a table where each column is headed by a section name (the XLSX layout)."""
+    key = {}
+    col_sections = {}
+    for row in rows:
+        for col, cell in enumerate(row):
+            if cell is None or str(cell).strip() in ("", "nan"):
+                continue
+            section = resolve_section(cell)
+            if section:
+                col_sections[col] = section
+                continue
+            parsed = parse_answer(cell)
+            if parsed:
+                _add_answer(key, col_sections.get(col), *parsed)
+    return key
+
+
+def parse_text_sets(text, default_set=None):
+    """Split a text file on 'Set X' header lines; each chunk is parsed as a block."""
+    chunks = {}
+    current = default_set
+    for line in text.splitlines():
+        stripped = line.strip().lstrip("\ufeff")
+        if re.match(r"^set\b", stripped, re.I) and not parse_answer(stripped):
+            current = normalize_set_name(stripped)
+            continue
+        chunks.setdefault(current, []).append(line)
+    keys = {}
+    for set_name, lines in chunks.items():
+        key = parse_sectionwise_block("\n".join(lines))
+        if key:
+            if set_name is None:
+                raise ValueError("Set name required for a text key without 'Set X' headers")
+            keys[set_name] = key
+    return keys
+
+
+def parse_csv_sets(text, default_set=None):
+    """CSV either in long form (set,question,answer[,section]) or in the grid layout."""
+    rows = list(csv.reader(io.StringIO(text.lstrip("\ufeff"))))
+    if not rows:
+        return {}
+    header = [h.strip().lower() for h in rows[0]]
+    if "question" in header and "answer" in header:
+        qi, ai = header.index("question"), header.index("answer")
+        si = header.index("set") if "set" in header else None
+        keys = {}
+        for row in rows[1:]:
+            if len(row) <= max(qi, ai):
+                continue
+            set_name = normalize_set_name(row[si]) if si is not None and row[si].strip() else default_set
+            parsed = parse_answer(f"{row[qi].strip().lstrip('Qq')} - {row[ai]}")
+            if not parsed:
+                continue
+            if set_name is None:
+                raise ValueError("Set name required: add a 'set' column or pass set_name")
+            _add_answer(keys.setdefault(set_name, {}), None, *parsed)
+        return keys
+    if default_set is None:
+        raise ValueError("Set name required for a grid CSV key")
+    key = parse_grid(rows)
+    return {default_set: key} if key else {}
+
+
+def parse_xlsx_sets(data, default_set=None):
+    """Every worksheet is one set; the sheet name ('Set - A') gives the set name."""
+    import pandas as pd
+    sheets = pd.read_excel(io.BytesIO(data), sheet_name=None, header=None, dtype=str)
+    keys = {}
+    for sheet_name, frame in sheets.items():
+        key = parse_grid(frame.values.tolist())
+        if key:
+            set_name = normalize_set_name(sheet_name) if len(sheets) > 1 or not default_set else default_set
+            keys[set_name] = key
+    return keys
+
+
+def import_key_file(filename, data, default_set=None):
+    """Parse an uploaded XLSX / CSV / text file into {set_name: sectionwise_key}."""
+    ext = os.path.splitext(filename)[1].lower()
+    if default_set:
+        default_set = normalize_set_name(default_set)
+    if ext in (".xlsx", ".xlsm", ".xls"):
+        return parse_xlsx_sets(data, default_set)
+    text = data.decode("utf-8-sig") if isinstance(data, bytes) else data
+    if ext == ".csv":
+        return parse_csv_sets(text, default_set)
+    return parse_text_sets(text, default_set)
+
+
+def validate_key(key):
+    """Check a sectionwise key against the sheet layout; returns a list of issue dicts."""
+    issues = []
+    seen = set()
+    for section, answers in key.items():
+        for qlabel, ans in answers.items():
+            qnum = int(qlabel.lstrip("Qq"))
+            if not 1 <= qnum <= NUM_QUESTIONS:
+                issues.append({"question": qlabel, "section": section, "issue": "out_of_range"})
+                continue
+            expected = section_for_question(qnum)
+            if section != expected:
+                issues.append({"question": qlabel, "section": section, "issue": "wrong_section",
+                               "expected_section": expected})
+            letters = [a for a in ans.split(",") if a]
+            if not letters or any(a not in _OPTION_BITS for a in letters):
+                issues.append({"question": qlabel, "section": section, "issue": "invalid_answer",
+                               "answer": ans})
+            seen.add(qnum)
+    for qnum in range(1, NUM_QUESTIONS + 1):
+        if qnum not in seen:
+            issues.append({"question": f"Q{qnum}", "section": section_for_question(qnum), "issue": "missing"})
+    return issues
+
+
+def compile_key(key):
+    """Sectionwise key -> uint8[NUM_QUESTIONS] bitmask (bit i set = option i is correct)."""
+    bits = np.zeros(NUM_QUESTIONS, dtype=np.uint8)
+    for answers in key.values():
+        for qlabel, ans in answers.items():
+            qnum = int(qlabel.lstrip("Qq"))
+            if 1 <= qnum <= NUM_QUESTIONS:
+                for letter in ans.split(","):
+                    bits[qnum - 1] |= _OPTION_BITS.get(letter.strip().lower(), 0)
+    return bits
+
+
+def key_to_options(bits):
+    """uint8 bitmask -> bool[NUM_QUESTIONS, NUM_OPTS] option matrix."""
+    return ((bits[:, None] >> np.arange(NUM_OPTS, dtype=np.uint8)) & 1).astype(bool)
+
+
+def compiled_path(answerkey_path):
+    return os.path.splitext(answerkey_path)[0] + COMPILED_EXT
+
+
+def save_key(key_dir, set_name, key):
+    """Write answers_<SET>.json plus its precompiled .npy bitmask; returns the JSON path."""
+    fname = os.path.join(key_dir, f"answers_{set_name.upper()}.json")
+    with atomic_write(fname, "w", encoding="utf-8") as f:
+        json.dump(key, f, indent=2)
+    with atomic_write(compiled_path(fname), "wb") as f:
+        np.save(f, compile_key(key))
+    return fname
+
+
+_compiled_cache = {}
+
+
+def load_compiled_key(answerkey_path):
+    """Load the bitmask for a key JSON, compiling (and caching on disk) if it is stale or absent."""
+    npy_path = compiled_path(answerkey_path)
+    json_mtime = os.path.getmtime(answerkey_path) if os.path.exists(answerkey_path) else 0
+    npy_mtime = os.path.getmtime(npy_path) if os.path.exists(npy_path) else -1
+    cached = _compiled_cache.get(answerkey_path)
+    if cached is not None and cached[0] == (json_mtime, npy_mtime):
+        return cached[1]
+    if npy_mtime >= json_mtime:
+        bits = np.load(npy_path)
+    else:
+        with open(answerkey_path, "r", encoding="utf-8") as f:
+            bits = compile_key(json.load(f))
+        try:
+            with atomic_write(npy_path, "wb") as f:
+                np.save(f, bits)
+            npy_mtime = os.path.getmtime(npy_path)
+        except OSError:
+            pass
+    _compiled_cache[answerkey_path] = ((json_mtime, npy_mtime), bits)
+    return bits
+
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) < 2:
+        print("usage: python answer_keys.py <key.xlsx|key.csv|key.txt> [SET]")
+        sys.exit(1)
+    key_dir = os.getenv("ANSWERKEY_DIR", "answer_keys")
+    os.makedirs(key_dir, exist_ok=True)
+    with open(sys.argv[1], "rb") as f:
+        sets = import_key_file(sys.argv[1], f.read(), sys.argv[2] if len(sys.argv) > 2 else None)
+    for set_name, key in sorted(sets.items()):
+        path = save_key(key_dir, set_name, key)
+        issues = validate_key(key)
+        print(f"Set {set_name}: {sum(len(v) for v in key.values())} questions -> {path}")
+        for issue in issues:
+            print(f"  {issue['question']}: {issue['issue']}")
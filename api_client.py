@@ -0,0 +1,161 @@
+import os
+import time
+import mimetypes
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+API_BASE = os.getenv("API_BASE_URL", "http://localhost:8000")
+# (connect, read) seconds; scoring a batch can take a while, listing should not
+DEFAULT_TIMEOUT = (3.05, float(os.getenv("API_TIMEOUT", "30")))
+BATCH_TIMEOUT = (3.05, float(os.getenv("API_BATCH_TIMEOUT", "300")))
+# A full scoring queue answers 429 before doing anything, so those POSTs are safe to repeat
+BUSY_RETRIES = 2
+MAX_RETRY_AFTER = 30
+
+
+class APIError(Exception):
+    def __init__(self, status_code, detail):
+        super().__init__(f"{status_code}: {detail}")
+        self.status_code = status_code
+        self.detail = detail
+
+
+def _raise_for_status(r):
+    if not r.ok:
+        try:
+            detail = r.json().get("detail", r.text)
+        except ValueError:
+            detail = r.text
+        raise APIError(r.status_code, detail)
+
+
+class OMRClient:
+    """Thin client for the OMR API over one pooled, keep-alive requests.Session."""
+
+    def __init__(self, base_url=API_BASE, pool_size=10):
+        self.base_url = base_url.rstrip("/")
+        self.session = requests.Session()
+        # Only idempotent GETs are retried; POSTs that score sheets are not
+        retry = Retry(total=2, backoff_factor=0.2, status_forcelist=(502, 503, 504), allowed_methods=("GET",))
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._revalidated = {}  # path -> (etag, body) for listings served with an ETag
+
+    def _request(self, method, path, timeout=DEFAULT_TIMEOUT, **kwargs):
+        r = self.session.request(method, self.base_url + path, timeout=timeout, **kwargs)
+        _raise_for_status(r)
+        return r.json()
+
+    def _score(self, path, client_id=None, **kwargs):
+        """POST a scoring request, waiting out a full queue (429 + Retry-After) a few times.
+        client_id (X-Client-Id) is who the server's per-client concurrency limit counts."""
+        headers = {"X-Client-Id": client_id} if client_id else {}
+        for attempt in range(BUSY_RETRIES + 1):
+            r = self.session.post(self.base_url + path, headers=headers, timeout=BATCH_TIMEOUT, **kwargs)
+            if r.status_code != 429 or attempt == BUSY_RETRIES:
+                break
+            time.sleep(min(float(r.headers.get("Retry-After", "1")), MAX_RETRY_AFTER))
+        _raise_for_status(r)
+        return r.json()
+
+    def _get_revalidated(self, path):
+        """GET a listing, sending the last ETag; a 304 reuses the body we already have."""
+        cached = self._revalidated.get(path)
+        headers = {"If-None-Match": cached[0]} if cached else {}
+        r = self.session.get(self.base_url + path, headers=headers, timeout=DEFAULT_TIMEOUT)
+        if r.status_code == 304 and cached:
+            return cached[1]
+        _raise_for_status(r)
+        body = r.json()
+        if r.headers.get("ETag"):
+            self._revalidated[path] = (r.headers["ETag"], body)
+        return body
+
+    # answer keys / storage
+    def answer_key_sets(self):
+        return self._get_revalidated("/answer-key-sets").get("sets", [])
+
+    def csv_files(self):
+        return self._get_revalidated("/csv-files").get("files", [])
+
+    def catalog(self):
+        """{"version", "sets", "files"}; version is the token /catalog/events reports changes against."""
+        return self._request("GET", "/catalog")
+
+    def create_csv(self, filename):
+        return self._request("POST", "/create-csv", data={"filename": filename})
+
+    def create_answer_key(self, set_name, block):
+        return self._request("POST", "/create-bulk-answerkey", data={"set_name": set_name, "block": block})
+
+    def import_answer_keys(self, filename, content, set_name=None):
+        data = {"set_name": set_name} if set_name else {}
+        return self._request("POST", "/import-answerkeys", files={"file": (filename, content)}, data=data)
+
+    # scoring
+    def score_batch(self, sheets, omr_set=None, csv_filename=None, threshold_mode=None, profile=None, client_id=None):
+        """sheets: iterable of (filename, bytes, student_name, roll_no). Name, roll number and
+        omr_set may be None / "" when the server reads them from the sheets (see sheet_layout)."""
+        files, names, rolls = [], [], []
+        for filename, content, student_name, roll_no in sheets:
+            mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+            files.append(("files", (filename, content, mimetype)))
+            names.append(student_name or "")
+            rolls.append(roll_no or "")
+        data = {"student_names": names, "roll_nos": rolls}
+        if omr_set:
+            data["omr_set"] = omr_set
+        if csv_filename:
+            data["csv_filename"] = csv_filename
+        if threshold_mode:
+            data["threshold_mode"] = threshold_mode
+        if profile:
+            data["profile"] = profile
+        return self._score("/score-batch", client_id, files=files, data=data)
+
+    def score_document(self, filename, content, roster_csv=None, omr_set=None, csv_filename=None, threshold_mode=None,
+                       profile=None, client_id=None):
+        """Score a multi-page PDF / TIFF scan; roster_csv maps pages (or read roll numbers) to students."""
+        files = {"file": (filename, content, mimetypes.guess_type(filename)[0] or "application/octet-stream")}
+        if roster_csv:
+            files["roster"] = ("roster.csv", roster_csv, "text/csv")
+        data = {"omr_set": omr_set} if omr_set else {}
+        if csv_filename:
+            data["csv_filename"] = csv_filename
+        if threshold_mode:
+            data["threshold_mode"] = threshold_mode
+        if profile:
+            data["profile"] = profile
+        return self._score("/score-document", client_id, files=files, data=data)
+
+    def processing_profile(self, set_name):
+        return self._request("GET", f"/processing-profile/{set_name}")
+
+    def set_processing_profile(self, set_name, profile):
+        return self._request("POST", f"/processing-profile/{set_name}", data={"profile": profile})
+
+    def sheet_layout(self):
+        return self._request("GET", "/sheet-layout")["id_fields"]
+
+    # results
+    def results_version(self, csv_filename):
+        return self._request("GET", "/results-version", params={"csv_filename": csv_filename})["version"]
+
+    def results_page(self, csv_filename, page=1, page_size=50):
+        return self._request("GET", "/results", params={"csv_filename": csv_filename, "page": page, "page_size": page_size})
+
+    def debug_overlay(self, debug_url):
+        """PNG bytes of a submission's debug overlay (the `debug_url` of a scoring result)."""
+        r = self.session.get(self.base_url + debug_url, timeout=DEFAULT_TIMEOUT)
+        if not r.ok:
+            raise APIError(r.status_code, r.text)
+        return r.content
+
+    def analytics(self, csv_filename, set_name=None, questions=True):
+        params = {"csv_filename": csv_filename, "questions": questions}
+        if set_name:
+            params["set_name"] = set_name
+        return self._request("GET", "/analytics", params=params)
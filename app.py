@@ -1,45 +1,75 @@
 import streamlit as st
-import requests
 import pandas as pd
-import time
 import os
 import re
+import uuid
 
-# Dynamic API base URL for cloud deployment
-API_BASE = os.getenv("API_BASE_URL", "http://localhost:8000")
+from api_client import OMRClient, APIError
+
+BATCH_CHUNK = int(os.getenv("UI_BATCH_CHUNK", "4"))  # sheets per /score-batch request
+PAGE_SIZE = 50
 
 st.set_page_config(page_title="OMR Scorer Bulk", layout="centered")
 st.title("Bulk Answer Key Paste + Evaluation UI")
 
-# Function to get existing answer key sets
-@st.cache_data(ttl=5)  # Cache for 5 seconds to allow dynamic updates
+# One pooled HTTP session per Streamlit server process
+@st.cache_resource
+def get_client():
+    return OMRClient()
+
+client = get_client()
+# Sent as X-Client-Id: the server limits how many sheets one browser session scores at once
+if "client_id" not in st.session_state:
+    st.session_state.client_id = uuid.uuid4().hex
+
+# Key sets and CSV files come from the server's in-memory catalog; the client sends the
+# listing's ETag, so a rerun costs an empty 304 unless a key or CSV was actually added
 def get_answer_key_sets():
     try:
-        response = requests.get(f"{API_BASE}/answer-key-sets")
-        if response.ok:
-            return response.json().get("sets", [])
-        return []
-    except:
+        return client.answer_key_sets()
+    except Exception:
         return []
 
-# Function to get existing CSV files
-@st.cache_data(ttl=5)  # Cache for 5 seconds to allow dynamic updates
 def get_csv_files():
     try:
-        response = requests.get(f"{API_BASE}/csv-files")
-        if response.ok:
-            return response.json().get("files", [])
-        return []
-    except:
+        return client.csv_files()
+    except Exception:
         return []
 
+# Identity fields the server reads off the sheets (roll number / set code bubbles), if any
+@st.cache_data(ttl=60)
+def get_sheet_layout():
+    try:
+        return client.sheet_layout() or {}
+    except Exception:
+        return {}
+
+# Result pages and analytics only change when rows are appended, so they are cached
+# on the results version token rather than on a timer
+def get_results_version(csv_file):
+    try:
+        return client.results_version(csv_file)
+    except Exception:
+        return None
+
+@st.cache_data(max_entries=64)
+def get_results_page(csv_file, page, version):
+    return client.results_page(csv_file, page, PAGE_SIZE)
+
+# Cohort analytics maintained server-side (no CSV rescans)
+@st.cache_data(max_entries=16)
+def get_analytics(csv_file, version):
+    try:
+        return client.analytics(csv_file)
+    except Exception:
+        return {}
+
 # Display existing answer key sets at the top
 col_header, col_refresh = st.columns([4, 1])
 with col_header:
     st.header("📚 Answer Key Sets")
 with col_refresh:
     if st.button("🔄 Refresh", key="refresh_sets"):
-        get_answer_key_sets.clear()
         st.rerun()
 
 existing_sets = get_answer_key_sets()
@@ -80,7 +110,6 @@ with col_csv_header:
     st.subheader("Select CSV File for Data Storage")
 with col_csv_refresh:
     if st.button("🔄 Refresh", key="refresh_csv"):
-        get_csv_files.clear()
         st.rerun()
 
 # Show current selection
@@ -126,19 +155,13 @@ if st.session_state.show_create_csv:
         if st.button("💾 Create & Use", key="save_csv_btn"):
             if new_csv_name.strip():
                 try:
-                    response = requests.post(
-                        f"{API_BASE}/create-csv",
-                        data={"filename": new_csv_name.strip()}
-                    )
-                    if response.ok:
-                        created_file = response.json()["filename"]
-                        st.session_state.selected_csv_file = created_file
-                        st.session_state.show_create_csv = False
-                        get_csv_files.clear()  # Clear cache to refresh list
-                        st.success(f"✅ CSV file '{created_file}' created and selected!")
-                        st.rerun()
-                    else:
-                        st.error(f"❌ Error: {response.text}")
+                    created_file = client.create_csv(new_csv_name.strip())["filename"]
+                    st.session_state.selected_csv_file = created_file
+                    st.session_state.show_create_csv = False
+                    st.success(f"✅ CSV file '{created_file}' created and selected!")
+                    st.rerun()
+                except APIError as e:
+                    st.error(f"❌ Error: {e.detail}")
                 except Exception as e:
                     st.error(f"❌ Error creating CSV: {str(e)}")
             else:
@@ -165,19 +188,14 @@ if st.session_state.get("show_add_form", False):
             if not set_name or not answer_key_block.strip():
                 st.error("Provide set and paste block.")
             else:
-                res = requests.post(
-                    f"{API_BASE}/create-bulk-answerkey",
-                    data={"set_name": set_name.upper(), "block": answer_key_block}
-                )
-                if res.ok:
-                    st.success(res.json()["message"])
-                    # Clear cache to refresh the sets list
-                    get_answer_key_sets.clear()
+                try:
+                    res = client.create_answer_key(set_name.upper(), answer_key_block)
+                    st.success(res["message"])
                     # Hide the form after successful save
                     st.session_state.show_add_form = False
                     st.rerun()
-                else:
-                    st.error(res.text)
+                except APIError as e:
+                    st.error(e.detail)
     
     with col2:
         if st.button("Cancel", key="cancel_add"):
@@ -186,104 +204,148 @@ if st.session_state.get("show_add_form", False):
 
 st.markdown("---")
 
-st.header("Step 2: Upload OMR Sheet and Score")
-student_name = st.text_input("Student Name")
-roll_no = st.text_input("Roll No")
+st.header("Step 2: Upload OMR Sheets and Score")
 
 # Show available sets in dropdown
+id_fields = get_sheet_layout()
 if existing_sets:
-    sel_set = st.selectbox("Select OMR Set", existing_sets, key="omr_set_select")
-    key_exists = True  # All sets in dropdown exist
+    set_options = (["Read from sheet"] if "set_code" in id_fields else []) + existing_sets
+    sel_set = st.selectbox("Select OMR Set", set_options, key="omr_set_select")
 else:
     st.warning("No answer key sets available. Please add an answer key set first.")
     sel_set = None
-    key_exists = False
 
-omr_file = st.file_uploader("Upload OMR Sheet", type=["jpg", "jpeg", "png"])
+threshold_mode = st.radio(
+    "Bubble threshold", ["fixed", "adaptive", "local"], horizontal=True,
+    help="fixed: global cutoffs. adaptive: fit this sheet's fill distribution. "
+         "local: adaptive after correcting for uneven lighting (best for dark or shadowed scans)."
+)
+
+profile = st.radio(
+    "Processing profile", ["set default", "fast", "balanced", "accurate"], horizontal=True,
+    help="fast: quickest read, for checking a capture. balanced: the standard path. accurate: full "
+         "resolution and a fit of the printed bubble layout, for final grading (slower)."
+)
+
+omr_files = st.file_uploader("Upload OMR Sheets", type=["jpg", "jpeg", "png"], accept_multiple_files=True)
+
+students = None
+if omr_files:
+    # Prefill name / roll from "<Name>_<Roll>.jpg" style filenames; editable per sheet
+    rows = []
+    for f in omr_files:
+        stem = os.path.splitext(f.name)[0]
+        name, _, roll = stem.rpartition("_")
+        default_name = "" if "roll_no" in id_fields else stem
+        rows.append({"File": f.name, "Student Name": name.replace("_", " ") if name else default_name,
+                     "Roll No": roll if name else ""})
+    if "roll_no" in id_fields:
+        st.caption("Roll numbers are read from the sheets: leave blank, or fill in to override.")
+    else:
+        st.caption("Check student details for each sheet:")
+    students = st.data_editor(pd.DataFrame(rows), disabled=["File"], hide_index=True, use_container_width=True)
 
 if st.button("Save OMR & Score"):
-    if not (student_name and roll_no and sel_set and omr_file):
-        st.error("Fill all fields and upload.")
-    elif not key_exists:
-        st.error(f"No answer key for set {sel_set.upper()}. Paste key first.")
+    if not (sel_set and omr_files):
+        st.error("Select a set and upload at least one sheet.")
     elif not st.session_state.selected_csv_file:
         st.error("⚠️ Please select a CSV file for data storage above.")
+    elif "roll_no" not in id_fields and ((students["Student Name"].str.strip() == "").any()
+                                         or (students["Roll No"].astype(str).str.strip() == "").any()):
+        st.error("Fill student name and roll number for every sheet.")
     else:
         # normalize set (remove leading "Set " if present) to match backend filenames
-        norm_set = re.sub(r'^(set\s*)', '', sel_set.strip(), flags=re.I).upper()
-        # determine mime type from uploaded file or fallback by extension
-        mimetype = getattr(omr_file, "type", None) or ("image/" + os.path.splitext(omr_file.name)[1].lstrip('.').lower())
-        files = {"file": (omr_file.name, omr_file.read(), mimetype)}
-        data = {"student_name": student_name, "roll_no": roll_no, "omr_set": norm_set}
-        r = requests.post(API_BASE + "/upload-omr", files=files, data=data)
-        if not r.ok:
-            st.error("Failed to save OMR: " + r.text)
-        else:
-            # Prepare evaluation data with selected CSV file
-            evaldata = {
-                "student_name": student_name,
-                "roll_no": roll_no,
-                "omr_set": norm_set,
-                "csv_filename": st.session_state.selected_csv_file
-            }
-            evalres = requests.post(API_BASE + "/evaluate", data=evaldata)
-            if evalres.ok:
-                data = evalres.json()
-                score = data.get("score", "N/A")
-                percentage = data.get("percentage", "N/A")
-                section_scores = data.get("section_scores", {})
-                csv_file = data.get("csv_file", "scores.csv")
-                
-                st.success(f"✅ OMR scored successfully!")
-                st.info(f"📊 **Total Score:** {score}/100 | **Percentage:** {percentage}% | **Set:** {sel_set.upper()}")
-                st.info(f"💾 **Data saved to:** {csv_file}")
-                
-                if section_scores:
-                    st.subheader("📈 Section-wise Scores")
-                    # Create a nice table for section scores
-                    section_data = {
-                        "Subject": list(section_scores.keys()),
-                        "Marks": list(section_scores.values())
-                    }
-                    st.table(section_data)
-            else:
-                st.error("Scoring error: " + evalres.text)
+        norm_set = None if sel_set == "Read from sheet" else re.sub(r'^(set\s*)', '', sel_set.strip(), flags=re.I).upper()
+        sheets = [(f.name, f.getvalue(), str(r["Student Name"]).strip(), str(r["Roll No"]).strip())
+                  for f, (_, r) in zip(omr_files, students.iterrows())]
+        progress = st.progress(0.0, text=f"Scoring 0/{len(sheets)} sheets...")
+        results = []
+        for start in range(0, len(sheets), BATCH_CHUNK):
+            chunk = sheets[start:start + BATCH_CHUNK]
+            try:
+                results.extend(client.score_batch(chunk, norm_set, st.session_state.selected_csv_file,
+                                                  threshold_mode, None if profile == "set default" else profile,
+                                                  client_id=st.session_state.client_id)["results"])
+            except Exception as e:
+                results.extend({"ok": False, "filename": sheet[0], "name": sheet[2], "roll_no": sheet[3], "error": str(e)} for sheet in chunk)
+            done = min(start + BATCH_CHUNK, len(sheets))
+            progress.progress(done / len(sheets), text=f"Scoring {done}/{len(sheets)} sheets...")
+        
+        scored = [r for r in results if r.get("ok")]
+        failed = [r for r in results if not r.get("ok")]
+        if scored:
+            st.success(f"✅ {len(scored)} OMR sheet(s) scored successfully! | **Set:** "
+                       f"{', '.join(sorted({r['set'] for r in scored}))}")
+            st.info(f"💾 **Data saved to:** {scored[0].get('csv_file', 'scores.csv')}")
+            table = pd.DataFrame([
+                dict({"Student Name": r["name"], "Roll No": r["roll_no"]}, **r.get("section_scores", {}),
+                     **{"Out of": r.get("total_possible"), "Percentage": r.get("percentage")})
+                for r in scored
+            ])
+            st.subheader("📈 Section-wise Scores")
+            st.dataframe(table, use_container_width=True, hide_index=True)
+            low_margin = [r for r in scored if (r.get("detection") or {}).get("margin") is not None
+                          and r["detection"]["margin"] < 0.05]
+            for r in low_margin:
+                st.warning(f"Check {r['name']} ({r['roll_no']}): marked and blank bubbles are hard to tell apart "
+                           f"(margin {r['detection']['margin']}). Consider rescanning or another threshold mode.")
+                with st.expander(f"What the scanner saw: {r['name']} ({r['roll_no']})"):
+                    try:
+                        st.image(client.debug_overlay(r["debug_url"]), use_column_width=True)
+                    except Exception as e:
+                        st.error(f"Could not load debug overlay: {e}")
+        for r in failed:
+            st.error(f"Scoring error for {r.get('filename')}: {r.get('error')}")
 
 st.markdown("---")
 st.header("📋 Results Dashboard")
 
 # Show results from selected CSV file
 if st.session_state.selected_csv_file:
-    st.subheader(f"Results from: {st.session_state.selected_csv_file}")
-    try:
-        # Read the selected CSV file
-        csv_path = f"uploaded_omr/{st.session_state.selected_csv_file}"
-        if os.path.exists(csv_path):
-            table = pd.read_csv(csv_path)
-            if not table.empty:
-                st.dataframe(table, use_container_width=True)
+    csv_file = st.session_state.selected_csv_file
+    st.subheader(f"Results from: {csv_file}")
+    version = get_results_version(csv_file)
+    if version is None:
+        st.error("Could not reach the API to load results.")
+    else:
+        try:
+            first = get_results_page(csv_file, 1, version)
+            total_rows = first["total_rows"]
+            if total_rows:
+                pages = max(1, -(-total_rows // PAGE_SIZE))
+                page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, value=1, step=1) if pages > 1 else 1
+                data = first if page == 1 else get_results_page(csv_file, int(page), version)
+                st.dataframe(pd.DataFrame(data["rows"], columns=data["columns"]), use_container_width=True)
                 
-                # Show summary statistics
-                if len(table) > 0:
+                # Summary statistics come from the API's running aggregates
+                stats = get_analytics(csv_file, version)
+                overall = stats.get("overall", {})
+                if overall.get("students"):
                     st.subheader("📊 Summary Statistics")
                     col1, col2, col3, col4 = st.columns(4)
                     
                     with col1:
-                        st.metric("Total Students", len(table))
+                        st.metric("Total Students", overall["students"])
                     with col2:
-                        avg_score = table['Marks Obtained'].mean()
-                        st.metric("Average Score", f"{avg_score:.1f}")
+                        st.metric("Average Score", f"{overall['mean']:.1f}")
                     with col3:
-                        max_score = table['Marks Obtained'].max()
-                        st.metric("Highest Score", f"{max_score}")
+                        st.metric("Highest Score", f"{overall['highest']}")
                     with col4:
-                        min_score = table['Marks Obtained'].min()
-                        st.metric("Lowest Score", f"{min_score}")
+                        st.metric("Lowest Score", f"{overall['lowest']}")
+                    st.caption("Percentiles: " + ", ".join(f"{k}={v}" for k, v in overall.get("percentiles", {}).items()))
+                    
+                    for set_name, set_stats in stats.get("sets", {}).items():
+                        with st.expander(f"🔍 Item analysis – Set {set_name}"):
+                            items = pd.DataFrame([
+                                dict(Question=q["question"], Key=q["key"], Difficulty=q["difficulty"],
+                                     Discrimination=q["discrimination"], Blank=q["blank"],
+                                     **{f"Chose {o.upper()}": v for o, v in q["options"].items()})
+                                for q in set_stats.get("questions", [])
+                            ])
+                            st.dataframe(items, use_container_width=True)
             else:
                 st.info("No data found in the selected CSV file.")
-        else:
-            st.warning(f"CSV file '{st.session_state.selected_csv_file}' not found.")
-    except Exception as e:
-        st.error(f"Error reading CSV file: {str(e)}")
+        except Exception as e:
+            st.error(f"Error loading results: {str(e)}")
 else:
     st.info("Please select a CSV file above to view results.")
@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+"""Benchmarks for the OMR service.
+
+    python benchmark.py                 # all sections
+    python benchmark.py --only startup  # one section
+    python benchmark.py --json bench.json
+
+Sections:
+  startup   import time of main.py and a cold uvicorn start: time to /health (live),
+            /ready (scoring workers warm) and to the first scored sheet
+  detection per-sheet detection latency over the bundled data/ images
+  scoring   vectorized scoring cost per sheet, single sheet vs. cohort, bool tensors vs.
+            packed response bits
+  threshold cost of each fill threshold mode and the margin it achieves per sheet
+  profiles  per-sheet latency of each processing profile (fast / balanced / accurate) and
+            how often its reading agrees with the accurate one, question by question
+  synthetic rendered sheets with known answers (synthetic.py): per distortion preset, the
+            share of questions read as marked, sheets rejected and detection latency
+  columnar  percentiles and item analysis of 100k students from the columnar results
+            store vs. parsing an equivalent results CSV, and the cost of compacting it
+  memory    peak RSS added by detecting one sheet (fresh warm process per sheet), for a
+            typical scan, the largest bundled photo and a synthetic 20 MP photo, with
+            and without reduced-resolution decode
+"""
+import os
+import sys
+import json
+import glob
+import time
+import socket
+import argparse
+import tempfile
+import subprocess
+import statistics
+import urllib.request
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(ROOT, "data")
+KEY_XLSX = os.path.join(DATA_DIR, "Key (Set A and B).xlsx")
+
+
+def sample_images(limit=None):
+    images = sorted(glob.glob(os.path.join(DATA_DIR, "Set *", "*.jpeg")))
+    return images[:limit] if limit else images
+
+
+def _summary(samples_ms):
+    samples_ms = sorted(samples_ms)
+    return {
+        "n": len(samples_ms),
+        "mean_ms": round(statistics.fmean(samples_ms), 2),
+        "p50_ms": round(samples_ms[len(samples_ms) // 2], 2),
+        "p95_ms": round(samples_ms[min(len(samples_ms) - 1, int(len(samples_ms) * 0.95))], 2),
+        "max_ms": round(samples_ms[-1], 2)
+    }
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_for(url, deadline):
+    while time.perf_counter() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as r:
+                if r.status == 200:
+                    return time.perf_counter()
+        except Exception:
+            pass
+        time.sleep(0.02)
+    return None
+
+
+def _post_multipart(url, fields, files, timeout=120):
+    boundary = "----omrbench%d" % int(time.time() * 1000)
+    body = b""
+    for name, value in fields:
+        body += f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+    for name, filename, content in files:
+        body += (f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                 f'Content-Type: application/octet-stream\r\n\r\n').encode() + content + b"\r\n"
+    body += f"--{boundary}--\r\n".encode()
+    req = urllib.request.Request(url, data=body, headers={"Content-Type": f"multipart/form-data; boundary={boundary}"})
+    with urllib.request.urlopen(req, timeout=timeout) as r:
+        return json.loads(r.read())
+
+
+def bench_startup():
+    tmp = tempfile.mkdtemp(prefix="omr_bench_")
+    env = dict(os.environ, UPLOAD_DIR=os.path.join(tmp, "up"), ANSWERKEY_DIR=os.path.join(tmp, "keys"))
+    code = ("import time, sys; t = time.perf_counter(); import main; "
+            "print(time.perf_counter() - t, 'cv2' in sys.modules)")
+    out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    import_s, cv2_loaded = out.stdout.split()
+    result = {"import_main_ms": round(float(import_s) * 1000, 1), "cv2_loaded_by_api": cv2_loaded == "True"}
+
+    port = _free_port()
+    base = f"http://127.0.0.1:{port}"
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port)],
+                            cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = start + 120
+        live = _wait_for(base + "/health", deadline)
+        ready = _wait_for(base + "/ready", deadline)
+        with open(KEY_XLSX, "rb") as f:
+            _post_multipart(base + "/import-answerkeys", [], [("file", "key.xlsx", f.read())])
+        image = sample_images(1)[0]
+        with open(image, "rb") as f:
+            content = f.read()
+        _post_multipart(base + "/score-batch",
+                        [("omr_set", "A"), ("student_names", "Bench"), ("roll_nos", "1"), ("csv_filename", "bench.csv")],
+                        [("files", os.path.basename(image), content)])
+        first_score = time.perf_counter()
+        result.update({
+            "time_to_live_ms": round((live - start) * 1000, 1) if live else None,
+            "time_to_ready_ms": round((ready - start) * 1000, 1) if ready else None,
+            "time_to_first_scored_sheet_ms": round((first_score - start) * 1000, 1)
+        })
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+    return result
+
+
+def bench_detection(repeat=1):
+    from omr_scoring import detect_responses
+    samples = []
+    failures = 0
+    for _ in range(repeat):
+        for path in sample_images():
+            t = time.perf_counter()
+            try:
+                detect_responses(path)
+            except Exception:
+                failures += 1
+            samples.append((time.perf_counter() - t) * 1000)
+    result = _summary(samples)
+    result["failures"] = failures
+    result["sheets_per_sec"] = round(1000 / result["mean_ms"], 1)
+    return result
+
+
+def bench_scoring(cohort=10000):
+    import numpy as np
+    from answer_keys import import_key_file, compile_key
+    from scoring_engine import score_responses
+    from responses import ResponseCohort, pack_bits
+    with open(KEY_XLSX, "rb") as f:
+        key_bits = compile_key(import_key_file(KEY_XLSX, f.read())["A"])
+    rng = np.random.default_rng(0)
+    responses = rng.random((cohort, 100, 4)) < 0.3
+    scheme = {"negative": 0.25, "multi_answer": "partial"}
+    t = time.perf_counter()
+    for i in range(200):
+        score_responses(responses[i], key_bits, scheme)
+    single_us = (time.perf_counter() - t) / 200 * 1e6
+    t = time.perf_counter()
+    score_responses(responses, key_bits, scheme)
+    cohort_us = (time.perf_counter() - t) / cohort * 1e6
+    packed = ResponseCohort.from_bits(pack_bits(responses))
+    t = time.perf_counter()
+    score_responses(packed, key_bits, scheme)
+    packed_us = (time.perf_counter() - t) / cohort * 1e6
+    return {"single_sheet_us": round(single_us, 1), "cohort_per_sheet_us": round(cohort_us, 2),
+            "packed_cohort_per_sheet_us": round(packed_us, 2), "cohort_size": cohort,
+            "bytes_per_sheet": {"bool": responses[0].nbytes, "packed": packed[0].bits.nbytes}}
+
+
+def bench_threshold():
+    from omr_scoring import measure_fills
+    from thresholding import THRESHOLD_MODES, classify_fills
+    fills = []
+    for path in sample_images():
+        try:
+            fills.append(measure_fills(path)[:2])
+        except Exception:
+            pass
+    result = {"sheets": len(fills)}
+    for mode in THRESHOLD_MODES:
+        t = time.perf_counter()
+        infos = [classify_fills(mean_val, black_ratio, mode)[1] for mean_val, black_ratio in fills]
+        margins = sorted(info["margin"] for info in infos if info["margin"] is not None)
+        result[mode] = {
+            "us_per_sheet": round((time.perf_counter() - t) / max(len(fills), 1) * 1e6, 1),
+            "min_margin": margins[0] if margins else None,
+            "median_margin": margins[len(margins) // 2] if margins else None,
+            "sheets_margin_below_0.05": sum(m < 0.05 for m in margins)
+        }
+    return result
+
+
+def bench_profiles(repeat=3):
+    # data/ has no hand-labelled answers, so the accurate profile's reading is the reference
+    from omr_scoring import read_sheet
+    from profiles import PROFILES
+    images = sample_images()
+    read_sheet(images[0])  # warm up
+    readings, result = {}, {}
+    for name in PROFILES:
+        samples, failures = [], 0
+        for path in images:
+            best = None
+            for _ in range(repeat):
+                t = time.perf_counter()
+                try:
+                    readings[name, path] = read_sheet(path, profile=name)[0]
+                except Exception:
+                    readings[name, path] = None
+                elapsed = (time.perf_counter() - t) * 1000
+                best = elapsed if best is None else min(best, elapsed)
+            samples.append(best)
+            failures += readings[name, path] is None
+        result[name] = dict(_summary(samples), failures=failures)
+    for name in PROFILES:
+        agree = [(readings[name, p] == readings["accurate", p]).all(axis=1).mean() for p in images
+                 if readings[name, p] is not None and readings["accurate", p] is not None]
+        result[name].update({
+            "questions_agreeing_with_accurate": round(statistics.fmean(agree), 4) if agree else None,
+            "sheets_identical_to_accurate": int(sum(a == 1 for a in agree))
+        })
+    return result
+
+
+# Run in a fresh interpreter per sheet. The kernel's peak RSS (VmHWM) is reset after
+# warm-up (Linux: /proc/self/clear_refs), so its growth past the warmed-up baseline is
+# the peak memory one sheet needed; import-time peaks would otherwise mask it.
+_RSS_CHILD = """
+import sys, json
+sys.path.insert(0, %r)
+from scoring_workers import warm_up, detect_image
+
+def status_mb(field):
+    with open("/proc/self/status") as f:
+        return next(int(line.split()[1]) for line in f if line.startswith(field)) / 1024
+
+warm_up()
+with open("/proc/self/clear_refs", "w") as f:
+    f.write("5")
+before = status_mb("VmRSS:")
+detect_image(sys.argv[1])
+print(json.dumps({"baseline_mb": before, "peak_delta_mb": status_mb("VmHWM:") - before}))
+""" % ROOT
+
+
+def _sheet_peak_rss(path, reduced=True):
+    env = dict(os.environ, OMR_REDUCED_DECODE="1" if reduced else "0")
+    out = subprocess.run([sys.executable, "-c", _RSS_CHILD, path], env=env, capture_output=True,
+                         text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def bench_memory():
+    import cv2
+    from image_io import image_size, estimate_sheet_bytes
+    images = sample_images()
+    largest = max(images, key=lambda p: image_size(p)[0] * image_size(p)[1])
+    sheets = {"typical": images[0], "largest": largest}
+    with tempfile.TemporaryDirectory() as tmp:
+        # an upscaled phone photo, as a 20 MP camera would send it
+        img = cv2.imread(largest)
+        scale = (20e6 / (img.shape[0] * img.shape[1])) ** 0.5
+        sheets["synthetic_20mp"] = os.path.join(tmp, "sheet_20mp.jpeg")
+        cv2.imwrite(sheets["synthetic_20mp"], cv2.resize(img, None, fx=scale, fy=scale), [cv2.IMWRITE_JPEG_QUALITY, 90])
+        del img
+        result = {}
+        for name, path in sheets.items():
+            w, h = image_size(path)
+            entry = {"pixels": f"{w}x{h}", "file_mb": round(os.path.getsize(path) / 2**20, 2),
+                     "estimate_mb": round(estimate_sheet_bytes(path) / 2**20, 1)}
+            for reduced in (False, True):
+                rss = _sheet_peak_rss(path, reduced)
+                entry["peak_rss_mb_" + ("reduced" if reduced else "full")] = round(rss["peak_delta_mb"], 1)
+            entry["worker_baseline_mb"] = round(rss["baseline_mb"], 1)
+            result[name] = entry
+    return result
+
+
+def bench_synthetic(sheets=100):
+    # unlike data/, rendered sheets have ground truth: accuracy, not agreement with accurate
+    import synthetic
+    result = {}
+    for preset in synthetic.PRESETS:
+        report = synthetic.evaluate(sheets, synthetic.distortions(preset))
+        result[preset] = {"sheets": sheets, "rejected": sum(report["failed"].values()),
+                          "question_accuracy": report["question_accuracy"],
+                          "sheets_exact": report["sheets_exact"], "detect_p50_ms": report["detect_ms"]["p50_ms"],
+                          "detect_p95_ms": report["detect_ms"]["p95_ms"]}
+    return result
+
+
+def bench_columnar(students=100000):
+    import csv
+    import numpy as np
+    from answer_keys import import_key_file, compile_key
+    from columnar import ColumnarStore, ROW_DTYPE
+    from results import CSV_HEADERS
+    from scoring_engine import SECTION_NAMES, score_responses
+    with open(KEY_XLSX, "rb") as f:
+        key_bits = compile_key(import_key_file(KEY_XLSX, f.read())["A"])
+    rng = np.random.default_rng(0)
+    bits = np.packbits(rng.random((students, 100, 4)) < 0.3, axis=-1, bitorder="little")[..., 0]
+    scored = score_responses(bits, key_bits)
+    rows = np.zeros(students, dtype=ROW_DTYPE)
+    rows["roll"] = np.char.encode(np.arange(students).astype(str))
+    rows["bits"], rows["sections"], rows["total"] = bits, scored["section_scores"], scored["total"]
+    rows["max_total"] = scored["max_total"]
+    with tempfile.TemporaryDirectory() as tmp:
+        store = ColumnarStore(os.path.join(tmp, "columnar"))
+        store.append("exam.csv", "A", "warm", bits[0], score_responses(bits[0], key_bits))
+        with open(os.path.join(store._dir("exam.csv", "A"), "delta.rec"), "ab") as f:
+            f.write(rows.tobytes())
+        t = time.perf_counter()
+        store.compact("exam.csv", "A")
+        compact_ms = (time.perf_counter() - t) * 1000
+        csv_path = os.path.join(tmp, "exam.csv")
+        with open(csv_path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(CSV_HEADERS)
+            for i in range(students):
+                writer.writerow([f"S{i}", i] + rows["sections"][i].tolist() + [rows["total"][i], 100, 0, "A"])
+
+        def timed(fn, repeat=3):
+            best = None
+            for _ in range(repeat):
+                t = time.perf_counter()
+                fn()
+                best = min(best or 1e9, (time.perf_counter() - t) * 1000)
+            return round(best, 1)
+
+        def csv_percentiles():
+            with open(csv_path, newline="") as f:
+                totals = [float(r[len(SECTION_NAMES) + 2]) for r in list(csv.reader(f))[1:]]
+            np.percentile(totals, [10, 25, 50, 75, 90])
+
+        return {
+            "students": students,
+            "compact_ms": round(compact_ms, 1),
+            "csv_percentiles_ms": timed(csv_percentiles),
+            "columnar_percentiles_ms": timed(lambda: np.percentile(store.read("exam.csv", "A", ("total",))["total"],
+                                                                   [10, 25, 50, 75, 90])),
+            "columnar_item_analysis_ms": timed(lambda: store.aggregate("exam.csv", "A", key_bits).summary())
+        }
+
+
+SECTIONS = {
+    "startup": bench_startup,
+    "detection": bench_detection,
+    "scoring": bench_scoring,
+    "threshold": bench_threshold,
+    "profiles": bench_profiles,
+    "synthetic": bench_synthetic,
+    "columnar": bench_columnar,
+    "memory": bench_memory
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--only", action="append", choices=sorted(SECTIONS), help="run only these sections")
+    parser.add_argument("--json", help="also write results to this JSON file")
+    args = parser.parse_args(argv)
+    results = {}
+    for name in args.only or SECTIONS:
+        results[name] = SECTIONS[name]()
+        print(f"[{name}]")
+        for k, v in results[name].items():
+            print(f"  {k}: {v}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+import os
+import shutil
+import hashlib
+import tempfile
+import threading
+
+from submissions import file_sha256
+
+
+class LocalBlobStore:
+    """Content-addressed files under <root>/<sha[:2]>/<sha>. Point every node at the same
+    shared volume and any worker can read any uploaded sheet by its hash."""
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, sha):
+        return os.path.join(self.root, sha[:2], sha)
+
+    def exists(self, sha):
+        return os.path.exists(self.path(sha))
+
+    def put_file(self, src, sha=None):
+        """Store a file by content hash; hard links instead of copying when possible."""
+        sha = sha or file_sha256(src)
+        dest = self.path(sha)
+        if os.path.exists(dest):
+            return sha
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        tmp = f"{dest}.{os.getpid()}.{threading.get_ident()}.part"
+        try:
+            os.link(src, tmp)
+        except OSError:
+            shutil.copyfile(src, tmp)
+        os.replace(tmp, dest)
+        return sha
+
+    def put(self, data):
+        sha = hashlib.sha256(data).hexdigest()
+        if not self.exists(sha):
+            os.makedirs(os.path.dirname(self.path(sha)), exist_ok=True)
+            tmp = f"{self.path(sha)}.{os.getpid()}.{threading.get_ident()}.part"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, self.path(sha))
+        return sha
+
+    def get(self, sha):
+        with open(self.path(sha), "rb") as f:
+            return f.read()
+
+    def local_path(self, sha):
+        """A readable file path for the blob (what OpenCV needs)."""
+        if not self.exists(sha):
+            raise FileNotFoundError(f"blob {sha} not found")
+        return self.path(sha)
+
+
+class MemoryBlobStore:
+    """In-process stand-in for a shared object store."""
+
+    def __init__(self):
+        self._blobs = {}
+        self._cache_dir = None
+
+    def exists(self, sha):
+        return sha in self._blobs
+
+    def put_file(self, src, sha=None):
+        with open(src, "rb") as f:
+            data = f.read()
+        return self.put(data)
+
+    def put(self, data):
+        sha = hashlib.sha256(data).hexdigest()
+        self._blobs.setdefault(sha, data)
+        return sha
+
+    def get(self, sha):
+        try:
+            return self._blobs[sha]
+        except KeyError:
+            raise FileNotFoundError(f"blob {sha} not found")
+
+    def local_path(self, sha):
+        """Materialise the blob in a per-store temp dir, as a remote store's workers would."""
+        if self._cache_dir is None:
+            self._cache_dir = tempfile.mkdtemp(prefix="omr_blobs_")
+        path = os.path.join(self._cache_dir, sha)
+        if not os.path.exists(path):
+            with open(path + ".part", "wb") as f:
+                f.write(self.get(sha))
+            os.replace(path + ".part", path)
+        return path
+
+
+_BACKENDS = {}
+_memory_stores = {}
+
+
+def register_backend(scheme, factory):
+    _BACKENDS[scheme] = factory
+
+
+register_backend("file", LocalBlobStore)
+register_backend("memory", lambda name: _memory_stores.setdefault(name or "default", MemoryBlobStore()))
+
+
+def open_blob_store(url):
+    """file:///abs/dir, file://relative/dir or memory://<name>."""
+    scheme, sep, rest = url.partition("://")
+    if not sep or scheme not in _BACKENDS:
+        raise ValueError(f"Unknown blob store {url!r}; known schemes: {', '.join(sorted(_BACKENDS))}")
+    return _BACKENDS[scheme](rest)
@@ -0,0 +1,137 @@
+"""In-memory catalog of answer key sets and result CSVs.
+
+The API updates it as keys and CSVs are created; a watcher thread stats the two
+directories and rescans only when one of them changed (keys copied in by hand, another
+API process appending to a new CSV). Each listing carries a content hash, used as its
+ETag and as the version token of the change stream, so it is the same on every replica
+and survives restarts.
+"""
+import os
+import asyncio
+import hashlib
+import threading
+
+# How often the watcher checks the directories for changes made outside this process
+CATALOG_POLL_SECONDS = float(os.getenv("OMR_CATALOG_POLL_SECONDS", "2"))
+
+
+def _token(*listings):
+    h = hashlib.sha1()
+    for items in listings:
+        h.update("\n".join(items).encode())
+        h.update(b"\0")
+    return h.hexdigest()[:16]
+
+
+class Catalog:
+    """Sorted key set names ("sets") and result CSV names ("files"), with change tokens."""
+
+    def __init__(self, answerkey_dir, upload_dir, poll_seconds=CATALOG_POLL_SECONDS):
+        self.answerkey_dir = answerkey_dir
+        self.upload_dir = upload_dir
+        self.poll_seconds = poll_seconds
+        self._lock = threading.Lock()
+        self._listings = {"sets": (), "files": ()}
+        self._tokens = {"sets": _token(()), "files": _token(())}
+        self.version = _token((), ())
+        self._waiters = set()
+        self._mtimes = None
+        self._stop = threading.Event()
+        self._thread = None
+        self.rescan()
+
+    def _dir_mtimes(self):
+        mtimes = []
+        for path in (self.answerkey_dir, self.upload_dir):
+            try:
+                mtimes.append(os.stat(path).st_mtime_ns)
+            except FileNotFoundError:
+                mtimes.append(None)
+        return mtimes
+
+    def _scan(self):
+        sets, files = [], []
+        if os.path.isdir(self.answerkey_dir):
+            for filename in os.listdir(self.answerkey_dir):
+                if filename.startswith("answers_") and filename.endswith(".json"):
+                    sets.append(filename[len("answers_"):-len(".json")])
+        if os.path.isdir(self.upload_dir):
+            files = [f for f in os.listdir(self.upload_dir) if f.endswith(".csv")]
+        return sets, files
+
+    def rescan(self):
+        """Re-list both directories; a no-op for clients unless something changed."""
+        # stat first: a file added while listing moves the mtime again and is picked up next poll
+        mtimes = self._dir_mtimes()
+        sets, files = self._scan()
+        self._mtimes = mtimes
+        self._update({"sets": sets, "files": files})
+
+    def add(self, kind, name):
+        """Record a key set or CSV created by this process; cheap when it is already listed."""
+        if name not in self._listings[kind]:
+            self._update({kind: (name,)}, merge=True)
+
+    def _update(self, listings, merge=False):
+        with self._lock:
+            changed = False
+            for kind, items in listings.items():
+                items = set(items) | set(self._listings[kind]) if merge else set(items)
+                items = tuple(sorted(items))
+                if items != self._listings[kind]:
+                    self._listings[kind] = items
+                    self._tokens[kind] = _token(items)
+                    changed = True
+            if not changed:
+                return
+            self.version = _token(self._listings["sets"], self._listings["files"])
+            waiters, self._waiters = self._waiters, set()
+        for loop, event in waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    def listing(self, kind):
+        """(names, etag) for "sets" or "files"."""
+        with self._lock:
+            return list(self._listings[kind]), f'"{kind}-{self._tokens[kind]}"'
+
+    def snapshot(self):
+        with self._lock:
+            return self._snapshot()
+
+    def _snapshot(self):
+        return {"version": self.version, "sets": list(self._listings["sets"]),
+                "files": list(self._listings["files"])}
+
+    async def wait(self, version, timeout):
+        """Snapshot as soon as the catalog differs from version, or after timeout seconds."""
+        event = asyncio.Event()
+        waiter = (asyncio.get_running_loop(), event)
+        with self._lock:
+            if self.version != version:
+                return self._snapshot()
+            self._waiters.add(waiter)
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self._lock:
+                self._waiters.discard(waiter)
+        return self.snapshot()
+
+    def start(self):
+        if self._thread is None and self.poll_seconds > 0:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._watch, name="catalog-watcher", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _watch(self):
+        while not self._stop.wait(self.poll_seconds):
+            if self._dir_mtimes() != self._mtimes:
+                self.rescan()
@@ -0,0 +1,232 @@
+"""Columnar results store: detected answers and scores per exam (results CSV) and set.
+
+Each column is an .npy file opened memory-mapped, so cohort-scale analytics read only the
+columns they need and parse nothing. Layout under <root>/<exam>/<SET>/:
+
+  delta.rec          rows appended as sheets are scored (fixed-size records)
+  seg-<n>/<col>.npy  immutable column segments written by compaction
+
+Compaction folds the delta log, and any newer segments not much larger than it, into one
+segment (size-tiered, so each row is rewritten a logarithmic number of times) and drops
+rows superseded by a rescan of the same roll number. Readers see segments then the delta
+and keep the latest row per roll number, so results are the same before and after.
+The CSVs and the submission log stay the source of truth: `python columnar.py rebuild`
+refills the store from the log.
+"""
+import os
+import re
+import json
+import shutil
+
+import numpy as np
+
+from omr_layout import NUM_QUESTIONS
+from scoring_engine import SECTION_NAMES, score_responses
+from responses import as_bits
+from analytics import SetAggregate
+from job_store import file_lock
+
+ROW_DTYPE = np.dtype([
+    ("roll", "S64"),                                  # roll number, utf-8
+    ("bits", np.uint8, (NUM_QUESTIONS,)),             # marked options, see responses.py
+    ("sections", np.float32, (len(SECTION_NAMES),)),  # section marks when scored
+    ("total", np.float32),
+    ("max_total", np.float32),
+])
+COLUMNS = ROW_DTYPE.names
+# Compact once this many rows sit in a set's delta log
+COMPACT_ROWS = int(os.getenv("OMR_COLUMNAR_COMPACT_ROWS", "2048"))
+# A segment joins a compaction while it is at most this many times the rows merged so far
+TIER_FACTOR = 4
+
+
+def _safe(name):
+    return re.sub(r"[^A-Za-z0-9_\-\.]", "_", name)
+
+
+class ColumnarStore:
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _dir(self, exam, set_name):
+        return os.path.join(self.root, _safe(exam), _safe(set_name.upper()))
+
+    @staticmethod
+    def _segments(path):
+        names = [n for n in os.listdir(path) if n.startswith("seg-")] if os.path.isdir(path) else []
+        return sorted(names, key=lambda n: int(n[4:]))
+
+    @staticmethod
+    def _delta_rows(path):
+        try:
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            return 0
+        return size // ROW_DTYPE.itemsize
+
+    def exams(self):
+        return sorted(os.listdir(self.root))
+
+    def sets(self, exam):
+        path = os.path.join(self.root, _safe(exam))
+        return sorted(os.listdir(path)) if os.path.isdir(path) else []
+
+    def append(self, exam, set_name, roll_no, responses, result):
+        """Record one scored sheet (result as returned by score_responses). Returns True
+        when the set's delta log has grown enough that compact() should run."""
+        row = np.zeros(1, dtype=ROW_DTYPE)
+        row["roll"] = roll_no.encode("utf-8")[:64]
+        row["bits"] = as_bits(responses)
+        row["sections"] = result["section_scores"]
+        row["total"] = result["total"]
+        row["max_total"] = result["max_total"]
+        path = self._dir(exam, set_name)
+        os.makedirs(path, exist_ok=True)
+        with file_lock(os.path.join(path, ".lock")):
+            with open(os.path.join(path, "delta.rec"), "ab") as f:
+                f.write(row.tobytes())
+        return self._delta_rows(os.path.join(path, "delta.rec")) >= COMPACT_ROWS
+
+    def _parts(self, path, segments, logs, columns):
+        parts = []
+        for seg in segments:
+            parts.append({c: np.load(os.path.join(path, seg, c + ".npy"), mmap_mode="r") for c in columns})
+        for log in logs:
+            count = self._delta_rows(os.path.join(path, log))
+            if count:
+                rows = np.fromfile(os.path.join(path, log), dtype=ROW_DTYPE, count=count)
+                parts.append({c: rows[c] for c in columns})
+        return parts
+
+    @staticmethod
+    def _latest(parts, columns):
+        """Concatenate parts keeping the last row per roll number; a part that needs no
+        rows dropped and stands alone is returned as is (memory-mapped, no copy)."""
+        if not parts:
+            return {c: np.zeros((0,) + ROW_DTYPE[c].shape, dtype=ROW_DTYPE[c].base) for c in columns}
+        rolls = parts[0]["roll"] if len(parts) == 1 else np.concatenate([p["roll"] for p in parts])
+        # np.unique on the reversed rolls finds each roll's last occurrence
+        _, last = np.unique(rolls[::-1], return_index=True)
+        keep = np.sort(len(rolls) - 1 - last)
+        if len(parts) == 1 and len(keep) == len(rolls):
+            return parts[0]
+        out = {}
+        for c in columns:
+            column = parts[0][c] if len(parts) == 1 else np.concatenate([p[c] for p in parts])
+            out[c] = column[keep]
+        return out
+
+    def read(self, exam, set_name, columns=("bits", "total")):
+        """{column: array} for the latest row of every student in a set."""
+        columns = tuple(dict.fromkeys(("roll",) + tuple(columns)))
+        unknown = set(columns) - set(COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown columns: {sorted(unknown)}")
+        path = self._dir(exam, set_name)
+        if not os.path.isdir(path):
+            return self._latest([], columns)
+        with file_lock(os.path.join(path, ".lock")):
+            # segments are opened before the lock is released: a concurrent compaction
+            # may unlink them, but an open memory map stays valid
+            parts = self._parts(path, self._segments(path), ["compacting.rec", "delta.rec"], columns)
+        return self._latest(parts, columns)
+
+    def aggregate(self, exam, set_name, key_bits, scheme=None):
+        """Item analysis of a set computed from its answer columns, rescoring the whole
+        cohort under the given key and scheme (so a key correction shows up at once)."""
+        agg = SetAggregate()
+        data = self.read(exam, set_name, ("bits",))
+        if len(data["roll"]):
+            agg.update(data["bits"], score_responses(data["bits"], key_bits, scheme), key_bits)
+        return agg
+
+    def compact(self, exam, set_name):
+        """Merge the delta log and small trailing segments into one segment; returns the
+        number of rows written (0 if there was nothing to merge)."""
+        path = self._dir(exam, set_name)
+        if not os.path.isdir(path):
+            return 0
+        lock = os.path.join(path, ".lock")
+        with file_lock(os.path.join(path, ".compact.lock")):
+            with file_lock(lock):
+                # new rows keep going to a fresh delta.rec while this one is merged;
+                # a compacting.rec left by an interrupted run is merged first
+                if not os.path.exists(os.path.join(path, "compacting.rec")) and \
+                        os.path.exists(os.path.join(path, "delta.rec")):
+                    os.replace(os.path.join(path, "delta.rec"), os.path.join(path, "compacting.rec"))
+                segments = self._segments(path)
+                pending = self._delta_rows(os.path.join(path, "compacting.rec"))
+                merged, rows = [], pending
+                for seg in reversed(segments):
+                    seg_rows = len(np.load(os.path.join(path, seg, "roll.npy"), mmap_mode="r"))
+                    if seg_rows > TIER_FACTOR * max(rows, 1):
+                        break
+                    merged.insert(0, seg)
+                    rows += seg_rows
+                if not pending and len(merged) < 2:
+                    return 0
+                parts = self._parts(path, merged, ["compacting.rec"], COLUMNS)
+            data = self._latest(parts, COLUMNS)
+            seq = int(segments[-1][4:]) + 1 if segments else 1
+            tmp = os.path.join(path, f".seg-{seq}.{os.getpid()}.tmp")
+            shutil.rmtree(tmp, ignore_errors=True)
+            os.makedirs(tmp)
+            for c in COLUMNS:
+                np.save(os.path.join(tmp, c + ".npy"), np.ascontiguousarray(data[c]))
+            with file_lock(lock):
+                os.rename(tmp, os.path.join(path, f"seg-{seq}"))
+                for seg in merged:
+                    shutil.rmtree(os.path.join(path, seg))
+                if os.path.exists(os.path.join(path, "compacting.rec")):
+                    os.remove(os.path.join(path, "compacting.rec"))
+            return len(data["roll"])
+
+    def stats(self, exam, set_name):
+        path = self._dir(exam, set_name)
+        segments = self._segments(path)
+        return {
+            "segments": [len(np.load(os.path.join(path, seg, "roll.npy"), mmap_mode="r")) for seg in segments],
+            "delta_rows": self._delta_rows(os.path.join(path, "delta.rec"))
+                          + self._delta_rows(os.path.join(path, "compacting.rec"))
+        }
+
+
+def rebuild(store, submissions_path):
+    """Refill the store from a submission log (e.g. after deleting it); returns rows written."""
+    from responses import SheetResponses
+    shutil.rmtree(store.root, ignore_errors=True)
+    os.makedirs(store.root, exist_ok=True)
+    count = 0
+    with open(submissions_path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            scores = record["result"]["section_scores"]
+            result = {"section_scores": [scores.get(s, 0) for s in SECTION_NAMES], "total": scores["Total"],
+                      "max_total": record["result"].get("total_possible", 0)}
+            store.append(record["csv_file"], record["set"], record["roll_no"],
+                         SheetResponses.from_hex(record["marked"]), result)
+            count += 1
+    for exam in store.exams():
+        for set_name in store.sets(exam):
+            store.compact(exam, set_name)
+    return count
+
+
+if __name__ == "__main__":
+    import sys
+    upload_dir = os.getenv("UPLOAD_DIR", "uploaded_omr")
+    store = ColumnarStore(os.path.join(upload_dir, "columnar"))
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    if command == "rebuild":
+        print(f"{rebuild(store, os.path.join(upload_dir, 'submissions.jsonl'))} rows")
+    elif command == "compact":
+        for exam in store.exams():
+            for set_name in store.sets(exam):
+                store.compact(exam, set_name)
+                print(exam, set_name, store.stats(exam, set_name))
+    else:
+        print("usage: python columnar.py compact|rebuild")
+        sys.exit(1)
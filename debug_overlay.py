@@ -0,0 +1,108 @@
+import io
+import base64
+from collections import OrderedDict
+
+import numpy as np
+
+from omr_layout import NUM_COLS, NUM_ROWS_PER_COL, OPTION_LETTERS
+from thresholding import darkness
+
+# BGR
+CORRECT = (40, 160, 40)
+WRONG = (40, 40, 220)
+MISSED = (220, 120, 0)     # key answer left blank
+BLANK = (150, 150, 150)
+TEXT = (20, 20, 20)
+
+
+def pack_trace(trace):
+    """Trace dict of small arrays -> base64 string (for job results / JSON)."""
+    buf = io.BytesIO()
+    np.savez(buf, **{k: np.asarray(v) for k, v in trace.items()})
+    return base64.b64encode(buf.getvalue()).decode("ascii")
+
+
+def unpack_trace(text):
+    with np.load(io.BytesIO(base64.b64decode(text))) as data:
+        return {k: data[k] for k in data.files}
+
+
+class TraceCache:
+    """Most recent detection traces by (image sha256, threshold mode, profile), in memory only."""
+
+    def __init__(self, size=512):
+        self.size = size
+        self._items = OrderedDict()
+
+    def put(self, key, trace):
+        self._items[key] = trace
+        self._items.move_to_end(key)
+        while len(self._items) > self.size:
+            self._items.popitem(last=False)
+
+    def get(self, key):
+        trace = self._items.get(key)
+        if trace is not None:
+            self._items.move_to_end(key)
+        return trace
+
+
+def render_overlay(image_path, trace, marked, detection=None, key_options=None):
+    """PNG of the normalised grid with every bubble's box, darkness and assigned question.
+
+    Green: marked and in the key; red: marked, not in the key; orange: key answer left
+    blank; grey: blank. Re-crops the original scan with the stored grid box, so no
+    detection is repeated. cv2 is imported here, only when an overlay is requested."""
+    import cv2
+    from image_io import read_gray
+    from omr_scoring import normalize_grid
+    from profiles import get_profile
+
+    # decode at the resolution the profile detected at, or the stored boxes do not line up
+    profile = get_profile((detection or {}).get("profile") or "balanced")
+    img = read_gray(image_path, profile["decode_side"])
+    if img is None:
+        raise ValueError("Image read failed!")
+    grid = cv2.cvtColor(normalize_grid(img, tuple(int(v) for v in trace["box"])), cv2.COLOR_GRAY2BGR)
+    boxes = trace["boxes"]
+    local = (detection or {}).get("mode") == "local"
+    dark = darkness(trace["mean_val"], local=local)
+    font = cv2.FONT_HERSHEY_SIMPLEX
+
+    for q in range(boxes.shape[0]):
+        found = boxes[q, :, 0] >= 0
+        if found.any():
+            x, y, w, h = boxes[q, np.argmax(found)]
+            cv2.putText(grid, str(q + 1), (int(x) - 30, int(y + h * 0.7)), font, 0.35, TEXT, 1, cv2.LINE_AA)
+        for opt in np.flatnonzero(found):
+            x, y, w, h = (int(v) for v in boxes[q, opt])
+            in_key = key_options is not None and key_options[q, opt]
+            if marked[q, opt]:
+                color = CORRECT if in_key or key_options is None else WRONG
+            else:
+                color = MISSED if in_key else BLANK
+            cv2.rectangle(grid, (x, y), (x + w, y + h), color, 2 if marked[q, opt] or in_key else 1)
+            label = f"{OPTION_LETTERS[opt]} {dark[q, opt]:.2f}" if not np.isnan(dark[q, opt]) else OPTION_LETTERS[opt]
+            cv2.putText(grid, label, (x, y - 2), font, 0.28, color, 1, cv2.LINE_AA)
+
+    # column split: where the detected bubbles were divided into the NUM_COLS columns
+    for col in range(1, NUM_COLS):
+        prev = boxes[(col - 1) * NUM_ROWS_PER_COL:col * NUM_ROWS_PER_COL].reshape(-1, 4)
+        nxt = boxes[col * NUM_ROWS_PER_COL:(col + 1) * NUM_ROWS_PER_COL].reshape(-1, 4)
+        prev, nxt = prev[prev[:, 0] >= 0], nxt[nxt[:, 0] >= 0]
+        if len(prev) and len(nxt):
+            x = int((prev[:, 0] + prev[:, 2]).max() + nxt[:, 0].min()) // 2
+            cv2.line(grid, (x, 0), (x, grid.shape[0]), (200, 0, 200), 1)
+
+    if detection:
+        header = ", ".join(f"{k}={v}" for k, v in detection.items())
+        header += f", bubbles={int(trace.get('bubbles_found', 0))}"
+        if "template_matched" in trace:
+            header += f", matched={int(trace['template_matched'])}"
+        cv2.rectangle(grid, (0, 0), (grid.shape[1], 18), (255, 255, 255), -1)
+        cv2.putText(grid, header, (4, 13), font, 0.4, TEXT, 1, cv2.LINE_AA)
+
+    ok, png = cv2.imencode(".png", grid)
+    if not ok:
+        raise ValueError("Could not encode overlay")
+    return png.tobytes()
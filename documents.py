@@ -0,0 +1,367 @@
+"""Multi-page scans: one PDF or TIFF per stack of sheets, split into single-page images.
+
+Pages are produced one at a time, so memory does not grow with the document:
+- PDF: each page's scanned image is copied out of the file as-is (JPEG, DCTDecode), with
+  no decoding or re-encoding. Only the objects on the way to each page are parsed.
+- TIFF: each page is decoded with OpenCV (imported on first use) and written out as PNG.
+"""
+import io
+import re
+import csv
+import os
+import zlib
+
+DOCUMENT_EXT = {".pdf", ".tif", ".tiff"}
+
+
+def document_kind(path):
+    """'pdf', 'tiff' or None, from the file's magic bytes."""
+    with open(path, "rb") as f:
+        head = f.read(5)
+    if head.startswith(b"%PDF-"):
+        return "pdf"
+    if head[:4] in (b"II*\x00", b"MM\x00*"):
+        return "tiff"
+    return None
+
+
+def page_count(path):
+    kind = document_kind(path)
+    if kind == "pdf":
+        with PDFReader(path) as pdf:
+            return sum(1 for _ in _checked(pdf.pages()))
+    if kind == "tiff":
+        import cv2
+        return cv2.imcount(path)
+    raise ValueError("Not a PDF or TIFF document")
+
+
+def iter_pages(path):
+    """Yield (page number from 1, image extension, image bytes, error) for each page.
+
+    A page that cannot be extracted yields its error message instead of bytes, so one
+    bad page does not stop the rest of the stack."""
+    kind = document_kind(path)
+    if kind == "pdf":
+        with PDFReader(path) as pdf:
+            for number, page in enumerate(_checked(pdf.pages()), 1):
+                try:
+                    yield (number, ".jpg", _checked_call(pdf.page_jpeg, page), None)
+                except ValueError as e:
+                    yield (number, None, None, f"page {number}: {e}")
+    elif kind == "tiff":
+        import cv2
+        for index in range(cv2.imcount(path)):
+            ok, mats = cv2.imreadmulti(path, index, 1, flags=cv2.IMREAD_GRAYSCALE)
+            ok = ok and len(mats) == 1
+            encoded = cv2.imencode(".png", mats[0])[1].tobytes() if ok else None
+            yield (index + 1, ".png", encoded, None if ok else f"page {index + 1}: could not decode")
+    else:
+        raise ValueError("Not a PDF or TIFF document")
+
+
+# what a PDFReader walking a damaged file can raise besides its own ValueErrors
+_PARSE_ERRORS = (KeyError, IndexError, TypeError, AttributeError, RecursionError, zlib.error)
+
+
+def _checked_call(fn, *args):
+    try:
+        return fn(*args)
+    except _PARSE_ERRORS as e:
+        raise ValueError(f"malformed PDF ({type(e).__name__}: {e})") from e
+
+
+def _checked(pages):
+    """pages(), with parser faults on a damaged file raised as ValueError."""
+    while True:
+        try:
+            page = next(pages)
+        except StopIteration:
+            return
+        except _PARSE_ERRORS as e:
+            raise ValueError(f"malformed PDF ({type(e).__name__}: {e})") from e
+        yield page
+
+
+class Name(str):
+    """A PDF name (/Foo), as opposed to a string."""
+
+
+class Ref(tuple):
+    """Indirect reference 'num gen R'."""
+
+
+class Stream(dict):
+    """Stream dictionary; .start is the file offset of the stream data."""
+    start = 0
+
+
+_TOKEN = re.compile(rb"""
+    \s*(?:%[^\r\n]*[\r\n]\s*)*
+    (<<|>>|\[|\]|/[^\s/\[\]<>(){}%]*|\((?:\\.|[^\\)])*\)|<[0-9A-Fa-f\s]*>|[-+]?(?:\d+\.?\d*|\.\d+)|[A-Za-z]+)
+""", re.X | re.S)
+_OBJ = re.compile(rb"(\d+)\s+(\d+)\s+obj\b")
+_INT = re.compile(rb"[-+]?\d+$")
+_REF = re.compile(rb"\s+(\d+)\s+R\b")
+
+
+def _token(data, pos):
+    m = _TOKEN.match(data, pos)
+    if not m:
+        raise ValueError(f"malformed PDF at byte {pos}")
+    return m.group(1), m.end()
+
+
+def _parse(data, pos):
+    """Parse one PDF object starting at pos; returns (value, end position)."""
+    tok, pos = _token(data, pos)
+    if tok == b"<<":
+        value = {}
+        while True:
+            key, after = _token(data, pos)
+            if key == b">>":
+                return value, after
+            key, pos = _parse(data, pos)
+            value[key], pos = _parse(data, pos)
+    if tok == b"[":
+        value = []
+        while True:
+            item, after = _token(data, pos)
+            if item == b"]":
+                return value, after
+            item, pos = _parse(data, pos)
+            value.append(item)
+    if tok[:1] == b"/":
+        return Name(tok[1:].decode("latin-1")), pos
+    if _INT.match(tok):
+        # "num gen R" is a reference; otherwise a plain integer
+        m = _REF.match(data, pos)
+        if m:
+            return Ref((int(tok), int(m.group(1)))), m.end()
+        return int(tok), pos
+    if tok[:1] in b"-+.0123456789":
+        return float(tok), pos
+    if tok in (b"true", b"false"):
+        return tok == b"true", pos
+    if tok == b"null":
+        return None, pos
+    return tok, pos  # strings are not needed for finding page images
+
+
+class PDFReader:
+    """Just enough of a PDF reader to walk the page tree and copy out page images.
+
+    Objects are located by scanning for 'N G obj' (rather than trusting the xref table),
+    which also copes with incrementally updated files; objects packed into object
+    streams are found through those streams. The file is read in chunks and by offset,
+    never held in memory as a whole."""
+
+    CHUNK = 8 << 20
+
+    def __init__(self, path):
+        self._file = open(path, "rb")
+        self._fd = self._file.fileno()
+        self.size = os.fstat(self._fd).st_size
+        self._offsets = {}
+        pos, tail = 0, b""
+        while pos < self.size:
+            chunk = tail + os.pread(self._fd, self.CHUNK, pos)
+            base = pos - len(tail)
+            for m in _OBJ.finditer(chunk):
+                self._offsets[int(m.group(1))] = base + m.end()
+            pos += self.CHUNK
+            tail = chunk[-64:]  # an 'N G obj' split across chunks is found in the overlap
+        self._packed = None
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _object_at(self, pos):
+        window = 1 << 16
+        while True:
+            data = os.pread(self._fd, window, pos)
+            try:
+                value, end = _parse(data, 0)
+                tok, after = _token(data, end) if isinstance(value, dict) else (None, end)
+                break
+            except ValueError:
+                if pos + window >= self.size or window >= 1 << 24:
+                    raise
+                window *= 4  # object larger than the window
+        if tok == b"stream":
+            value = Stream(value)
+            value.start = pos + after + (2 if data[after:after + 2] == b"\r\n" else 1)
+        return value
+
+    def resolve_dict(self, value, what):
+        """resolve() for an object that must be a dictionary."""
+        value = self.resolve(value)
+        if not isinstance(value, dict):
+            raise ValueError(f"malformed PDF: {what} is {'missing' if value is None else 'not a dictionary'}")
+        return value
+
+    def resolve(self, value, depth=0):
+        while isinstance(value, Ref):
+            num = value[0]
+            if num in self._offsets:
+                value = self._object_at(self._offsets[num])
+            else:
+                value = self._packed_object(num)
+            depth += 1
+            if depth > 32:
+                raise ValueError("reference loop")
+        return value
+
+    def _packed_object(self, num):
+        if self._packed is None:
+            self._packed = {}
+            for stream_num in list(self._offsets):
+                obj = self.resolve(Ref((stream_num, 0)))
+                if isinstance(obj, Stream) and obj.get("Type") == "ObjStm":
+                    body = self.stream_bytes(obj)
+                    header = body[:obj["First"]].split()
+                    for i in range(0, len(header) - 1, 2):
+                        self._packed[int(header[i])] = (body, obj["First"] + int(header[i + 1]))
+        if num not in self._packed:
+            return None
+        body, pos = self._packed[num]
+        return _parse(body, pos)[0]
+
+    def stream_bytes(self, stream, decode=True):
+        length = self.resolve(stream.get("Length"))
+        if not isinstance(length, int) or not 0 <= length <= self.size - stream.start:
+            raise ValueError(f"malformed PDF: bad stream length {length!r}")
+        raw = os.pread(self._fd, length, stream.start)
+        filters = self.resolve(stream.get("Filter"))
+        filters = filters if isinstance(filters, list) else [filters] if filters else []
+        if decode and filters == ["FlateDecode"]:
+            try:
+                return zlib.decompress(raw)
+            except zlib.error as e:
+                raise ValueError(f"malformed PDF: {e}")
+        return raw
+
+    def root(self):
+        tail_start = max(0, self.size - (1 << 16))
+        tail = os.pread(self._fd, self.size - tail_start, tail_start)
+        end = tail.rfind(b"trailer")
+        if end >= 0:
+            trailer = _parse(tail, end + len(b"trailer"))[0]
+        else:
+            # PDF 1.5+ cross-reference stream: its dictionary doubles as the trailer
+            xrefs = [num for num, pos in self._offsets.items() if b"/XRef" in os.pread(self._fd, 200, pos)]
+            if not xrefs:
+                raise ValueError("PDF has no trailer")
+            trailer = self.resolve(Ref((max(xrefs, key=self._offsets.get), 0)))
+        trailer = self.resolve_dict(trailer, "trailer")
+        return self.resolve_dict(trailer.get("Root"), "document catalog")
+
+    def pages(self):
+        """Page dictionaries in reading order, with inherited Resources filled in."""
+        stack = [(self.resolve_dict(self.root().get("Pages"), "page tree"), None)]
+        seen = 0
+        while stack:
+            node, inherited = stack.pop()
+            seen += 1
+            if seen > 1_000_000:
+                raise ValueError("page tree loop")
+            resources = node.get("Resources", inherited)
+            if "Kids" in node:
+                kids = self.resolve(node["Kids"])
+                if not isinstance(kids, list):
+                    raise ValueError("malformed PDF: page tree Kids is not an array")
+                stack.extend((self.resolve_dict(kid, "page"), resources) for kid in reversed(kids))
+            else:
+                yield dict(node, Resources=resources)
+
+    def page_jpeg(self, page):
+        """Bytes of the largest image on the page, which must be a JPEG (DCTDecode) scan."""
+        resources = self.resolve_dict(page.get("Resources") or {}, "page resources")
+        xobjects = self.resolve_dict(resources.get("XObject") or {}, "page XObjects")
+        images = [obj for obj in (self.resolve(v) for v in xobjects.values())
+                  if isinstance(obj, Stream) and obj.get("Subtype") == "Image"]
+        if not images:
+            raise ValueError("no scanned image on this page")
+        image = max(images, key=lambda obj: self.resolve(obj.get("Width", 0)) * self.resolve(obj.get("Height", 0)))
+        filters = self.resolve(image.get("Filter"))
+        filters = filters if isinstance(filters, list) else [filters]
+        if filters != ["DCTDecode"]:
+            raise ValueError(f"image is {'/'.join(str(f) for f in filters if f) or 'uncompressed'}, "
+                             "not JPEG; scan in grayscale or colour mode, or export TIFF")
+        return self.stream_bytes(image, decode=False)
+
+
+def write_pdf(path, jpeg_pages):
+    """Write a minimal PDF with one JPEG scan per page, as scanners do (for tests)."""
+    from image_io import header_size
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None]
+    kids = []
+    for data in jpeg_pages:
+        width, height = header_size(io.BytesIO(data))
+        sof = max(data.find(b"\xff\xc0"), data.find(b"\xff\xc2"))
+        color_space = "DeviceRGB" if sof >= 0 and data[sof + 9] == 3 else "DeviceGray"
+        image_num, content_num, page_num = len(objects) + 1, len(objects) + 2, len(objects) + 3
+        content = f"q {width} 0 0 {height} 0 0 cm /Im0 Do Q".encode()
+        objects.append(f"<< /Type /XObject /Subtype /Image /Width {width} /Height {height} /ColorSpace "
+                       f"/{color_space} /BitsPerComponent 8 /Filter /DCTDecode /Length {len(data)} >>\n"
+                       "stream\n".encode() + data + b"\nendstream")
+        objects.append(f"<< /Length {len(content)} >>\nstream\n".encode() + content + b"\nendstream")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {width} {height}] "
+                       f"/Resources << /XObject << /Im0 {image_num} 0 R >> >> /Contents {content_num} 0 R >>".encode())
+        kids.append(f"{page_num} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>".encode()
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for num, body in enumerate(objects, 1):
+        offsets.append(out.tell())
+        out.write(f"{num} 0 obj\n".encode() + body + b"\nendobj\n")
+    xref = out.tell()
+    out.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode())
+    out.write(b"".join(f"{off:010d} 00000 n \n".encode() for off in offsets))
+    out.write(f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode())
+    with open(path, "wb") as f:
+        f.write(out.getvalue())
+
+
+_NAME_COLUMNS = ("name", "student", "student_name", "student name")
+_ROLL_COLUMNS = ("roll", "roll_no", "roll no", "roll number", "roll_number")
+
+
+def parse_roster(data):
+    """Roster CSV (name, roll number and optionally page columns) -> [(page, name, roll)].
+
+    page is None without a page column: the caller either takes rows in page order or
+    looks names up by the roll number read from each sheet."""
+    text = data.decode("utf-8-sig") if isinstance(data, bytes) else data
+    reader = csv.reader(io.StringIO(text))
+    header = [h.strip().lower() for h in next(reader, [])]
+    name_col = next((header.index(c) for c in _NAME_COLUMNS if c in header), None)
+    roll_col = next((header.index(c) for c in _ROLL_COLUMNS if c in header), None)
+    if name_col is None or roll_col is None:
+        raise ValueError("Roster needs a name column and a roll number column")
+    page_col = header.index("page") if "page" in header else None
+    roster = []
+    for row in reader:
+        if not any(cell.strip() for cell in row):
+            continue
+        try:
+            page = int(row[page_col]) if page_col is not None else None
+        except (ValueError, IndexError):
+            raise ValueError(f"Roster row {len(roster) + 2}: page must be a number")
+        if len(row) <= max(name_col, roll_col):
+            raise ValueError(f"Roster row {len(roster) + 2} has too few columns")
+        name, roll = row[name_col].strip(), row[roll_col].strip()
+        if not name or not roll:
+            raise ValueError(f"Roster row {len(roster) + 2}: name and roll number are required")
+        roster.append((page, name, roll))
+    pages = [page for page, _, _ in roster if page is not None]
+    if len(set(pages)) != len(pages):
+        raise ValueError("Roster lists a page more than once")
+    return roster
@@ -0,0 +1,117 @@
+"""File I/O for the API process.
+
+Async handlers never touch the disk on the event loop: blocking file work goes through
+run_io, a bounded thread pool (OMR_IO_THREADS), so a slow or network-backed volume delays
+the requests that need it and not every other one. Files other processes or clients read
+are written with atomic_write (temp file + rename), so readers see the old file or the new
+one, never a partial one. LoopLagMonitor measures how late the event loop runs, which is
+what blocking work on the loop shows up as.
+"""
+import os
+import time
+import asyncio
+import functools
+import contextlib
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+IO_THREADS = int(os.getenv("OMR_IO_THREADS", "8"))
+
+_executor = ThreadPoolExecutor(IO_THREADS, thread_name_prefix="omr-io")
+_pending = 0  # calls submitted and not finished; only touched on the event loop
+
+
+async def run_io(fn, *args, **kwargs):
+    """Run blocking file work on the I/O thread pool and wait for its result."""
+    global _pending
+    _pending += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_executor, functools.partial(fn, *args, **kwargs))
+    finally:
+        _pending -= 1
+
+
+def io_stats():
+    return {"threads": IO_THREADS, "pending": _pending}
+
+
+def _temp_path(path):
+    return f"{path}.{os.getpid()}.{threading.get_ident()}.part"
+
+
+@contextlib.contextmanager
+def atomic_write(path, mode="w", **open_kwargs):
+    """Write to a temp file next to path that replaces path when the block exits cleanly."""
+    tmp = _temp_path(path)
+    try:
+        with open(tmp, mode, **open_kwargs) as f:
+            yield f
+        os.replace(tmp, path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp)
+        raise
+
+
+@contextlib.contextmanager
+def atomic_create(path, mode="w", **open_kwargs):
+    """atomic_write that raises FileExistsError instead of replacing an existing file,
+    also when two processes create the same file at once."""
+    tmp = _temp_path(path)
+    try:
+        with open(tmp, mode, **open_kwargs) as f:
+            yield f
+        os.link(tmp, path)  # fails if path exists; rename would silently replace it
+    finally:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp)
+
+
+class LoopLagMonitor:
+    """How late the event loop wakes a coroutine that asked to sleep `interval` seconds.
+
+    Keeps the last `window` samples for percentiles plus running totals since start."""
+
+    def __init__(self, interval=0.05, window=1200, stall_ms=100):
+        self.interval = interval
+        self.stall_ms = stall_ms
+        self._samples = collections.deque(maxlen=window)
+        self._task = None
+        self.count = 0
+        self.stalls = 0
+        self.max_ms = 0.0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while True:
+            t = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag_ms = max(0.0, time.perf_counter() - t - self.interval) * 1000
+            self._samples.append(lag_ms)
+            self.count += 1
+            self.stalls += lag_ms >= self.stall_ms
+            self.max_ms = max(self.max_ms, lag_ms)
+
+    def snapshot(self):
+        recent = sorted(self._samples)
+
+        def pct(q):
+            return round(recent[min(len(recent) - 1, int(q * len(recent)))], 2) if recent else None
+
+        return {
+            "interval_ms": self.interval * 1000,
+            "recent": {"samples": len(recent), "p50_ms": pct(0.5), "p99_ms": pct(0.99),
+                       "max_ms": round(recent[-1], 2) if recent else None},
+            "samples": self.count,
+            f"stalls_over_{self.stall_ms}ms": self.stalls,
+            "max_ms": round(self.max_ms, 2)
+        }
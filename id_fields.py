@@ -0,0 +1,76 @@
+"""Identity fields printed on the sheet as bubble grids: the roll number and the set code.
+
+Off unless OMR_ID_LAYOUT names a JSON file describing where the fields are, e.g.
+
+    {"roll_no":  {"region": [0.05, 0.02, 0.45, 0.22], "positions": 6, "symbols": "0123456789"},
+     "set_code": {"region": [0.60, 0.04, 0.90, 0.09], "positions": 1, "symbols": "ABCD",
+                  "orientation": "rows"}}
+
+region is left, top, right, bottom as fractions of the page. With orientation "columns"
+(the default) each character is a column of bubbles, symbols top to bottom; with "rows"
+each character is a row, symbols left to right. Kept free of OpenCV like omr_layout;
+the bubbles themselves are found by omr_scoring.read_id_fields.
+"""
+import os
+import json
+
+import numpy as np
+
+from thresholding import darkness
+
+ID_FIELD_NAMES = ("roll_no", "set_code")
+ID_MIN_DARKNESS = 0.3   # darkest bubble of a position must be at least this dark to count
+ID_MIN_GAP = 0.15       # ... and this much darker than the runner-up, or the position is ambiguous
+
+
+def parse_id_layout(layout):
+    """Validate a layout dict; returns it with defaults filled in."""
+    if not isinstance(layout, dict) or not layout:
+        raise ValueError("ID layout must be an object with roll_no and / or set_code")
+    parsed = {}
+    for name, field in layout.items():
+        if name not in ID_FIELD_NAMES:
+            raise ValueError(f"Unknown ID field {name!r}; use {' or '.join(ID_FIELD_NAMES)}")
+        region = [float(v) for v in field.get("region", ())]
+        if len(region) != 4 or not (0 <= region[0] < region[2] <= 1 and 0 <= region[1] < region[3] <= 1):
+            raise ValueError(f"{name}: region must be [left, top, right, bottom] fractions of the page")
+        symbols = str(field.get("symbols", "0123456789" if name == "roll_no" else "ABCD"))
+        positions = int(field.get("positions", 1))
+        orientation = field.get("orientation", "columns")
+        if positions < 1 or len(symbols) < 2 or orientation not in ("columns", "rows"):
+            raise ValueError(f"{name}: needs positions >= 1, two or more symbols and orientation columns / rows")
+        parsed[name] = {"region": region, "positions": positions, "symbols": symbols, "orientation": orientation}
+    return parsed
+
+
+def load_id_layout(path):
+    if not path:
+        return None
+    with open(path) as f:
+        return parse_id_layout(json.load(f))
+
+
+ID_LAYOUT = load_id_layout(os.getenv("OMR_ID_LAYOUT"))
+
+
+def decode_field(mean_val, field):
+    """Field value from its bubbles' mean intensity, float32[positions, len(symbols)].
+
+    One symbol per position: the darkest bubble, if it is clearly marked and clearly darker
+    than the next one. Unmarked or ambiguous positions read as '?'."""
+    dark = darkness(mean_val)
+    chars, unread = [], []
+    for pos in range(dark.shape[0]):
+        order = np.argsort(-np.nan_to_num(dark[pos], nan=-1))
+        best, second = dark[pos, order[0]], dark[pos, order[1]]
+        if np.isnan(best) or best < ID_MIN_DARKNESS or best - np.nan_to_num(second) < ID_MIN_GAP:
+            chars.append("?")
+            unread.append(pos + 1)
+        else:
+            chars.append(field["symbols"][order[0]])
+    return {"value": "".join(chars), "complete": not unread, "unread_positions": unread}
+
+
+def unreadable_field(field, reason):
+    return {"value": "?" * field["positions"], "complete": False,
+            "unread_positions": list(range(1, field["positions"] + 1)), "error": reason}
@@ -0,0 +1,103 @@
+import os
+import struct
+
+# Limits for uploaded sheets; a phone photo is ~12 MP / 3-5 MB, a flatbed scan far less
+MAX_UPLOAD_BYTES = int(float(os.getenv("OMR_MAX_UPLOAD_MB", "20")) * 1024 * 1024)
+MAX_PIXELS = int(float(os.getenv("OMR_MAX_MEGAPIXELS", "40")) * 1_000_000)
+# Decode large sheets at 1/2, 1/4 or 1/8 scale (in the JPEG DCT, so the full-size image
+# never exists in memory) while the long side stays at least this many pixels. The
+# detector's size filters are tuned for sheets of roughly this resolution.
+MIN_DECODE_SIDE = int(os.getenv("OMR_MIN_DECODE_SIDE", "1200"))
+REDUCED_DECODE = os.getenv("OMR_REDUCED_DECODE", "1") != "0"
+
+_JPEG_SOF = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+class ImageTooLarge(ValueError):
+    """The sheet is over MAX_UPLOAD_BYTES or MAX_PIXELS."""
+
+
+def image_size(path):
+    """(width, height) from the PNG / JPEG header without decoding, or None if unknown."""
+    with open(path, "rb") as f:
+        return header_size(f)
+
+
+def header_size(f):
+    """image_size for a binary file object (or BytesIO) holding just the image."""
+    head = f.read(26)
+    if head.startswith(b"\x89PNG\r\n\x1a\n") and head[12:16] == b"IHDR":
+        return struct.unpack(">II", head[16:24])
+    if not head.startswith(b"\xff\xd8"):
+        return None
+    f.seek(2)
+    while True:
+        byte = f.read(1)
+        while byte and byte != b"\xff":
+            byte = f.read(1)
+        while byte == b"\xff":
+            byte = f.read(1)
+        if not byte:
+            return None
+        marker = byte[0]
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+            continue  # markers without a length
+        length = f.read(2)
+        if len(length) < 2:
+            return None
+        if marker in _JPEG_SOF:
+            data = f.read(5)
+            if len(data) < 5:
+                return None
+            height, width = struct.unpack(">HH", data[1:5])
+            return width, height
+        f.seek(struct.unpack(">H", length)[0] - 2, 1)
+
+
+def check_image(path):
+    """Raise ValueError for files that are not PNG / JPEG or exceed the pixel limit."""
+    size = image_size(path)
+    if size is None:
+        raise ValueError("Not a readable JPEG or PNG image")
+    width, height = size
+    if width * height > MAX_PIXELS:
+        raise ImageTooLarge(f"Image is {width}x{height} ({width * height / 1e6:.1f} MP); "
+                         f"the limit is {MAX_PIXELS / 1e6:.0f} MP")
+    return size
+
+
+def decode_reduction(size, min_side=MIN_DECODE_SIDE):
+    """1, 2, 4 or 8: the largest scale-down that keeps the long side >= min_side (None: 1)."""
+    if not REDUCED_DECODE or size is None or min_side is None:
+        return 1
+    long_side = max(size)
+    factor = 1
+    while factor < 8 and long_side // (factor * 2) >= min_side:
+        factor *= 2
+    return factor
+
+
+def estimate_sheet_bytes(path, min_side=MIN_DECODE_SIDE):
+    """Rough peak memory for detecting one sheet, used to budget worker admission.
+
+    A JPEG is scaled down inside the decoder; a PNG is decoded at full size first. The
+    detector then holds about three more image-sized buffers (threshold map, contours,
+    the grid crop) plus the fixed-size normalised grid."""
+    size = image_size(path)
+    if size is None:
+        return 32 * 2**20
+    full = size[0] * size[1]
+    reduced = full // decode_reduction(size, min_side) ** 2
+    with open(path, "rb") as f:
+        jpeg = f.read(2) == b"\xff\xd8"
+    decoded = reduced if jpeg else full + reduced
+    return decoded + 3 * reduced + 8 * 2**20
+
+
+def read_gray(path, min_side=MIN_DECODE_SIDE):
+    """Decode a sheet straight to grayscale, at reduced resolution if it is large."""
+    import cv2
+    size = check_image(path)
+    flag = {1: cv2.IMREAD_GRAYSCALE, 2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+            4: cv2.IMREAD_REDUCED_GRAYSCALE_4, 8: cv2.IMREAD_REDUCED_GRAYSCALE_8}[decode_reduction(size, min_side)]
+    return cv2.imread(path, flag)
@@ -0,0 +1,261 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+import contextlib
+
+try:
+    import fcntl
+except ImportError:  # Windows: file_lock degrades to a process-local lock
+    fcntl = None
+
+# Job states: queued -> leased -> done | failed. An expired lease goes back to the queue.
+QUEUED, LEASED, DONE, FAILED = "queued", "leased", "done", "failed"
+MAX_ATTEMPTS = 3
+
+
+def _decode(row):
+    job = dict(row)
+    job["payload"] = json.loads(job["payload"])
+    job["result"] = json.loads(job["result"]) if job["result"] is not None else None
+    return job
+
+
+class SQLiteJobStore:
+    """Job queue and result store in one SQLite file, shared by every API and worker
+    process on a host. Leases are taken inside BEGIN IMMEDIATE, so two workers never
+    get the same job; a worker that dies just lets its lease expire."""
+
+    def __init__(self, path):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._local = threading.local()
+        self._db().executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY, kind TEXT NOT NULL, payload TEXT NOT NULL,
+                state TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0,
+                lease_owner TEXT, lease_until REAL, result TEXT, error TEXT,
+                created_at REAL NOT NULL, updated_at REAL NOT NULL);
+            CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (state, kind, created_at);
+            CREATE TABLE IF NOT EXISTS workers (
+                id TEXT PRIMARY KEY, kinds TEXT NOT NULL, info TEXT, seen_at REAL NOT NULL);
+        """)
+
+    def _db(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.row_factory = sqlite3.Row
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    @contextlib.contextmanager
+    def _tx(self):
+        db = self._db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    def submit(self, kind, payload, job_id):
+        """Queue a job unless one with this id exists; a failed job is queued again."""
+        now = time.time()
+        with self._tx() as db:
+            row = db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                db.execute("INSERT INTO jobs (id, kind, payload, state, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                           (job_id, kind, json.dumps(payload), QUEUED, now, now))
+            elif row["state"] == FAILED:
+                db.execute("UPDATE jobs SET state = ?, attempts = 0, error = NULL, lease_owner = NULL, "
+                           "lease_until = NULL, updated_at = ? WHERE id = ?", (QUEUED, now, job_id))
+            row = db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return _decode(row)
+
+    def get(self, job_id):
+        row = self._db().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return _decode(row) if row is not None else None
+
+    def lease(self, worker_id, kinds, lease_seconds=60):
+        """Claim the oldest runnable job of the given kinds, or None."""
+        now = time.time()
+        marks = ",".join("?" * len(kinds))
+        with self._tx() as db:
+            while True:
+                row = db.execute(
+                    f"SELECT * FROM jobs WHERE kind IN ({marks}) AND (state = ? OR (state = ? AND lease_until < ?)) "
+                    "ORDER BY created_at LIMIT 1", (*kinds, QUEUED, LEASED, now)).fetchone()
+                if row is None:
+                    return None
+                if row["attempts"] >= MAX_ATTEMPTS:
+                    db.execute("UPDATE jobs SET state = ?, error = ?, updated_at = ? WHERE id = ?",
+                               (FAILED, row["error"] or "lease expired too many times", now, row["id"]))
+                    continue
+                db.execute("UPDATE jobs SET state = ?, lease_owner = ?, lease_until = ?, attempts = attempts + 1, "
+                           "updated_at = ? WHERE id = ?", (LEASED, worker_id, now + lease_seconds, now, row["id"]))
+                return _decode(db.execute("SELECT * FROM jobs WHERE id = ?", (row["id"],)).fetchone())
+
+    def complete(self, job_id, worker_id, result):
+        """Store a result; False if the lease was lost to another worker meanwhile."""
+        with self._tx() as db:
+            cur = db.execute("UPDATE jobs SET state = ?, result = ?, error = NULL, lease_until = NULL, updated_at = ? "
+                             "WHERE id = ? AND state = ? AND lease_owner = ?",
+                             (DONE, json.dumps(result), time.time(), job_id, LEASED, worker_id))
+        return cur.rowcount == 1
+
+    def fail(self, job_id, worker_id, error, retry=False):
+        """Record a failure; with retry the job is queued again until MAX_ATTEMPTS."""
+        with self._tx() as db:
+            row = db.execute("SELECT attempts FROM jobs WHERE id = ? AND state = ? AND lease_owner = ?",
+                             (job_id, LEASED, worker_id)).fetchone()
+            if row is None:
+                return False
+            state = QUEUED if retry and row["attempts"] < MAX_ATTEMPTS else FAILED
+            db.execute("UPDATE jobs SET state = ?, error = ?, lease_until = NULL, updated_at = ? WHERE id = ?",
+                       (state, error, time.time(), job_id))
+        return True
+
+    def heartbeat(self, worker_id, kinds, info=None):
+        with self._tx() as db:
+            db.execute("INSERT OR REPLACE INTO workers (id, kinds, info, seen_at) VALUES (?, ?, ?, ?)",
+                       (worker_id, json.dumps(list(kinds)), json.dumps(info or {}), time.time()))
+
+    def workers(self, max_age=30):
+        """Workers that sent a heartbeat in the last max_age seconds."""
+        rows = self._db().execute("SELECT * FROM workers WHERE seen_at >= ?", (time.time() - max_age,)).fetchall()
+        return [dict(id=r["id"], kinds=json.loads(r["kinds"]), info=json.loads(r["info"]), seen_at=r["seen_at"])
+                for r in rows]
+
+    def stats(self):
+        rows = self._db().execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall()
+        return {state: count for state, count in rows}
+
+
+class MemoryJobStore:
+    """In-process stand-in with the same semantics as SQLiteJobStore, for tests and for
+    running API and workers as threads of one process."""
+
+    def __init__(self):
+        self._jobs = {}
+        self._workers = {}
+        self._lock = threading.Lock()
+
+    def submit(self, kind, payload, job_id):
+        now = time.time()
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                job = self._jobs[job_id] = {
+                    "id": job_id, "kind": kind, "payload": json.loads(json.dumps(payload)), "state": QUEUED,
+                    "attempts": 0, "lease_owner": None, "lease_until": None, "result": None, "error": None,
+                    "created_at": now, "updated_at": now
+                }
+            elif job["state"] == FAILED:
+                job.update(state=QUEUED, attempts=0, error=None, lease_owner=None, lease_until=None, updated_at=now)
+            return dict(job)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def lease(self, worker_id, kinds, lease_seconds=60):
+        now = time.time()
+        with self._lock:
+            runnable = sorted((j for j in self._jobs.values() if j["kind"] in kinds and (
+                j["state"] == QUEUED or (j["state"] == LEASED and j["lease_until"] < now))),
+                key=lambda j: j["created_at"])
+            for job in runnable:
+                if job["attempts"] >= MAX_ATTEMPTS:
+                    job.update(state=FAILED, error=job["error"] or "lease expired too many times", updated_at=now)
+                    continue
+                job.update(state=LEASED, lease_owner=worker_id, lease_until=now + lease_seconds,
+                           attempts=job["attempts"] + 1, updated_at=now)
+                return dict(job)
+            return None
+
+    def complete(self, job_id, worker_id, result):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job["state"] != LEASED or job["lease_owner"] != worker_id:
+                return False
+            job.update(state=DONE, result=json.loads(json.dumps(result)), error=None, lease_until=None,
+                       updated_at=time.time())
+            return True
+
+    def fail(self, job_id, worker_id, error, retry=False):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job["state"] != LEASED or job["lease_owner"] != worker_id:
+                return False
+            state = QUEUED if retry and job["attempts"] < MAX_ATTEMPTS else FAILED
+            job.update(state=state, error=error, lease_until=None, updated_at=time.time())
+            return True
+
+    def heartbeat(self, worker_id, kinds, info=None):
+        with self._lock:
+            self._workers[worker_id] = {"id": worker_id, "kinds": list(kinds), "info": info or {}, "seen_at": time.time()}
+
+    def workers(self, max_age=30):
+        cutoff = time.time() - max_age
+        with self._lock:
+            return [dict(w) for w in self._workers.values() if w["seen_at"] >= cutoff]
+
+    def stats(self):
+        counts = {}
+        with self._lock:
+            for job in self._jobs.values():
+                counts[job["state"]] = counts.get(job["state"], 0) + 1
+        return counts
+
+
+# url scheme -> factory(rest of url). Register a networked backend (e.g. a Postgres or
+# Redis queue) to share jobs between hosts; it only needs the methods above.
+_BACKENDS = {}
+# memory://<name> -> store, so API and worker threads of one process share a queue
+_memory_stores = {}
+
+
+def register_backend(scheme, factory):
+    _BACKENDS[scheme] = factory
+
+
+def _memory_store(name):
+    return _memory_stores.setdefault(name or "default", MemoryJobStore())
+
+
+register_backend("sqlite", SQLiteJobStore)
+register_backend("memory", _memory_store)
+
+
+def open_job_store(url):
+    """sqlite:///abs/path/jobs.db, sqlite://relative/jobs.db or memory://<name>."""
+    scheme, sep, rest = url.partition("://")
+    if not sep or scheme not in _BACKENDS:
+        raise ValueError(f"Unknown job store {url!r}; known schemes: {', '.join(sorted(_BACKENDS))}")
+    return _BACKENDS[scheme](rest)
+
+
+_thread_locks = {}
+
+
+@contextlib.contextmanager
+def file_lock(path):
+    """Exclusive lock shared by every process on the host that uses the same path."""
+    thread_lock = _thread_locks.setdefault(path, threading.Lock())
+    with thread_lock:
+        if fcntl is None:
+            yield
+            return
+        with open(path, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
@@ -0,0 +1,75 @@
+"""Live capture: pick the frame of a camera stream worth scoring.
+
+The client sends downscaled frames of a sheet held under a phone. Each frame gets the
+cheap check of quality.py (grid in view, sharp, square to the frame) and only the best
+frame of a steady run is sent through full detection, so the proctor sees a result
+moments after the sheet is held still, instead of uploading photos until one reads.
+Kept free of OpenCV: the checks run on scoring workers.
+"""
+import os
+
+# Passing frames in a row that count as the sheet being held still
+STABLE_FRAMES = int(os.getenv("OMR_LIVE_STABLE_FRAMES", "3"))
+MAX_FRAME_BYTES = int(float(os.getenv("OMR_LIVE_MAX_FRAME_MB", "4")) * 1024 * 1024)
+
+
+class CaptureSession:
+    """Which frame of one live capture to score.
+
+    add() records each checked frame. Once `stable` frames in a row pass, ready() is true
+    and take() hands out the best frame of that run; a client may also ask for a capture
+    early, which takes the best frame since the session was armed. After a take the
+    session keeps reporting frame quality but waits for rearm() (the next sheet)."""
+
+    def __init__(self, stable=STABLE_FRAMES):
+        self.stable = stable
+        self.frames = 0
+        self.dropped = 0        # frames skipped because newer ones had arrived
+        self.rejected = {}      # reason code -> frames
+        self.armed = True
+        self._streak = 0
+        self._streak_best = None
+        self._best = None
+
+    def add(self, data, quality):
+        """Record a frame and its quality.frame_quality result; returns the event for the client."""
+        self.frames += 1
+        seq = self.frames
+        if quality["ok"]:
+            frame = (quality["score"], seq, data, quality)
+            self._streak += 1
+            if self._streak_best is None or frame[0] > self._streak_best[0]:
+                self._streak_best = frame
+            if self._best is None or frame[0] > self._best[0]:
+                self._best = frame
+        else:
+            self._streak = 0
+            self._streak_best = None
+            for reason in quality["reasons"]:
+                self.rejected[reason["code"]] = self.rejected.get(reason["code"], 0) + 1
+        return dict(quality, type="frame", seq=seq, stable=self._streak)
+
+    def ready(self):
+        return self.armed and self._streak >= self.stable
+
+    def take(self, force=False):
+        """(seq, frame bytes, quality) of the frame to score, or None if no frame passed."""
+        if self.ready():
+            frame = self._streak_best
+        elif self.armed and force:
+            frame = self._streak_best or self._best
+        else:
+            frame = None
+        if frame is None:
+            return None
+        self.armed = False
+        return frame[1], frame[2], frame[3]
+
+    def rearm(self):
+        self.armed = True
+        self._streak = 0
+        self._streak_best = None
+        self._best = None
+
+    def stats(self):
+        return {"frames": self.frames, "dropped": self.dropped, "rejected": dict(self.rejected)}
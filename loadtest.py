@@ -0,0 +1,403 @@
+#!/usr/bin/env python3
+"""Load test: a fleet of simulated clients replaying exam-day traffic against the API.
+
+    python loadtest.py                                   # in-process app, 30 s, 16 clients
+    python loadtest.py --target spawn -c 32 -d 60        # local uvicorn on a free port
+    python loadtest.py --target http://127.0.0.1:8000    # an already running server
+    python loadtest.py --mix evaluate=5,batch=1,all_scores=3,key_sets=1 --save run.json
+    python loadtest.py --images synthetic_sheets        # sheets from synthetic.py write
+    python loadtest.py compare before.json after.json
+
+Traffic (weights via --mix):
+  evaluate    /upload-omr + /evaluate of a random sheet from data/ (or --images), new roll
+              number each time
+  batch       /score-batch with --batch-size sheets
+  all_scores  /all-scores
+  key_sets    /answer-key-sets
+
+Reports per-endpoint latency histograms and percentiles, error rates, throughput and
+event-loop lag. For the in-process target the lag is the app's own loop; for the others it
+is this client's loop, plus /health probe latency and the server's /metrics/event-loop.
+Runs entirely offline; spawn and in-process targets use throwaway upload / key dirs.
+"""
+import os
+import sys
+import glob
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import platform
+import subprocess
+
+import httpx
+
+from benchmark import KEY_XLSX, sample_images, _free_port
+
+DEFAULT_MIX = "evaluate=6,batch=1,all_scores=2,key_sets=1"
+# histogram bucket upper bounds, ms
+BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, float("inf")]
+LAG_INTERVAL = 0.05
+PROBE_INTERVAL = 0.5
+PRELOAD_IMAGES = 256   # larger image sets are read from disk as they are sent
+
+
+class Recorder:
+    """Latencies and errors per endpoint."""
+
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.started = time.perf_counter()
+
+    def add(self, endpoint, seconds, status):
+        self.latencies.setdefault(endpoint, []).append(seconds * 1000)
+        if status is None or status >= 400:
+            key = str(status) if status is not None else "exception"
+            self.errors.setdefault(endpoint, {}).setdefault(key, 0)
+            self.errors[endpoint][key] += 1
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.started
+        return {endpoint: summarize(samples, self.errors.get(endpoint, {}), elapsed)
+                for endpoint, samples in sorted(self.latencies.items())}
+
+
+def percentile(sorted_samples, q):
+    if not sorted_samples:
+        return None
+    return round(sorted_samples[min(len(sorted_samples) - 1, int(len(sorted_samples) * q))], 2)
+
+
+def histogram(samples):
+    counts = [0] * len(BUCKETS_MS)
+    for s in samples:
+        counts[next(i for i, bound in enumerate(BUCKETS_MS) if s <= bound)] += 1
+    return {("inf" if bound == float("inf") else f"{bound:g}"): n for bound, n in zip(BUCKETS_MS, counts)}
+
+
+def summarize(samples, errors=None, elapsed=None):
+    samples = sorted(samples)
+    n = len(samples)
+    result = {
+        "requests": n,
+        "errors": sum((errors or {}).values()),
+        "error_rate": round(sum((errors or {}).values()) / n, 4) if n else 0,
+        "error_codes": errors or {},
+        "mean_ms": round(sum(samples) / n, 2) if n else None,
+        "p50_ms": percentile(samples, 0.50),
+        "p90_ms": percentile(samples, 0.90),
+        "p99_ms": percentile(samples, 0.99),
+        "max_ms": round(samples[-1], 2) if n else None,
+        "histogram_ms": histogram(samples)
+    }
+    if elapsed:
+        result["rps"] = round(n / elapsed, 2)
+    return result
+
+
+async def monitor_loop_lag(samples, stop):
+    """How late the event loop wakes a coroutine that asked to sleep LAG_INTERVAL."""
+    while not stop.is_set():
+        t = time.perf_counter()
+        await asyncio.sleep(LAG_INTERVAL)
+        samples.append(max(0.0, time.perf_counter() - t - LAG_INTERVAL) * 1000)
+
+
+async def probe_health(client, samples, stop):
+    while not stop.is_set():
+        t = time.perf_counter()
+        try:
+            await client.get("/health")
+        except httpx.HTTPError:
+            pass
+        samples.append((time.perf_counter() - t) * 1000)
+        await asyncio.sleep(PROBE_INTERVAL)
+
+
+class Traffic:
+    """Operations of a simulated client; each records one sample per HTTP call."""
+
+    def __init__(self, client, recorder, images, csv_filename, batch_size, rng):
+        self.client = client
+        self.rng = rng
+        self.rec = recorder
+        self.images = images
+        self.csv_filename = csv_filename
+        self.batch_size = batch_size
+        self._roll = 0
+
+    async def _call(self, endpoint, method, url, **kwargs):
+        t = time.perf_counter()
+        status = None
+        try:
+            r = await self.client.request(method, url, **kwargs)
+            status = r.status_code
+            return r
+        except httpx.HTTPError:
+            return None
+        finally:
+            self.rec.add(endpoint, time.perf_counter() - t, status)
+
+    def _sheet(self):
+        self._roll += 1
+        path, content = self.rng.choice(self.images)
+        if content is None:
+            with open(path, "rb") as f:
+                content = f.read()
+        set_name = "B" if f"{os.sep}Set B{os.sep}" in path else "A"
+        roll = f"LT{os.getpid()}-{id(self) % 100000}-{self._roll}"
+        return os.path.basename(path), content, set_name, roll
+
+    async def evaluate(self):
+        filename, content, set_name, roll = self._sheet()
+        form = {"student_name": f"Load {roll}", "roll_no": roll, "omr_set": set_name}
+        r = await self._call("/upload-omr", "POST", "/upload-omr", data=form, files={"file": (filename, content)})
+        if r is not None and r.status_code == 200:
+            await self._call("/evaluate", "POST", "/evaluate", data=dict(form, csv_filename=self.csv_filename))
+
+    async def batch(self):
+        sheets = [self._sheet() for _ in range(self.batch_size)]
+        set_name = sheets[0][2]
+        sheets = [s for s in sheets if s[2] == set_name]
+        await self._call("/score-batch", "POST", "/score-batch", data={
+            "omr_set": set_name, "csv_filename": self.csv_filename,
+            "student_names": [f"Load {s[3]}" for s in sheets], "roll_nos": [s[3] for s in sheets]
+        }, files=[("files", (s[0], s[1])) for s in sheets])
+
+    async def all_scores(self):
+        await self._call("/all-scores", "GET", "/all-scores")
+
+    async def key_sets(self):
+        await self._call("/answer-key-sets", "GET", "/answer-key-sets")
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ("evaluate", "batch", "all_scores", "key_sets"):
+            raise SystemExit(f"unknown operation in --mix: {name}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+async def client_fleet(client, args, lag_samples, probe_samples):
+    images = []
+    paths = sample_images() if args.images is None else sorted(
+        glob.glob(os.path.join(args.images, "*.jpeg")) + glob.glob(os.path.join(args.images, "*.jpg")))
+    if not paths:
+        raise SystemExit(f"no sheets in {args.images}")
+    for path in paths:
+        if len(paths) > PRELOAD_IMAGES:
+            images.append((path, None))
+        else:
+            with open(path, "rb") as f:
+                images.append((path, f.read()))
+    with open(KEY_XLSX, "rb") as f:
+        r = await client.post("/import-answerkeys", files={"file": ("key.xlsx", f.read())})
+        r.raise_for_status()
+
+    recorder = Recorder()
+    mix = parse_mix(args.mix)
+    ops, weights = list(mix), list(mix.values())
+    deadline = time.perf_counter() + args.duration
+    budget = {"left": args.requests}
+    stop = asyncio.Event()
+
+    async def simulated_client(i):
+        rng = random.Random(args.seed + i)
+        traffic = Traffic(client, recorder, images, args.csv, args.batch_size, rng)
+        while time.perf_counter() < deadline and (budget["left"] is None or budget["left"] > 0):
+            if budget["left"] is not None:
+                budget["left"] -= 1
+            await getattr(traffic, rng.choices(ops, weights)[0])()
+            if args.think_ms:
+                await asyncio.sleep(rng.expovariate(1000 / args.think_ms))
+
+    monitors = [asyncio.create_task(monitor_loop_lag(lag_samples, stop))]
+    if probe_samples is not None:
+        monitors.append(asyncio.create_task(probe_health(client, probe_samples, stop)))
+    recorder.started = time.perf_counter()
+    await asyncio.gather(*(simulated_client(i) for i in range(args.concurrency)))
+    elapsed = time.perf_counter() - recorder.started
+    stop.set()
+    await asyncio.gather(*monitors)
+    return recorder, elapsed
+
+
+async def run_in_process(args):
+    tmp = tempfile.mkdtemp(prefix="omr_load_")
+    os.environ.setdefault("UPLOAD_DIR", os.path.join(tmp, "up"))
+    os.environ.setdefault("ANSWERKEY_DIR", os.path.join(tmp, "keys"))
+    import main
+    await main.app.router.startup()
+    try:
+        while not main.scoring_pool.ready():
+            await asyncio.sleep(0.05)
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=args.timeout) as client:
+            lag = []
+            recorder, elapsed = await client_fleet(client, args, lag, None)
+        return recorder, elapsed, lag, None, None
+    finally:
+        await main.app.router.shutdown()
+
+
+async def run_against(base_url, args):
+    limits = httpx.Limits(max_connections=args.concurrency + 1, max_keepalive_connections=args.concurrency + 1)
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+        lag, probes = [], []
+        recorder, elapsed = await client_fleet(client, args, lag, probes)
+        try:
+            # the server's own event-loop lag over (roughly) the run
+            server = (await client.get("/metrics/event-loop")).json()
+        except (httpx.HTTPError, ValueError):
+            server = None
+    return recorder, elapsed, lag, probes, server
+
+
+def spawn_server():
+    tmp = tempfile.mkdtemp(prefix="omr_load_")
+    env = dict(os.environ, UPLOAD_DIR=os.path.join(tmp, "up"), ANSWERKEY_DIR=os.path.join(tmp, "keys"))
+    port = _free_port()
+    proc = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+                             "--log-level", "warning"], cwd=os.path.dirname(os.path.abspath(__file__)), env=env)
+    base = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 120
+    while time.time() < deadline:
+        try:
+            if httpx.get(base + "/ready", timeout=1).status_code == 200:
+                return proc, base
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.1)
+    proc.terminate()
+    raise SystemExit("spawned server did not become ready within 120 s")
+
+
+def run(args):
+    proc = None
+    if args.target == "inproc":
+        recorder, elapsed, lag, probes, server = asyncio.run(run_in_process(args))
+    else:
+        if args.target == "spawn":
+            proc, base = spawn_server()
+        else:
+            base = args.target
+        try:
+            recorder, elapsed, lag, probes, server = asyncio.run(run_against(base, args))
+        finally:
+            if proc is not None:
+                proc.terminate()
+                proc.wait(timeout=10)
+    endpoints = recorder.summary()
+    total = sum(e["requests"] for e in endpoints.values())
+    errors = sum(e["errors"] for e in endpoints.values())
+    result = {
+        "meta": {
+            "target": args.target, "concurrency": args.concurrency, "mix": args.mix, "batch_size": args.batch_size,
+            "images": args.images or "data/",
+            "duration_s": round(elapsed, 2), "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "host": platform.node(), "python": platform.python_version(), "cpus": os.cpu_count(),
+            "scoring_workers": os.getenv("OMR_SCORING_WORKERS"), "job_store": os.getenv("OMR_JOB_STORE")
+        },
+        "totals": {"requests": total, "errors": errors, "error_rate": round(errors / total, 4) if total else 0,
+                   "rps": round(total / elapsed, 2) if elapsed else None},
+        "endpoints": endpoints,
+        "loop_lag": summarize(lag)
+    }
+    if probes is not None:
+        result["health_probe"] = summarize(probes)
+    if server is not None:
+        result["server_loop_lag"] = server
+    return result
+
+
+def print_report(result):
+    meta, totals = result["meta"], result["totals"]
+    print(f"target={meta['target']} concurrency={meta['concurrency']} duration={meta['duration_s']}s mix={meta['mix']}")
+    print(f"total: {totals['requests']} requests, {totals['rps']} req/s, error rate {totals['error_rate']:.2%}")
+    print(f"{'endpoint':<18}{'n':>7}{'rps':>8}{'err%':>7}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}")
+    for name, e in result["endpoints"].items():
+        print(f"{name:<18}{e['requests']:>7}{e['rps']:>8}{e['error_rate'] * 100:>7.2f}"
+              f"{e['p50_ms']:>9}{e['p90_ms']:>9}{e['p99_ms']:>9}{e['max_ms']:>9}")
+    for name, e in result["endpoints"].items():
+        peak = max(e["histogram_ms"].values()) or 1
+        print(f"\n{name} latency (ms)")
+        for bound, n in e["histogram_ms"].items():
+            if n:
+                print(f"  <= {bound:>6} {n:>7} {'#' * max(1, round(40 * n / peak))}")
+    for label in ("loop_lag", "health_probe"):
+        if label in result and result[label]["requests"]:
+            s = result[label]
+            print(f"\n{label}: p50 {s['p50_ms']} ms, p99 {s['p99_ms']} ms, max {s['max_ms']} ms")
+    if "server_loop_lag" in result:
+        s = result["server_loop_lag"]["loop_lag"]["recent"]
+        print(f"server_loop_lag: p50 {s['p50_ms']} ms, p99 {s['p99_ms']} ms, max {s['max_ms']} ms")
+
+
+def compare(old, new):
+    """Side-by-side deltas of two saved runs."""
+    def delta(a, b):
+        if a is None or b is None:
+            return "n/a"
+        return f"{b - a:+.2f}" + (f" ({(b - a) / a:+.0%})" if a else "")
+    print(f"{'endpoint':<18}{'metric':<12}{'old':>10}{'new':>10}  delta")
+    rows = [("TOTAL", "rps", old["totals"]["rps"], new["totals"]["rps"]),
+            ("TOTAL", "error_rate", old["totals"]["error_rate"], new["totals"]["error_rate"])]
+    for name in sorted(set(old["endpoints"]) | set(new["endpoints"])):
+        a, b = old["endpoints"].get(name, {}), new["endpoints"].get(name, {})
+        for metric in ("rps", "p50_ms", "p99_ms", "error_rate"):
+            rows.append((name, metric, a.get(metric), b.get(metric)))
+    rows.append(("loop_lag", "p99_ms", old["loop_lag"]["p99_ms"], new["loop_lag"]["p99_ms"]))
+    if "server_loop_lag" in old and "server_loop_lag" in new:
+        rows.append(("server_loop_lag", "p99_ms", old["server_loop_lag"]["loop_lag"]["recent"]["p99_ms"],
+                     new["server_loop_lag"]["loop_lag"]["recent"]["p99_ms"]))
+    for name, metric, a, b in rows:
+        print(f"{name:<18}{metric:<12}{str(a):>10}{str(b):>10}  {delta(a, b)}")
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] == "compare":
+        if len(argv) != 3:
+            raise SystemExit("usage: python loadtest.py compare OLD.json NEW.json")
+        with open(argv[1]) as f_old, open(argv[2]) as f_new:
+            compare(json.load(f_old), json.load(f_new))
+        return 0
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", default="inproc", help="inproc, spawn or a base URL (default inproc)")
+    parser.add_argument("-c", "--concurrency", type=int, default=16, help="simulated clients")
+    parser.add_argument("-d", "--duration", type=float, default=30, help="seconds to run")
+    parser.add_argument("-n", "--requests", type=int, default=None, help="stop after this many operations")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"operation weights (default {DEFAULT_MIX})")
+    parser.add_argument("--batch-size", type=int, default=4, help="sheets per /score-batch call")
+    parser.add_argument("--images", help="directory of sheets to send instead of data/ (e.g. synthetic.py write)")
+    parser.add_argument("--think-ms", type=float, default=0, help="mean pause between a client's operations")
+    parser.add_argument("--csv", default="scores.csv", help="results CSV the scoring traffic writes to")
+    parser.add_argument("--timeout", type=float, default=120, help="per-request timeout, seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save", help="write the results JSON here (default loadtest_results/<timestamp>.json)")
+    parser.add_argument("--compare", help="compare with a saved run after finishing")
+    args = parser.parse_args(argv)
+
+    result = run(args)
+    print_report(result)
+    save = args.save or os.path.join("loadtest_results", time.strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(save) or ".", exist_ok=True)
+    with open(save, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"\nsaved {save}")
+    if args.compare:
+        with open(args.compare) as f:
+            print()
+            compare(json.load(f), result)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
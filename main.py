@@ -1,10 +1,15 @@
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+from fastapi import FastAPI, UploadFile, File, Form, Body, HTTPException, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, HTMLResponse, FileResponse
+from fastapi.responses import JSONResponse, HTMLResponse, FileResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import UploadFile as PageFile
+import io
 import os
+import contextlib
 import json
 import shutil
+import hashlib
+import asyncio
 import re
 import csv
 from pathlib import Path
@@ -12,8 +17,31 @@ import subprocess
 import threading
 import time
 import logging
+from typing import List
 
-from omr_scoring import omr_detect_and_score
+from scoring_workers import make_scorer, NUM_WORKERS
+from blob_store import open_blob_store
+from job_store import file_lock
+from fileio import run_io, atomic_write, atomic_create, io_stats, LoopLagMonitor
+from thresholding import THRESHOLD_MODES, DEFAULT_THRESHOLD_MODE
+from profiles import PROFILES, get_profile, save_set_profile, load_set_profile
+from debug_overlay import TraceCache, render_overlay
+from image_io import MAX_UPLOAD_BYTES, ImageTooLarge, check_image
+from documents import DOCUMENT_EXT, document_kind, iter_pages, parse_roster
+from id_fields import ID_LAYOUT
+from answer_keys import parse_sectionwise_block, import_key_file, validate_key, save_key, load_compiled_key, key_to_options
+from scoring_engine import SECTION_NAMES, load_scheme, save_scheme, max_marks, score_responses, section_scores_dict
+from analytics import CohortAnalytics, csv_aggregates, overall_summary
+from columnar import ColumnarStore
+import similarity
+from results import CSV_HEADERS, append_row, replace_row, read_page, results_version
+from catalog import Catalog
+from submissions import SubmissionStore, file_sha256, default_idempotency_key, submission_params, unpack_marked
+from responses import SheetResponses
+from livecapture import CaptureSession, MAX_FRAME_BYTES
+from quality import SheetRejected, QualityStats
+from tracing import SlowLog, request_trace, span, note_input
+from scheduler import Scheduler, QueueFull, SLOTS, BULK, INTERACTIVE, lane, lane_for
 
 app = FastAPI(title="OMR Proxy + Key Manager")
 app.add_middleware(
@@ -23,6 +51,29 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Whole request bodies above this are refused before they are read (batches carry many sheets)
+MAX_REQUEST_BYTES = int(float(os.getenv("OMR_MAX_REQUEST_MB", "200")) * 1024 * 1024)
+
+@app.middleware("http")
+async def limit_request_size(request: Request, call_next):
+    length = request.headers.get("content-length")
+    if length is not None and length.isdigit() and int(length) > MAX_REQUEST_BYTES:
+        return JSONResponse({"detail": f"Request body exceeds {MAX_REQUEST_BYTES / 2**20:g} MB"}, status_code=413)
+    return await call_next(request)
+
+# Span timings of every request go out as a Server-Timing header; slow requests are kept
+# with their spans for /debug/slow (see tracing.py)
+slow_requests = SlowLog()
+
+@app.middleware("http")
+async def trace_request(request: Request, call_next):
+    with request_trace(request.method, request.url.path) as trace:
+        response = await call_next(request)
+        total_ms = trace.elapsed_ms()
+    response.headers["Server-Timing"] = trace.server_timing(total_ms)
+    slow_requests.record(trace, response.status_code, total_ms)
+    return response
+
 # Use environment variables for cloud deployment
 UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploaded_omr")
 ANSWERKEY_DIR = os.getenv("ANSWERKEY_DIR", "answer_keys")
@@ -31,6 +82,77 @@ ANSWERKEY_DIR = os.getenv("ANSWERKEY_DIR", "answer_keys")
 Path(UPLOAD_DIR).mkdir(parents=True, exist_ok=True)
 Path(ANSWERKEY_DIR).mkdir(parents=True, exist_ok=True)
 
+# Detected answers and scores per exam and set as memory-mapped columns, for exact
+# cohort analytics (and rescoring) without parsing the CSVs
+results_store = ColumnarStore(os.path.join(UPLOAD_DIR, "columnar"))
+
+
+def _rescored_aggregates(exam):
+    """Per set aggregates from the columnar store, under each set's current key and scheme."""
+    aggregates = {}
+    for name in results_store.sets(exam):
+        anskey_file = os.path.join(ANSWERKEY_DIR, f"answers_{name}.json")
+        if os.path.exists(anskey_file):
+            aggregates[name] = results_store.aggregate(exam, name, load_compiled_key(anskey_file),
+                                                       load_scheme(ANSWERKEY_DIR, name))
+    return aggregates
+
+
+def _section_maxima(set_name):
+    """Maximum marks per section under the set's current key and scheme, or None without them."""
+    anskey_file = os.path.join(ANSWERKEY_DIR, f"answers_{set_name}.json")
+    if not os.path.exists(anskey_file):
+        return None
+    try:
+        marks = max_marks(load_compiled_key(anskey_file), load_scheme(ANSWERKEY_DIR, set_name))
+    except ValueError:
+        return None
+    return [marks[s] for s in SECTION_NAMES]
+
+
+def _backfill_analytics(exam):
+    """Seed an exam scored before its analytics snapshot existed: from the columnar store,
+    plus score-only stats from the results CSV for sets the store doesn't have."""
+    aggregates = _rescored_aggregates(exam)
+    aggregates.update(csv_aggregates(os.path.join(UPLOAD_DIR, _sanitize_filename(exam)), skip=aggregates,
+                                     section_maxima=_section_maxima))
+    return aggregates
+
+
+# Running per-exam / per-set aggregates, updated as each sheet is scored
+analytics = CohortAnalytics(os.path.join(UPLOAD_DIR, "analytics"), backfill=_backfill_analytics)
+
+# Uploaded sheets, content addressed; share this (and OMR_JOB_STORE) between nodes
+BLOB_STORE_URL = os.getenv("OMR_BLOB_STORE", "file://" + os.path.join(UPLOAD_DIR, "blobs"))
+blobs = open_blob_store(BLOB_STORE_URL)
+
+# OpenCV detection runs in warm worker processes off the event loop, or on queue workers
+scoring_pool = make_scorer(BLOB_STORE_URL)
+# Detection slots shared fairly between interactive and bulk scoring (see scheduler.py)
+scheduler = Scheduler(SLOTS or NUM_WORKERS)
+
+# Serialises CSV / analytics / submission writes between API processes on this host
+RECORD_LOCK = os.path.join(UPLOAD_DIR, ".record.lock")
+
+# Debug overlays are drawn on request (or right away for low-margin sheets) from the
+# detection trace kept here, so the normal scoring path never renders anything
+DEBUG_DIR = os.path.join(UPLOAD_DIR, "debug")
+DEBUG_MARGIN = float(os.getenv("OMR_DEBUG_MARGIN", "0.05"))
+traces = TraceCache(int(os.getenv("OMR_DEBUG_TRACES", "512")))
+
+# Scored submissions indexed by idempotency key and by (roll number, set)
+submissions = SubmissionStore(os.path.join(UPLOAD_DIR, "submissions.jsonl"))
+
+# Key sets and result CSVs, listed from memory; clients revalidate with ETags or follow /catalog/events
+catalog = Catalog(ANSWERKEY_DIR, UPLOAD_DIR)
+CATALOG_HEARTBEAT = float(os.getenv("OMR_CATALOG_HEARTBEAT_SECONDS", "15"))
+
+# Blocking file work in async handlers goes through fileio.run_io; this shows if some does not
+loop_lag = LoopLagMonitor()
+
+# Outcomes of the image quality gate that runs before detection
+quality_stats = QualityStats()
+
 # Mount static folders so uploaded files and keys are accessible (optional)
 app.mount("/uploads", StaticFiles(directory=UPLOAD_DIR), name="uploads")
 app.mount("/answer_keys", StaticFiles(directory=ANSWERKEY_DIR), name="answer_keys")
@@ -43,172 +165,876 @@ logger = logging.getLogger("omr_api")
 def on_startup():
     logger.info("Starting OMR API")
     logger.info(f"UPLOAD_DIR={UPLOAD_DIR}, ANSWERKEY_DIR={ANSWERKEY_DIR}")
+    scoring_pool.start()
+    catalog.start()
+    loop_lag.start()
 
-SECTIONS = [
-    ("Python", 1, 20),
-    ("EDA", 21, 40),
-    ("SQL", 41, 60),
-    ("Power BI", 61, 80),
-    ("Statistics", 81, 100)
-]
-SECTION_NAMES = [sec for sec, _, _ in SECTIONS]
-ALIASES = {
-    "PowerBI": "Power BI", "Power Bi": "Power BI", "adv stats": "Statistics",
-    "Adv Stats": "Statistics", "statastics": "Statistics", "Statistics": "Statistics"
-}
-
-def parse_sectionwise_block(text):
-    key = {}
-    current_section = None
-    lines = [l.strip() for l in text.splitlines() if l.strip()]
-    # Build case-insensitive alias map for quick lookup
-    alias_map = {k.lower(): v for k, v in ALIASES.items()}
-    section_names_lower = {s.lower(): s for s in SECTION_NAMES}
-    for line in lines:
-        # Section header? (case-insensitive)
-        check = line.strip().lower().rstrip(':')
-        section = section_names_lower.get(check)
-        if section or check in alias_map:
-            # prefer alias mapping, otherwise canonical section name
-            current_section = alias_map.get(check, section or line)
-            if current_section not in key:
-                key[current_section] = {}
-            continue
-        m = re.match(r"(\d+)[\s\-\.]+([a-dA-D, ]+)", line)
-        if m and current_section:
-            qn = m.group(1)
-            ans = m.group(2).replace(" ", "").lower()
-            key[current_section][f"Q{qn}"] = ans
-    # Drop empty sections
-    key = {sec: v for sec, v in key.items() if v}
-    return key
+@app.on_event("shutdown")
+def on_shutdown():
+    loop_lag.stop()
+    with file_lock(RECORD_LOCK):
+        analytics.flush()  # sheets recorded since the last analytics snapshot
+    catalog.stop()
+    scoring_pool.shutdown()
 
 @app.post("/create-bulk-answerkey")
 async def create_bulk_answerkey(set_name: str = Form(...), block: str = Form(...)):
     section_answerkey = parse_sectionwise_block(block)
     if not section_answerkey:
         raise HTTPException(400, "No answers parsed from block, check formatting!")
-    fname = os.path.join(ANSWERKEY_DIR, f"answers_{set_name.upper()}.json")
-    with open(fname, "w", encoding="utf-8") as f:
-        json.dump(section_answerkey, f, indent=2)
-    return JSONResponse({"message": f"Saved sectionwise key as {fname} ({sum(len(x) for x in section_answerkey.values())} questions)."})
+    fname = await run_io(save_key, ANSWERKEY_DIR, set_name, section_answerkey)
+    catalog.add("sets", set_name.upper())
+    return JSONResponse({
+        "message": f"Saved sectionwise key as {fname} ({sum(len(x) for x in section_answerkey.values())} questions).",
+        "issues": validate_key(section_answerkey)
+    })
+
+@app.post("/import-answerkeys")
+async def import_answerkeys(
+    file: UploadFile = File(...),
+    set_name: str = Form(None),
+    strict: bool = Form(False)
+):
+    """Bulk import answer key sets from an XLSX workbook (one sheet per set), CSV or text file"""
+    data = await file.read(MAX_UPLOAD_BYTES + 1)
+    if len(data) > MAX_UPLOAD_BYTES:
+        raise HTTPException(413, f"Answer key file exceeds {MAX_UPLOAD_BYTES / 2**20:g} MB")
+    try:
+        sets = await run_io(import_key_file, file.filename, data, set_name)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    except Exception as e:
+        logger.exception("Failed parsing answer key file")
+        raise HTTPException(400, f"Could not read answer key file: {e}")
+    if not sets:
+        raise HTTPException(400, "No answers parsed from file, check formatting!")
+    issues = {name: validate_key(key) for name, key in sets.items()}
+    if strict and any(issues.values()):
+        raise HTTPException(422, {"message": "Answer keys failed validation", "issues": issues})
+    imported = {}
+    for name, key in sorted(sets.items()):
+        await run_io(save_key, ANSWERKEY_DIR, name, key)
+        catalog.add("sets", name.upper())
+        imported[name] = sum(len(x) for x in key.values())
+    return {"imported": imported, "issues": issues}
 
 @app.get("/key-exists/{set_name}")
 def key_exists(set_name: str):
     path = os.path.join(ANSWERKEY_DIR, f"answers_{set_name.upper()}.json")
     return {"exists": os.path.exists(path)}
 
+@app.get("/marking-scheme/{set_name}")
+def get_marking_scheme(set_name: str):
+    """Marking scheme for a set (defaults: +1 exact match, no negative marking)"""
+    scheme = load_scheme(ANSWERKEY_DIR, set_name)
+    anskey_file = os.path.join(ANSWERKEY_DIR, f"answers_{set_name.upper()}.json")
+    result = {"set": set_name.upper(), "scheme": scheme}
+    if os.path.exists(anskey_file):
+        result["max_marks"] = max_marks(load_compiled_key(anskey_file), scheme)
+    return result
+
+@app.post("/marking-scheme/{set_name}")
+def set_marking_scheme(set_name: str, scheme: dict = Body(...)):
+    """Save a marking scheme: positive/negative marks, multi_answer mode, section_weights, dropped, bonus"""
+    try:
+        saved = save_scheme(ANSWERKEY_DIR, set_name, scheme)
+    except (ValueError, TypeError) as e:
+        raise HTTPException(400, str(e))
+    return {"set": set_name.upper(), "scheme": saved}
+
+@app.get("/processing-profile/{set_name}")
+def get_processing_profile(set_name: str):
+    """Profile sheets of a set are detected with unless a request names one (see /docs)"""
+    configured = _set_profile(set_name)
+    return {"set": set_name.upper(), "profile": configured, "effective": configured or get_profile()["name"],
+            "profiles": PROFILES}
+
+@app.post("/processing-profile/{set_name}")
+def set_processing_profile(set_name: str, profile: str = Form(...)):
+    """Detect this set's sheets with profile fast, balanced or accurate by default"""
+    try:
+        saved = save_set_profile(ANSWERKEY_DIR, set_name, profile)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    return {"set": set_name.upper(), "profile": saved}
+
 ALLOWED_EXT = {".jpg", ".jpeg", ".png"}
 
 def _sanitize_filename(name: str) -> str:
     # simple sanitize: keep alphanum, dash, underscore
     return re.sub(r"[^A-Za-z0-9_\-\.]", "_", name)
 
-@app.post("/upload-omr")
-async def upload_omr(
-    student_name: str = Form(...),
-    roll_no: str = Form(...),
-    omr_set: str = Form(...),
-    file: UploadFile = File(...)
-):
-    # normalize set name to folder-safe form
-    set_folder = re.sub(r'^(set\s*)', '', omr_set.strip(), flags=re.I).strip().upper()
-    set_dir = os.path.join(UPLOAD_DIR, set_folder)
-    os.makedirs(set_dir, exist_ok=True)
+def _normalize_set(omr_set: str) -> str:
+    # remove leading "set" word but don't remove all spaces/characters
+    return re.sub(r'^(set\s*)', '', omr_set.strip(), flags=re.I).strip().upper()
 
-    ext = os.path.splitext(file.filename)[1].lower()
-    if ext not in ALLOWED_EXT:
-        raise HTTPException(400, "Unsupported file type. Use jpg / jpeg / png")
+# (path, mtime_ns, size) -> sha256, so evaluate does not re-hash a sheet it has seen
+_image_hashes = {}
 
+def _image_sha256(path):
+    st = os.stat(path)
+    cache_key = (path, st.st_mtime_ns, st.st_size)
+    if cache_key not in _image_hashes:
+        _image_hashes[cache_key] = file_sha256(path)
+    return _image_hashes[cache_key]
+
+def _upload_base(student_name, roll_no, set_name):
     safe_name = _sanitize_filename(student_name.replace(' ','_'))
     safe_roll = _sanitize_filename(roll_no)
-    base_fname = f"{safe_name}_{safe_roll}_{set_folder}{ext}"
-    save_path = os.path.join(set_dir, base_fname)
+    return f"{safe_name}_{safe_roll}_{set_name}"
+
+def _copy_capped(src, dst_path, limit):
+    """Copy a file object to dst_path in 1 MB chunks; sha256 hex, or None past limit bytes."""
+    digest = hashlib.sha256()
+    size = 0
+    with open(dst_path, "wb") as f:
+        for chunk in iter(lambda: src.read(1 << 20), b""):
+            size += len(chunk)
+            if size > limit:
+                return None
+            digest.update(chunk)
+            f.write(chunk)
+    return digest.hexdigest()
+
+def _receive_image(file, tmp_path):
+    """Copy an uploaded sheet to tmp_path and check its size and pixel count; returns the sha256."""
     try:
-        with open(save_path, "wb") as f:
-            shutil.copyfileobj(file.file, f)
+        sha = _copy_capped(file.file, tmp_path, MAX_UPLOAD_BYTES)
     except Exception as e:
+        # open() itself may have failed: don't let cleanup mask the real error
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp_path)
         logger.exception("Failed saving uploaded OMR")
         raise HTTPException(500, f"Failed to save file: {e}")
-    return JSONResponse({"omr_path": save_path, "filename": base_fname})
+    try:
+        if sha is None:
+            raise ImageTooLarge(f"File exceeds {MAX_UPLOAD_BYTES / 2**20:g} MB")
+        check_image(tmp_path)
+    except ValueError as e:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp_path)
+        raise HTTPException(413 if isinstance(e, ImageTooLarge) else 400, f"{file.filename}: {e}")
+    return sha
 
-@app.post("/evaluate")
-async def evaluate(
-    student_name: str = Form(...),
-    roll_no: str = Form(...),
-    omr_set: str = Form(...),
-    csv_filename: str = Form(None)
-):
-    # Normalize set names: remove leading "set" word but don't remove all spaces/characters
-    set_name = re.sub(r'^(set\s*)', '', omr_set.strip(), flags=re.I).strip().upper()
+def _save_upload(student_name, roll_no, set_name, file):
+    """Store an uploaded sheet as <UPLOAD_DIR>/<SET>/<name>_<roll>_<SET>[_v<n>]<ext>.
+
+    Re-uploading identical bytes is a no-op; a different scan for the same student gets
+    the next _v<n> name instead of overwriting the earlier one. The upload is copied in
+    1 MB chunks and refused (413) past MAX_UPLOAD_BYTES or the pixel limit, which is read
+    from the image header before anything is decoded."""
+    ext = os.path.splitext(file.filename)[1].lower()
+    if ext not in ALLOWED_EXT:
+        raise HTTPException(400, "Unsupported file type. Use jpg / jpeg / png")
+    set_dir = os.path.join(UPLOAD_DIR, set_name)
+    os.makedirs(set_dir, exist_ok=True)
+    base = _upload_base(student_name, roll_no, set_name)
+    tmp_path = os.path.join(set_dir, f".{base}{ext}.part")
+    sha = _receive_image(file, tmp_path)
+    existing = _find_upload(student_name, roll_no, set_name)
+    if existing and _image_sha256(existing) == sha:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp_path)
+        blobs.put_file(existing, sha)
+        return existing, os.path.basename(existing), sha
+    n = 1
+    base_fname = f"{base}{ext}"
+    while any(os.path.exists(os.path.join(set_dir, f"{base}{'' if n == 1 else f'_v{n}'}{e}")) for e in ALLOWED_EXT):
+        n += 1
+        base_fname = f"{base}_v{n}{ext}"
+    save_path = os.path.join(set_dir, base_fname)
+    os.replace(tmp_path, save_path)
+    blobs.put_file(save_path, sha)
+    return save_path, base_fname, sha
+
+def _stage_upload(file):
+    """Store a sheet whose student is not known yet as <UPLOAD_DIR>/unidentified/<sha256><ext>."""
+    ext = os.path.splitext(file.filename)[1].lower()
+    if ext not in ALLOWED_EXT:
+        raise HTTPException(400, "Unsupported file type. Use jpg / jpeg / png")
+    stage_dir = os.path.join(UPLOAD_DIR, "unidentified")
+    os.makedirs(stage_dir, exist_ok=True)
+    tmp_path = os.path.join(stage_dir, f".{os.getpid()}_{id(file)}{ext}.part")
+    sha = _receive_image(file, tmp_path)
+    staged = os.path.join(stage_dir, sha + ext)
+    os.replace(tmp_path, staged)
+    return staged, sha
+
+def _stage_preview(file):
+    """Write a frame that is only previewed to a private temp file; returns (path, sha256).
+    The caller _discard()s it after detection."""
+    stage_dir = os.path.join(UPLOAD_DIR, "unidentified")
+    os.makedirs(stage_dir, exist_ok=True)
+    path = os.path.join(stage_dir, f".preview_{os.getpid()}_{id(file)}{os.path.splitext(file.filename)[1].lower()}")
+    return path, _receive_image(file, path)
+
+def _discard(path):
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(path)
+
+def _find_upload(student_name, roll_no, set_name):
+    """Latest stored scan for a student (highest _v<n>), or None."""
+    set_dir = os.path.join(UPLOAD_DIR, set_name)
+    names = [
+        _upload_base(student_name, roll_no, set_name),
+        f"{student_name.replace(' ','_')}_{roll_no}_{set_name}"
+    ]
+    for base in names:
+        found, n = None, 1
+        while True:
+            suffix = "" if n == 1 else f"_v{n}"
+            candidate = next((os.path.join(set_dir, base + suffix + ext) for ext in (".jpg", ".jpeg", ".png")
+                              if os.path.exists(os.path.join(set_dir, base + suffix + ext))), None)
+            if candidate is None:
+                break
+            found, n = candidate, n + 1
+        if found:
+            return found
+    return None
+
+def _threshold_mode(mode):
+    mode = (mode or DEFAULT_THRESHOLD_MODE).strip().lower()
+    if mode not in THRESHOLD_MODES:
+        raise HTTPException(400, f"threshold_mode must be one of {', '.join(THRESHOLD_MODES)}")
+    return mode
+
+def _profile(profile):
+    """A requested profile name, validated; None leaves the choice to the set / server default."""
+    if not profile:
+        return None
+    try:
+        return get_profile(profile)["name"]
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+def _answer_key_file(set_name):
     anskey_file = os.path.join(ANSWERKEY_DIR, f"answers_{set_name}.json")
     if not os.path.exists(anskey_file):
         raise HTTPException(400, f"Answer key for set {set_name} not found. Upload that first.")
-    set_dir = os.path.join(UPLOAD_DIR, set_name)
-    img_file = None
-    for ext in (".jpg", ".jpeg", ".png"):
-        candidate = os.path.join(set_dir, f"{student_name.replace(' ','_')}_{roll_no}_{set_name}{ext}")
-        if os.path.exists(candidate):
-            img_file = candidate
-            break
-    if not img_file:
-        raise HTTPException(400, "OMR image file not found for this student/set.")
+    return anskey_file
+
+def _set_profile(set_name):
     try:
-        detected_sectionwise, section_scores = omr_detect_and_score(img_file, anskey_file)
+        return load_set_profile(ANSWERKEY_DIR, set_name)
+    except ValueError as e:
+        raise HTTPException(409, f"Bad profile file for set {set_name.upper()}: {e}. "
+                                 f"Save it again with POST /processing-profile/{set_name.upper()}")
+
+def _set_config(set_name):
+    """Compiled key, marking scheme and processing profile (or None) of a set. A stored
+    scheme or profile that no longer loads is a 409 naming the set, not a scoring error."""
+    anskey_file = _answer_key_file(set_name)
+    try:
+        scheme = load_scheme(ANSWERKEY_DIR, set_name)
+    except ValueError as e:
+        raise HTTPException(409, f"Bad marking scheme file for set {set_name}: {e}. "
+                                 f"Save it again with POST /marking-scheme/{set_name}")
+    return load_compiled_key(anskey_file), scheme, _set_profile(set_name)
+
+async def _detect(img_file, image_sha, threshold_mode, profile=None):
+    note_input(image=img_file, image_sha256=image_sha, mode=threshold_mode or DEFAULT_THRESHOLD_MODE,
+               profile=profile or get_profile()["name"])
+    try:
+        async with scheduler.slot():
+            with span("detect"):
+                detected = await scoring_pool.detect(img_file, image_sha, threshold_mode, profile)
+    except SheetRejected as e:
+        quality_stats.record(e.quality, rejected=True)
+        raise HTTPException(422, {"message": str(e), "reasons": e.quality["reasons"], "quality": e.quality})
     except Exception as e:
         raise HTTPException(500, f"OMR detection error: {e}")
+    quality_stats.record(detected[1].get("quality"))
+    return detected
+
+def _client_id(request):
+    """Who a request counts against for OMR_CLIENT_CONCURRENCY: its X-Client-Id header (the
+    UI sends one per browser session), else the peer address."""
+    return request.headers.get("x-client-id") or (request.client.host if request.client else None)
+
+@contextlib.contextmanager
+def _admission(lane_name):
+    """Hold a place in the lane's queue for the request in the block; 429 when it is full."""
+    try:
+        scheduler.admit(lane_name)
+    except QueueFull as e:
+        raise HTTPException(429, str(e), headers={"Retry-After": str(e.retry_after)})
+    try:
+        yield
+    finally:
+        scheduler.finish(lane_name)
+
+# idempotency key -> (request params, future of the submission currently being scored)
+_inflight = {}
+
+def _check_params(idempotency_key, stored_params, params):
+    """A key reused with other options would silently return a result for the wrong request."""
+    if stored_params != params:
+        changed = ", ".join(k for k in params if stored_params.get(k) != params[k])
+        raise HTTPException(409, f"Idempotency key {idempotency_key} was already used with a different {changed}")
+
+async def _score_and_record(student_name, roll_no, set_name, img_file, csv_filename, idempotency_key=None,
+                            threshold_mode=None, detected=None, profile=None):
+    """Score a stored sheet, append its CSV row and update the running analytics.
+
+    Submissions are idempotent: a key (default roll number + set + image hash, plus any
+    non-default results file / threshold mode / profile) that was already scored returns
+    the stored result without rescoring or writing a row. Reusing a key with other
+    options is a 409."""
+    with span("hash"):
+        image_sha = await run_io(_image_sha256, img_file)
+    params = submission_params(csv_filename, threshold_mode, profile)
+    idempotency_key = idempotency_key or default_idempotency_key(roll_no, set_name, image_sha, params)
+    stored = await run_io(submissions.get, idempotency_key)
+    if stored is not None:
+        _check_params(idempotency_key, stored.get("params", params), params)
+        return dict(stored["result"], duplicate=True, version=stored["version"], idempotency_key=idempotency_key)
+    if idempotency_key in _inflight:
+        # a concurrent retry of the same submission waits for the first one
+        pending_params, pending = _inflight[idempotency_key]
+        _check_params(idempotency_key, pending_params, params)
+        result = await asyncio.shield(pending)
+        return dict(result, duplicate=True)
+
+    pending = asyncio.get_running_loop().create_future()
+    _inflight[idempotency_key] = (params, pending)
+    try:
+        result = await _score_new_submission(student_name, roll_no, set_name, img_file, csv_filename,
+                                             idempotency_key, image_sha, threshold_mode, detected, profile, params)
+        pending.set_result(result)
+        return result
+    except BaseException as e:
+        pending.set_exception(e)
+        pending.exception()  # mark retrieved when nobody else is waiting
+        raise
+    finally:
+        del _inflight[idempotency_key]
+
+async def _score_new_submission(student_name, roll_no, set_name, img_file, csv_filename, idempotency_key, image_sha,
+                                threshold_mode=None, detected=None, profile=None, params=None):
+    with span("key"):
+        key_bits, scheme, set_profile = await run_io(_set_config, set_name)
+    # the request's profile, else the set's, else the server default
+    profile = profile or set_profile or get_profile()["name"]
+    if detected is not None and detected[1].get("profile") != profile:
+        detected = None  # identified before the set (and so its profile) was known
+    marked, detection, trace = detected or await _detect(img_file, image_sha, threshold_mode, profile)
+    traces.put((image_sha, detection["mode"], detection["profile"]), trace)
+    with span("score"):
+        responses = SheetResponses.from_marked(marked)
+        result = score_responses(responses, key_bits, scheme)
+        section_scores = section_scores_dict(result)
 
     # Use selected CSV file or default to scores.csv
-    if csv_filename:
-        outcsv = os.path.join(UPLOAD_DIR, csv_filename)
-    else:
-        outcsv = os.path.join(UPLOAD_DIR, "scores.csv")
+    csv_file = csv_filename or "scores.csv"
+    outcsv = os.path.join(UPLOAD_DIR, csv_file)
     
-    # Calculate percentage (assuming total possible marks is 100)
-    total_possible = 100
+    # Maximum marks follow the set's marking scheme (dropped / bonus questions, weights)
+    total_possible = max_marks(key_bits, scheme)["Total"]
     percentage = round((section_scores["Total"] / total_possible) * 100, 2) if total_possible > 0 else 0
     
-    # Prepare row data with all required columns
-    row = [
-        student_name,  # Student Name
-        roll_no,       # Roll Number
-        section_scores.get("Python", 0),      # Python
-        section_scores.get("EDA", 0),         # EDA
-        section_scores.get("SQL", 0),         # SQL
-        section_scores.get("Power BI", 0),    # Power BI
-        section_scores.get("Statistics", 0),  # Statistics
-        section_scores["Total"],              # Marks Obtained
-        total_possible,                       # Total Marks
-        percentage,                           # Percentage
-        set_name                              # Set Name
-    ]
-    
-    # Check if file exists and has headers
-    is_new = not os.path.exists(outcsv)
-    if is_new:
-        # Create new file with headers
-        headers = ["Student Name", "Roll Number", "Python", "EDA", "SQL", "Power BI", "Statistics", 
-                  "Marks Obtained", "Total Marks", "Percentage", "Set Name"]
-        with open(outcsv, "w", newline="", encoding="utf-8") as fcsv:
-            writer = csv.writer(fcsv)
-            writer.writerow(headers)
-            writer.writerow(row)
-    else:
-        # Append to existing file
-        with open(outcsv, "a", newline="", encoding="utf-8") as fcsv:
-            writer = csv.writer(fcsv)
-            writer.writerow(row)
-
-    return {
+    row = [student_name, roll_no] + [section_scores.get(s, 0) for s in SECTION_NAMES] + [
+        section_scores["Total"], total_possible, percentage, set_name]
+    response = {
         "name": student_name,
         "roll_no": roll_no,
         "set": set_name,
         "score": section_scores["Total"],
         "section_scores": section_scores,
+        "total_possible": total_possible,
         "percentage": percentage,
-        "csv_file": csv_filename or "scores.csv"
+        "csv_file": csv_file,
+        "detection": detection,
+        "debug_url": f"/debug/{idempotency_key}"
     }
 
+    def record_submission():
+        # CSV, analytics, columnar store and submission log: on the I/O pool, one process at a time
+        with file_lock(RECORD_LOCK):
+            # another API process may have recorded the same submission while we scored it
+            stored = submissions.get(idempotency_key)
+            if stored is not None:
+                _check_params(idempotency_key, stored.get("params", params), params)
+                return stored, True, False
+            # A genuinely new scan of an already scored student supersedes the earlier row
+            previous = submissions.latest(roll_no, set_name)
+            replaces = None
+            if previous is not None and previous["csv_file"] == csv_file:
+                old_responses = SheetResponses.from_hex(previous["marked"])
+                replaces = (old_responses, score_responses(old_responses, key_bits, scheme))
+            # before the CSV write, so a first-use backfill from the CSV doesn't count this row twice
+            analytics.record(csv_file, set_name, responses, result, key_bits, replaces=replaces)
+            if replaces is not None:
+                replace_row(outcsv, roll_no, set_name, row)
+            else:
+                append_row(outcsv, row)
+                catalog.add("files", csv_file)
+            compact_due = results_store.append(csv_file, set_name, roll_no, responses, result)
+            return submissions.add({
+                "idempotency_key": idempotency_key,
+                "roll_no": roll_no,
+                "set": set_name,
+                "image": img_file,
+                "image_sha256": image_sha,
+                "csv_file": csv_file,
+                "params": params,
+                "marked": responses.to_hex(),
+                "result": response
+            }), False, compact_due
+
+    with span("record"):
+        record, duplicate, compact_due = await run_io(record_submission)
+    if duplicate:
+        return dict(record["result"], duplicate=True, version=record["version"], idempotency_key=idempotency_key)
+    if detection.get("margin") is not None and detection["margin"] < DEBUG_MARGIN:
+        # low confidence: have the overlay ready by the time someone reviews the sheet
+        task = asyncio.create_task(_prerender_debug_overlay(record))
+        _background.add(task)
+        task.add_done_callback(_background.discard)
+    if compact_due:
+        task = asyncio.create_task(_compact_results(csv_file, set_name))
+        _background.add(task)
+        task.add_done_callback(_background.discard)
+    return dict(response, duplicate=False, version=record["version"], idempotency_key=idempotency_key)
+
+_background = set()
+
+async def _prerender_debug_overlay(record):
+    try:
+        with lane(BULK):  # nobody is waiting for it: never ahead of a sheet being scored
+            await _debug_overlay(record)
+    except Exception:
+        logger.exception("Failed rendering debug overlay")
+
+async def _compact_results(csv_file, set_name):
+    try:
+        await run_io(results_store.compact, csv_file, set_name)
+    except Exception:
+        logger.exception("Failed compacting columnar results")
+
+async def _debug_overlay(record):
+    """Path of the overlay PNG for a stored submission, rendering it on first use."""
+    detection = record["result"].get("detection") or {"mode": "fixed"}
+    profile = detection.get("profile") or "balanced"
+    # marks are coloured against the key: a re-uploaded key needs a fresh overlay
+    key_version = await run_io(_key_version, record["set"])
+    png_path = os.path.join(DEBUG_DIR, f"{record['image_sha256']}_{detection['mode']}_{profile}_{key_version}.png")
+    if await run_io(os.path.exists, png_path):
+        return png_path
+    image, key_options = await run_io(_overlay_sources, record)
+    trace = traces.get((record["image_sha256"], detection["mode"], profile))
+    if trace is None:
+        # evicted or scored by another process: the only case that detects again, in the caller's lane
+        async with scheduler.slot():
+            _, _, trace = await scoring_pool.detect(image, record["image_sha256"], detection["mode"], profile)
+    png = await asyncio.to_thread(render_overlay, image, trace, unpack_marked(record["marked"]), detection, key_options)
+    await run_io(_write_file, png_path, png)
+    return png_path
+
+def _overlay_sources(record):
+    """Sheet image to draw on and the key's option matrix (None if the key is gone)."""
+    image = record["image"] if os.path.exists(record["image"]) else blobs.local_path(record["image_sha256"])
+    anskey_file = os.path.join(ANSWERKEY_DIR, f"answers_{record['set']}.json")
+    key_options = key_to_options(load_compiled_key(anskey_file)) if os.path.exists(anskey_file) else None
+    return image, key_options
+
+def _key_version(set_name):
+    """Change token of a set's answer key file ("nokey" when there is none)."""
+    try:
+        return f"{os.stat(os.path.join(ANSWERKEY_DIR, f'answers_{set_name}.json')).st_mtime_ns:x}"
+    except FileNotFoundError:
+        return "nokey"
+
+def _write_file(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with atomic_write(path, "wb") as f:
+        f.write(data)
+
+@app.get("/debug/slow")
+def slow_request_log(limit: int = 50):
+    """Recent requests slower than OMR_TRACE_SLOW_MS with their span timings, newest first.
+    Sampled ones (OMR_TRACE_SAMPLE) list their input sheets for `python tracing.py replay`"""
+    return slow_requests.snapshot(limit)
+
+@app.get("/debug/{submission:path}")
+async def debug_overlay(submission: str, request: Request):
+    """Annotated grid for a scored submission (by idempotency key): crop, bubble boxes with
+    darkness, question numbers, column split and marks coloured against the key"""
+    record = await run_io(submissions.get, submission)
+    if record is None:
+        raise HTTPException(404, "Submission not found")
+    try:
+        with _admission(INTERACTIVE), lane(INTERACTIVE, _client_id(request)):
+            png_path = await _debug_overlay(record)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(500, f"Could not render debug overlay: {e}")
+    return FileResponse(png_path, media_type="image/png")
+
+@app.post("/upload-omr")
+async def upload_omr(
+    student_name: str = Form(...),
+    roll_no: str = Form(...),
+    omr_set: str = Form(...),
+    file: UploadFile = File(...)
+):
+    set_name = _normalize_set(omr_set)
+    save_path, base_fname, sha = await run_io(_save_upload, student_name, roll_no, set_name, file)
+    return JSONResponse({"omr_path": save_path, "filename": base_fname, "image_sha256": sha,
+                         "idempotency_key": default_idempotency_key(roll_no, set_name, sha)})
+
+@app.post("/evaluate")
+async def evaluate(
+    request: Request,
+    student_name: str = Form(...),
+    roll_no: str = Form(...),
+    omr_set: str = Form(...),
+    csv_filename: str = Form(None),
+    idempotency_key: str = Form(None),
+    threshold_mode: str = Form(None),
+    profile: str = Form(None)
+):
+    """Score an uploaded sheet. threshold_mode: fixed, adaptive or local; profile: fast,
+    balanced or accurate (default: the set's profile, then OMR_PROFILE)"""
+    set_name = _normalize_set(omr_set)
+    threshold_mode = _threshold_mode(threshold_mode)
+    profile = _profile(profile)
+    lane_name = lane_for(1, request.headers.get("x-omr-lane"))
+    with _admission(lane_name):
+        with span("key"):
+            await run_io(_answer_key_file, set_name)
+        with span("probe"):
+            img_file = await run_io(_find_upload, student_name, roll_no, set_name)
+        if not img_file:
+            raise HTTPException(400, "OMR image file not found for this student/set.")
+        with lane(lane_name, _client_id(request)):
+            return await _score_and_record(student_name, roll_no, set_name, img_file, csv_filename, idempotency_key,
+                                           threshold_mode, profile=profile)
+
+def _adopt_staged(staged, student_name, roll_no, set_name):
+    """Move a sheet identified from its ID bubbles to its student's upload name."""
+    with open(staged, "rb") as f:
+        img_file, _, _ = _save_upload(student_name, roll_no, set_name, PageFile(f, filename=os.path.basename(staged)))
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(staged)  # the same scan may have been identified concurrently
+    return img_file
+
+def _reads_roll_no():
+    return bool(ID_LAYOUT and "roll_no" in ID_LAYOUT)
+
+async def _score_upload(file, student_name, roll_no, set_name, csv_filename, idempotency_key=None,
+                        threshold_mode=None, names=None, profile=None):
+    """Save and score one uploaded sheet. Whatever the form left out (roll number, set) is
+    read from the sheet's ID bubbles (OMR_ID_LAYOUT); names maps roll numbers read that way
+    to student names, which otherwise default to the roll number."""
+    if roll_no and set_name:
+        with span("save"):
+            img_file, _, _ = await run_io(_save_upload, student_name or roll_no, roll_no, set_name, file)
+        return await _score_and_record(student_name or roll_no, roll_no, set_name, img_file, csv_filename,
+                                       idempotency_key, threshold_mode, profile=profile)
+    for given, field, label in ((roll_no, "roll_no", "Roll number"), (set_name, "set_code", "Set")):
+        if not given and not (ID_LAYOUT and field in ID_LAYOUT):
+            raise HTTPException(400, f"{label} is required: this server does not read {field} from sheets (OMR_ID_LAYOUT)")
+    with span("save"):
+        staged, sha = await run_io(_stage_upload, file)
+    detected = await _detect(staged, sha, threshold_mode, profile)
+    fields = detected[1].get("fields", {})
+    if not roll_no:
+        if not fields["roll_no"]["complete"]:
+            raise HTTPException(422, {"message": f"Could not read the roll number ({fields['roll_no']['value']})",
+                                      "fields": fields, "image_sha256": sha})
+        roll_no = fields["roll_no"]["value"]
+    if not set_name:
+        if not fields["set_code"]["complete"]:
+            raise HTTPException(422, {"message": "Could not read the set code", "fields": fields, "image_sha256": sha})
+        set_name = _normalize_set(fields["set_code"]["value"])
+        await run_io(_answer_key_file, set_name)
+    student_name = student_name or (names or {}).get(roll_no, roll_no)
+    img_file = await run_io(_adopt_staged, staged, student_name, roll_no, set_name)
+    return await _score_and_record(student_name, roll_no, set_name, img_file, csv_filename, idempotency_key,
+                                   threshold_mode, detected, profile)
+
+@app.post("/score-batch")
+async def score_batch(
+    request: Request,
+    files: List[UploadFile] = File(...),
+    student_names: List[str] = Form(None),
+    roll_nos: List[str] = Form(None),
+    omr_set: str = Form(None),
+    csv_filename: str = Form(None),
+    idempotency_keys: List[str] = Form(None),
+    threshold_mode: str = Form(None),
+    profile: str = Form(None)
+):
+    """Upload and score several sheets in one request; the i-th file belongs to the i-th name / roll.
+    Roll numbers and the set may be left out (or blank) when the sheets carry ID bubbles.
+    Batches of up to OMR_INTERACTIVE_MAX_SHEETS sheets are scored in the interactive lane,
+    larger ones (or with an X-OMR-Lane: bulk header) in the bulk lane."""
+    student_names = student_names or [""] * len(files)
+    roll_nos = roll_nos or [""] * len(files)
+    if not (len(files) == len(student_names) == len(roll_nos)):
+        raise HTTPException(400, "files, student_names and roll_nos must have the same length")
+    if idempotency_keys and len(idempotency_keys) != len(files):
+        raise HTTPException(400, "idempotency_keys must have one entry per file")
+    idempotency_keys = idempotency_keys or [None] * len(files)
+    set_name = _normalize_set(omr_set) if omr_set else None
+    threshold_mode = _threshold_mode(threshold_mode)
+    profile = _profile(profile)
+    lane_name = lane_for(len(files), request.headers.get("x-omr-lane"))
+    with _admission(lane_name):
+        if set_name:
+            await run_io(_answer_key_file, set_name)
+        results = []
+        for file, student_name, roll_no, idem_key in zip(files, student_names, roll_nos, idempotency_keys):
+            try:
+                with lane(lane_name, _client_id(request)):
+                    result = await _score_upload(file, student_name.strip(), roll_no.strip(), set_name, csv_filename,
+                                                 idem_key or None, threshold_mode, profile=profile)
+                results.append(dict(result, ok=True, filename=file.filename))
+            except HTTPException as e:
+                results.append({"ok": False, "filename": file.filename, "name": student_name,
+                                "roll_no": roll_no, "error": e.detail})
+        return {"results": results, "version": results_version(os.path.join(UPLOAD_DIR, csv_filename or "scores.csv"))}
+
+# Pages of a scanned stack being extracted or scored at once; bounds memory per document
+PAGE_WINDOW = int(os.getenv("OMR_PAGE_WINDOW", "8"))
+
+def _save_document(file):
+    """Store a PDF / TIFF stack as <UPLOAD_DIR>/documents/<sha256><ext>; returns (path, sha)."""
+    ext = os.path.splitext(file.filename)[1].lower()
+    if ext not in DOCUMENT_EXT:
+        raise HTTPException(400, "Unsupported document type. Use pdf / tif / tiff")
+    doc_dir = os.path.join(UPLOAD_DIR, "documents")
+    os.makedirs(doc_dir, exist_ok=True)
+    tmp_path = os.path.join(doc_dir, f".{os.getpid()}_{id(file)}{ext}.part")
+    try:
+        sha = _copy_capped(file.file, tmp_path, MAX_REQUEST_BYTES)
+        if sha is None:
+            raise HTTPException(413, f"Document exceeds {MAX_REQUEST_BYTES / 2**20:g} MB")
+        if document_kind(tmp_path) is None:
+            raise HTTPException(400, f"{file.filename} is not a PDF or TIFF document")
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp_path)
+        raise
+    path = os.path.join(doc_dir, sha + ext)
+    os.replace(tmp_path, path)
+    return path, sha
+
+@app.post("/score-document")
+async def score_document(
+    request: Request,
+    file: UploadFile = File(...),
+    omr_set: str = Form(None),
+    roster: UploadFile = File(None),
+    csv_filename: str = Form(None),
+    threshold_mode: str = Form(None),
+    profile: str = Form(None)
+):
+    """Score a multi-page PDF / TIFF scan, one sheet per page. A roster CSV (name, roll no,
+    optional page columns) says whose sheet each page is; on sheets with ID bubbles the
+    roll number and set are read from the page, and the roster only supplies names.
+    Documents are scored in the bulk lane."""
+    set_name = _normalize_set(omr_set) if omr_set else None
+    threshold_mode = _threshold_mode(threshold_mode)
+    profile = _profile(profile)
+    lane_name = lane_for(None)
+    with _admission(lane_name):
+        if set_name:
+            await run_io(_answer_key_file, set_name)
+        try:
+            entries = parse_roster(await roster.read(MAX_UPLOAD_BYTES)) if roster else []
+        except (ValueError, UnicodeDecodeError) as e:
+            raise HTTPException(400, f"Could not read roster: {e}")
+        if not entries and not _reads_roll_no():
+            raise HTTPException(400, "A roster is required: this server does not read roll numbers from sheets")
+        students = {page: (name, roll) for page, name, roll in entries if page is not None}
+        if entries and not students and not _reads_roll_no():
+            students = {number: (name, roll) for number, (_, name, roll) in enumerate(entries, 1)}
+        names = {roll: name for _, name, roll in entries}
+        doc_path, doc_sha = await run_io(_save_document, file)
+        stem = _sanitize_filename(os.path.splitext(file.filename)[0])
+
+        async def score_page(number, ext, data, error):
+            result = {"page": number}
+            try:
+                if error:
+                    raise HTTPException(400, error)
+                if number not in students and not _reads_roll_no():
+                    raise HTTPException(400, f"page {number} has no roster entry")
+                student_name, roll_no = students.get(number, (None, None))
+                if roll_no:
+                    result.update(name=student_name, roll_no=roll_no)
+                page_file = PageFile(io.BytesIO(data), filename=f"{stem}_p{number}{ext}")
+                result.update(await _score_upload(page_file, student_name, roll_no, set_name, csv_filename,
+                                                  None, threshold_mode, names, profile), ok=True)
+            except HTTPException as e:
+                result.update(ok=False, error=e.detail)
+            finally:
+                window.release()
+            return result
+
+        # Pages are extracted one at a time on a thread and scored concurrently, with at
+        # most PAGE_WINDOW pages in memory; scoring itself is throttled by the worker pool
+        window = asyncio.Semaphore(PAGE_WINDOW)
+        pages = iter_pages(doc_path)
+        tasks = []
+        try:
+            with lane(lane_name, _client_id(request)):  # the page tasks take the lane with them
+                while True:
+                    await window.acquire()
+                    page = await asyncio.to_thread(next, pages, None)
+                    if page is None:
+                        window.release()
+                        break
+                    tasks.append(asyncio.create_task(score_page(*page)))
+        except ValueError as e:
+            raise HTTPException(400, f"Could not read document: {e}")
+        finally:
+            pages.close()
+            results = await asyncio.gather(*tasks)
+        missing = sorted(set(students) - {r["page"] for r in results})
+        return {"document_sha256": doc_sha, "pages": len(results), "results": results,
+                "roster_pages_missing": missing,
+                "version": results_version(os.path.join(UPLOAD_DIR, csv_filename or "scores.csv"))}
+
+def _frame_ext(data):
+    return ".png" if data[:8] == b"\x89PNG\r\n\x1a\n" else ".jpg"
+
+async def _read_live_messages(websocket, inbox):
+    """Queue a live capture's messages (frame bytes / text) as they arrive; None at the end."""
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            inbox.put_nowait(message["bytes"] if message.get("bytes") is not None else message.get("text"))
+    finally:
+        inbox.put_nowait(None)
+
+async def _live_result(frame, set_name, student_name, roll_no, csv_filename, threshold_mode, profile):
+    """Score the chosen frame of a live capture: recorded like /evaluate when the student is
+    known, otherwise a preview that stores nothing (the frame is deleted after detection)."""
+    seq, data, quality = frame
+    start = time.perf_counter()
+    page_file = PageFile(io.BytesIO(data), filename=f"live{_frame_ext(data)}")
+    if roll_no:
+        result = await _score_upload(page_file, student_name, roll_no, set_name, csv_filename,
+                                     None, threshold_mode, profile=profile)
+    else:
+        key_bits, scheme, set_profile = await run_io(_set_config, set_name)
+        preview, sha = await run_io(_stage_preview, page_file)
+        try:
+            marked, detection, _ = await _detect(preview, sha, threshold_mode,
+                                                 profile or set_profile or get_profile()["name"])
+        finally:
+            await run_io(_discard, preview)
+        responses = SheetResponses.from_marked(marked)
+        section_scores = section_scores_dict(score_responses(responses, key_bits, scheme))
+        total_possible = max_marks(key_bits, scheme)["Total"]
+        result = {"set": set_name, "score": section_scores["Total"], "section_scores": section_scores,
+                  "total_possible": total_possible,
+                  "percentage": round(section_scores["Total"] / total_possible * 100, 2) if total_possible > 0 else 0,
+                  "responses": responses.to_sectionwise(), "detection": detection, "image_sha256": sha}
+    return {"type": "result", "seq": seq, "quality": quality, "result": result,
+            "elapsed_ms": round((time.perf_counter() - start) * 1000, 1)}
+
+@app.websocket("/live-capture")
+async def live_capture(websocket: WebSocket, omr_set: str, student_name: str = None, roll_no: str = None,
+                       csv_filename: str = None, threshold_mode: str = None, profile: str = None):
+    """Score a sheet held up to a camera. Send downscaled frames (JPEG / PNG bytes) as binary
+    messages; each gets a {"type": "frame"} quality report (grid found, sharpness, skew) and
+    the best frame of a steady run is scored once ({"type": "result"}). Text messages:
+    {"action": "capture"} scores the best frame so far, {"action": "next"} waits for the
+    next sheet. With a roll_no the result is recorded like /evaluate, else it is a preview."""
+    await websocket.accept()
+    try:
+        set_name = _normalize_set(omr_set)
+        threshold_mode = _threshold_mode(threshold_mode)
+        profile = _profile(profile)
+        await run_io(_answer_key_file, set_name)
+    except HTTPException as e:
+        await websocket.send_json({"type": "error", "detail": e.detail})
+        await websocket.close(code=1008)
+        return
+    session = CaptureSession()
+    client = _client_id(websocket)
+    inbox = asyncio.Queue()
+    reader = asyncio.create_task(_read_live_messages(websocket, inbox))
+
+    async def score(frame):
+        if frame is None:
+            detail = ("No frame has passed the quality check yet" if session.armed else
+                      'This sheet was scored; send {"action": "next"} for the next one')
+            await websocket.send_json({"type": "error", "detail": detail})
+            return
+        try:
+            with _admission(INTERACTIVE), lane(INTERACTIVE, client):
+                event = await _live_result(frame, set_name, student_name or roll_no, roll_no, csv_filename,
+                                           threshold_mode, profile)
+        except HTTPException as e:
+            session.rearm()  # the frame passed the check but not detection: keep looking
+            event = {"type": "error", "seq": frame[0], "detail": e.detail}
+        await websocket.send_json(dict(event, **session.stats()))
+
+    try:
+        while True:
+            messages = [await inbox.get()]
+            while not inbox.empty():
+                messages.append(inbox.get_nowait())
+            frames = [m for m in messages if isinstance(m, bytes)]
+            # checks fall behind a fast camera: only the newest waiting frame is checked
+            session.dropped += max(0, len(frames) - 1)
+            for message in messages:
+                if message is None:
+                    return
+                if isinstance(message, bytes):
+                    if message is not frames[-1]:
+                        continue
+                    if len(message) > MAX_FRAME_BYTES:
+                        await websocket.send_json({"type": "error", "detail": f"Frame exceeds {MAX_FRAME_BYTES / 2**20:g} MB"})
+                        continue
+                    try:
+                        quality = await scoring_pool.check_frame(message)
+                    except ImageTooLarge as e:
+                        await websocket.send_json({"type": "error", "detail": str(e)})
+                        continue
+                    if quality is None:
+                        await websocket.send_json({"type": "error", "detail": "Frame is not a JPEG / PNG image"})
+                        continue
+                    await websocket.send_json(session.add(message, quality))
+                    if session.ready():
+                        await score(session.take())
+                    continue
+                try:
+                    action = json.loads(message).get("action")
+                except (ValueError, AttributeError):
+                    action = None
+                if action == "capture":
+                    await score(session.take(force=True))
+                elif action == "next":
+                    session.rearm()
+                    await websocket.send_json({"type": "armed"})
+                else:
+                    await websocket.send_json({"type": "error", "detail": 'Expected {"action": "capture" | "next"}'})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        reader.cancel()
+
+@app.get("/results")
+def get_results(csv_filename: str = "scores.csv", page: int = 1, page_size: int = 50):
+    """One page of a results CSV plus its version token (changes whenever a row is appended)"""
+    path = os.path.join(UPLOAD_DIR, _sanitize_filename(csv_filename))
+    page, page_size = max(page, 1), min(max(page_size, 1), 500)
+    data = read_page(path, page, page_size)
+    data.update(page=page, page_size=page_size, version=results_version(path))
+    return data
+
+@app.get("/results-version")
+def get_results_version(csv_filename: str = "scores.csv"):
+    return {"csv_file": csv_filename, "version": results_version(os.path.join(UPLOAD_DIR, _sanitize_filename(csv_filename)))}
+
 @app.get("/all-scores")
 def all_scores():
     csv_file = os.path.join(UPLOAD_DIR, "scores.csv")
@@ -222,26 +1048,100 @@ def all_scores():
     results = [dict(zip(keys, row)) for row in reader[1:]]
     return results
 
+@app.get("/analytics")
+def get_analytics(csv_filename: str = "scores.csv", set_name: str = None, questions: bool = True, exact: bool = False):
+    """Running cohort analytics for a results file: score percentiles, section stats and, per set,
+    question difficulty, discrimination index and option choice distribution.
+    exact=true recomputes them from the columnar store, rescoring every sheet under the set's
+    current answer key and marking scheme"""
+    set_name = set_name.upper() if set_name else None
+    if exact:
+        aggregates = _rescored_aggregates(csv_filename)
+        return {
+            "csv_file": csv_filename,
+            "exact": True,
+            "overall": overall_summary(aggregates.values()),
+            "sets": {name: agg.summary(questions) for name, agg in sorted(aggregates.items())
+                     if set_name is None or name == set_name}
+        }
+    return {
+        "csv_file": csv_filename,
+        "overall": analytics.overall(csv_filename),
+        "sets": analytics.report(csv_filename, set_name, include_questions=questions)
+    }
+
+@app.get("/analytics/similarity")
+async def get_similarity(csv_filename: str = "scores.csv", set_name: str = None, top: int = similarity.TOP_PAIRS):
+    """Pairs of students per set whose answers, wrong answers above all, are unusually alike
+    (possible copying): identical wrong answers, differing answers, their ratio and how far
+    above the cohort it lies (z). Computed from the columnar store; flagged pairs need review"""
+    set_name = set_name.upper() if set_name else None
+    if not 1 <= top <= 1000:
+        raise HTTPException(400, "top must be between 1 and 1000")
+
+    def set_report(name):
+        """A set's report, or None without an answer key; key, scheme and columns are all read here."""
+        anskey_file = os.path.join(ANSWERKEY_DIR, f"answers_{name}.json")
+        if not os.path.exists(anskey_file):
+            return None
+        return similarity.set_report(results_store, csv_filename, name, load_compiled_key(anskey_file),
+                                     load_scheme(ANSWERKEY_DIR, name), top)
+
+    reports = {}
+    for name in await run_io(results_store.sets, csv_filename):
+        if set_name is None or name == set_name:
+            # a 20k-sheet set takes seconds of numpy work: off the event loop, and off the I/O pool
+            report = await asyncio.to_thread(set_report, name)
+            if report is not None:
+                reports[name] = report
+    return {"csv_file": csv_filename, "flag_z": similarity.FLAG_Z, "sets": reports}
+
+@app.get("/sheet-layout")
+def get_sheet_layout():
+    """Identity fields read from the sheets (OMR_ID_LAYOUT), or null if students are entered by hand"""
+    return {"id_fields": ID_LAYOUT}
+
+def _listing_response(request, kind):
+    """A catalog listing with its ETag; 304 when the client already has this version."""
+    names, etag = catalog.listing(kind)
+    sent = request.headers.get("if-none-match", "")
+    if sent.strip() == "*" or etag in (t.strip().removeprefix("W/") for t in sent.split(",")):
+        return Response(status_code=304, headers={"ETag": etag})
+    return JSONResponse({kind: names}, headers={"ETag": etag})
+
 @app.get("/answer-key-sets")
-def get_answer_key_sets():
-    """Get list of all existing answer key sets"""
-    sets = []
-    if os.path.exists(ANSWERKEY_DIR):
-        for filename in os.listdir(ANSWERKEY_DIR):
-            if filename.startswith("answers_") and filename.endswith(".json"):
-                set_name = filename.replace("answers_", "").replace(".json", "")
-                sets.append(set_name)
-    return {"sets": sorted(sets)}
+def get_answer_key_sets(request: Request):
+    """Get list of all existing answer key sets (ETag / If-None-Match aware)"""
+    return _listing_response(request, "sets")
 
 @app.get("/csv-files")
-def get_csv_files():
-    """Get list of all existing CSV files"""
-    csv_files = []
-    if os.path.exists(UPLOAD_DIR):
-        for filename in os.listdir(UPLOAD_DIR):
-            if filename.endswith(".csv"):
-                csv_files.append(filename)
-    return {"files": sorted(csv_files)}
+def get_csv_files(request: Request):
+    """Get list of all existing CSV files (ETag / If-None-Match aware)"""
+    return _listing_response(request, "files")
+
+@app.get("/catalog")
+def get_catalog():
+    """Key sets and CSV files together, with the version token /catalog/events reports"""
+    return catalog.snapshot()
+
+@app.get("/catalog/events")
+async def catalog_events(request: Request, since: str = None):
+    """Server-sent events: a "catalog" event with the full listing whenever it changes.
+
+    The first event is sent right away unless since (or Last-Event-ID) is the current version."""
+    version = since or request.headers.get("last-event-id")
+
+    async def stream():
+        nonlocal version
+        while not await request.is_disconnected():
+            snapshot = await catalog.wait(version, CATALOG_HEARTBEAT)
+            if snapshot["version"] == version:
+                yield ": keep-alive\n\n"
+                continue
+            version = snapshot["version"]
+            yield f"id: {version}\nevent: catalog\ndata: {json.dumps(snapshot)}\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
 
 @app.post("/create-csv")
 async def create_csv_file(filename: str = Form(...)):
@@ -250,18 +1150,17 @@ async def create_csv_file(filename: str = Form(...)):
         filename += ".csv"
     
     csv_path = os.path.join(UPLOAD_DIR, filename)
-    
-    # Check if file already exists
-    if os.path.exists(csv_path):
+
+    def create():
+        # Create CSV with headers; fails if the file already exists
+        with atomic_create(csv_path, "w", newline="", encoding="utf-8") as f:
+            csv.writer(f).writerow(CSV_HEADERS)
+
+    try:
+        await run_io(create)
+    except FileExistsError:
         raise HTTPException(400, f"CSV file '{filename}' already exists!")
-    
-    # Create CSV with headers
-    headers = ["Student Name", "Roll Number", "Python", "EDA", "SQL", "Power BI", "Statistics", 
-              "Marks Obtained", "Total Marks", "Percentage", "Set Name"]
-    
-    with open(csv_path, "w", newline="", encoding="utf-8") as f:
-        writer = csv.writer(f)
-        writer.writerow(headers)
+    catalog.add("files", filename)
     
     return {"message": f"CSV file '{filename}' created successfully!", "filename": filename}
 
@@ -271,11 +1170,35 @@ def get_current_csv():
     # This will be managed by the frontend session state
     return {"current_csv": None}
 
+@app.get("/metrics/event-loop")
+async def event_loop_metrics():
+    """How late the event loop has been running (blocking work on it shows up here) and the
+    file I/O pool's load"""
+    return {"loop_lag": loop_lag.snapshot(), "io": io_stats()}
+
+@app.get("/metrics/scheduler")
+def scheduler_metrics():
+    """Detection slots per lane: queue lengths, wait times, admissions and 429s"""
+    return scheduler.snapshot()
+
+@app.get("/metrics/quality")
+def quality_metrics():
+    """Sheets checked by the image quality gate, rejected or flagged, by reason"""
+    return quality_stats.snapshot()
+
 @app.get("/health")
 def health_check():
     """Health check endpoint for deployment"""
     return {"status": "healthy", "message": "OMR API is running"}
 
+@app.get("/ready")
+def readiness_check():
+    """Readiness: 200 once the scoring workers are warm, 503 until then (liveness is /health)"""
+    status = scoring_pool.status()
+    if not status["warm"]:
+        return JSONResponse(dict(status, status="starting"), status_code=503)
+    return dict(status, status="ready")
+
 @app.get("/", response_class=HTMLResponse)
 def root():
     """Root endpoint - serve main HTML page or fallback if index.html missing"""
@@ -0,0 +1,28 @@
+# Sheet layout shared by detection, key parsing and scoring. Kept free of OpenCV so the
+# API process can import it without paying for cv2 (only scoring workers load that).
+
+SECTION_MAP = {
+    "Python": "Python",
+    "EDA": "EDA",
+    "SQL": "SQL",
+    "Power BI": "Power BI",
+    "Statistics": "Statistics"
+}
+SECTION_RANGES = {
+    "Python": (1, 20),
+    "EDA": (21, 40),
+    "SQL": (41, 60),
+    "Power BI": (61, 80),
+    "Statistics": (81, 100)
+}
+OPTION_LETTERS = ['a', 'b', 'c', 'd']
+NUM_QUESTIONS = 100
+NUM_COLS = 5
+NUM_ROWS_PER_COL = 20
+NUM_OPTS = 4
+
+# Printed bubble positions in option pitches (measured on the bundled sheets): question
+# columns start 6 pitches apart, and blocks of 5 rows start 6 row pitches apart
+TEMPLATE_COL_PITCH = 6
+TEMPLATE_BLOCK_ROWS = 5
+TEMPLATE_BLOCK_PITCH = 6
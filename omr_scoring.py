@@ -1,39 +1,38 @@
 import cv2
 import numpy as np
-import json
-
-SECTION_MAP = {
-    "Python": "Python",
-    "EDA": "EDA",
-    "SQL": "SQL",
-    "Power BI": "Power BI",
-    "Statistics": "Statistics"
-}
-SECTION_RANGES = {
-    "Python": (1, 20),
-    "EDA": (21, 40),
-    "SQL": (41, 60),
-    "Power BI": (61, 80),
-    "Statistics": (81, 100)
-}
-OPTION_LETTERS = ['a', 'b', 'c', 'd']
-NUM_QUESTIONS = 100
-NUM_COLS = 5
-NUM_ROWS_PER_COL = 20
-NUM_OPTS = 4
-FILL_THRESH = 0.27
 
-def create_standard_grid_crop_with_aspect_ratio(img, target_size=(800, 1000), padding=80):
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    blur = cv2.GaussianBlur(gray, (5, 5), 0)
-    thresh = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY_INV, 13, 8)
+from omr_layout import (SECTION_MAP, SECTION_RANGES, OPTION_LETTERS, NUM_QUESTIONS,
+                        NUM_COLS, NUM_ROWS_PER_COL, NUM_OPTS,
+                        TEMPLATE_COL_PITCH, TEMPLATE_BLOCK_ROWS, TEMPLATE_BLOCK_PITCH)
+from answer_keys import load_compiled_key
+from scoring_engine import score_responses, section_scores_dict
+from image_io import read_gray
+from id_fields import ID_LAYOUT, decode_field, unreadable_field
+from thresholding import THRESHOLD_MODES, DEFAULT_THRESHOLD_MODE, FILL_THRESH, DARK_PIXEL, classify_fills
+from profiles import DETECTION_PARAMS, get_profile
+from responses import SheetResponses
+from quality import SheetRejected, gate
+from tracing import span
+
+def find_grid_box(img, padding=80, scale=1.0, params=None):
+    """(left, top, right, bottom) of the bubble grid plus padding, or None if too few bubbles.
+
+    With scale < 1 the bubbles are searched on a copy shrunk by that factor (size filters
+    follow it); the box is returned in img coordinates. params: a profile's detection
+    constants (default profiles.DETECTION_PARAMS)."""
+    p = params or DETECTION_PARAMS
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+    if scale != 1:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    block = max(3, int(round(13 * scale)) | 1)
+    thresh = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY_INV, block, 8)
     contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
     bubbles = []
     for c in contours:
-        area = cv2.contourArea(c)
-        x, y, w, h = cv2.boundingRect(c)
+        area = cv2.contourArea(c) / (scale * scale)
+        x, y, w, h = (v / scale for v in cv2.boundingRect(c))
         aspect_ratio = float(w) / h
-        if 100 < area < 3000 and 0.3 < aspect_ratio < 3.0 and w > 5 and h > 5:
+        if p["grid_min_area"] < area < p["grid_max_area"] and 0.3 < aspect_ratio < 3.0 and w > 5 and h > 5:
             bubbles.append((x, y, w, h))
     if len(bubbles) < 50:
         print(f"Only found {len(bubbles)} bubbles")
@@ -42,14 +41,20 @@ def create_standard_grid_crop_with_aspect_ratio(img, target_size=(800, 1000), pa
     ys = sorted([y for x, y, w, h in bubbles])
     x_rights = sorted([x+w for x, y, w, h in bubbles])
     y_bottoms = sorted([y+h for x, y, w, h in bubbles])
-    left = xs[int(len(xs) * 0.05)]
-    right = x_rights[int(len(x_rights) * 0.95)]
-    top = ys[int(len(ys) * 0.05)]
-    bottom = y_bottoms[int(len(y_bottoms) * 0.95)]
-    crop_left = max(0, left - padding)
-    crop_right = min(img.shape[1], right + padding)
-    crop_top = max(0, top - padding)
-    crop_bottom = min(img.shape[0], bottom + padding)
+    low, high = p["grid_low_pct"], p["grid_high_pct"]
+    left = xs[int(len(xs) * low)]
+    right = x_rights[min(len(x_rights) - 1, int(len(x_rights) * high))]
+    top = ys[int(len(ys) * low)]
+    bottom = y_bottoms[min(len(y_bottoms) - 1, int(len(y_bottoms) * high))]
+    crop_left = max(0, int(left - padding))
+    crop_right = min(img.shape[1], int(round(right + padding)))
+    crop_top = max(0, int(top - padding))
+    crop_bottom = min(img.shape[0], int(round(bottom + padding)))
+    return crop_left, crop_top, crop_right, crop_bottom
+
+def normalize_grid(img, box, target_size=(800, 1000)):
+    """Crop the grid box and fit it, aspect preserved, on a white target_size canvas."""
+    crop_left, crop_top, crop_right, crop_bottom = box
     grid_crop = img[crop_top:crop_bottom, crop_left:crop_right]
     crop_height, crop_width = grid_crop.shape[:2]
     target_width, target_height = target_size
@@ -59,13 +64,19 @@ def create_standard_grid_crop_with_aspect_ratio(img, target_size=(800, 1000), pa
     new_width = int(crop_width * scale)
     new_height = int(crop_height * scale)
     resized_grid = cv2.resize(grid_crop, (new_width, new_height), interpolation=cv2.INTER_LINEAR)
-    final_image = np.ones((target_height, target_width, 3), dtype=np.uint8) * 255
+    final_image = np.full((target_height, target_width) + img.shape[2:], 255, dtype=np.uint8)
     start_x = (target_width - new_width) // 2
     start_y = (target_height - new_height) // 2
     final_image[start_y:start_y+new_height, start_x:start_x+new_width] = resized_grid
     return final_image
 
-def cluster_bubbles_by_row(contours, min_area=120, max_area=400, min_aspect=0.7, max_aspect=1.4, min_w=10, min_h=10, min_circularity=0.65):
+def create_standard_grid_crop_with_aspect_ratio(img, target_size=(800, 1000), padding=80):
+    box = find_grid_box(img, padding)
+    if box is None:
+        return None
+    return normalize_grid(img, box, target_size)
+
+def cluster_bubbles_by_row(contours, min_area=120, max_area=400, min_aspect=0.7, max_aspect=1.4, min_w=10, min_h=10, min_circularity=0.65, row_threshold=20):
     bubbles = []
     for c in contours:
         area = cv2.contourArea(c)
@@ -80,7 +91,6 @@ def cluster_bubbles_by_row(contours, min_area=120, max_area=400, min_aspect=0.7,
         return []
     rows = []
     current_row = []
-    row_threshold = 20
     last_y = None
     for b in bubbles:
         if last_y is None or abs(b[1]-last_y) < row_threshold:
@@ -93,100 +103,262 @@ def cluster_bubbles_by_row(contours, min_area=120, max_area=400, min_aspect=0.7,
         rows.append(current_row)
     return rows
 
-def omr_detect_and_score(image_path, answerkey_path):
-    img = cv2.imread(image_path)
+def _read_id_field(region, field):
+    """Bubbles of one identity field, arranged as positions x symbols and decoded."""
+    blur = cv2.GaussianBlur(region, (5, 5), 0)
+    thresh = cv2.adaptiveThreshold(blur, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY_INV, 13, 8)
+    contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    rows = cluster_bubbles_by_row(contours, min_area=30, max_area=min(region.shape) ** 2, min_aspect=0.65,
+                                  max_aspect=1.45, min_w=5, min_h=5, min_circularity=0.6)
+    bubbles = [b for row in rows for b in row]
+    per_position = len(field["symbols"])
+    expected = field["positions"] * per_position
+    if len(bubbles) < expected:
+        return unreadable_field(field, f"found {len(bubbles)} of {expected} bubbles")
+    # printed digits and stray marks pass the shape filter too: keep the bubbles of typical size
+    median = np.median([w * h for x, y, w, h, c in bubbles])
+    bubbles = sorted(bubbles, key=lambda b: abs(b[2] * b[3] - median))[:expected]
+    across, along = (0, 1) if field["orientation"] == "columns" else (1, 0)
+    bubbles.sort(key=lambda b: b[across])
+    mean_val = np.full((field["positions"], per_position), np.nan, dtype=np.float32)
+    for pos in range(field["positions"]):
+        group = sorted(bubbles[pos * per_position:(pos + 1) * per_position], key=lambda b: b[along])
+        for i, (x, y, w, h, c) in enumerate(group):
+            mean_val[pos, i] = np.mean(region[int(y+0.2*h):int(y+0.8*h), int(x+0.2*w):int(x+0.8*w)])
+    return decode_field(mean_val, field)
+
+def read_id_fields(gray, layout):
+    """Read the identity fields of a grayscale page, then blank their regions so the
+    answer grid search does not see their bubbles. Returns {field name: reading}."""
+    fields = {}
+    height, width = gray.shape[:2]
+    for name, field in layout.items():
+        left, top, right, bottom = (int(round(v * size)) for v, size in zip(field["region"], (width, height, width, height)))
+        fields[name] = _read_id_field(gray[top:bottom, left:right], field)
+        gray[top:bottom, left:right] = 255
+    return fields
+
+def bubble_template():
+    """Centres of the printed bubbles in option pitches, float32[NUM_QUESTIONS * NUM_OPTS, 2]
+    in question-major order (cell q * NUM_OPTS + option)."""
+    col, row, opt = np.meshgrid(np.arange(NUM_COLS), np.arange(NUM_ROWS_PER_COL), np.arange(NUM_OPTS), indexing="ij")
+    x = TEMPLATE_COL_PITCH * col + opt
+    y = TEMPLATE_BLOCK_PITCH * (row // TEMPLATE_BLOCK_ROWS) + row % TEMPLATE_BLOCK_ROWS
+    return np.stack([x, y], axis=-1).reshape(-1, 2).astype(np.float32)
+
+def _contour_boxes(detected):
+    """Bubble boxes int16[NUM_QUESTIONS, NUM_OPTS, 4] by contour order: sorted left to right
+    and cut into NUM_COLS equal columns, then top to bottom into rows of NUM_OPTS. A missed
+    or extra contour shifts every later bubble of its column."""
+    detected = sorted(detected, key=lambda b: b[0])
+    bubbles_per_col = len(detected) // NUM_COLS
+    boxes = np.full((NUM_QUESTIONS, NUM_OPTS, 4), -1, dtype=np.int16)
+    for col in range(NUM_COLS):
+        col_bubbles = detected[col * bubbles_per_col : (col + 1) * bubbles_per_col]
+        col_bubbles.sort(key=lambda b: b[1])
+        for row in range(NUM_ROWS_PER_COL):
+            group = col_bubbles[row * NUM_OPTS : (row + 1) * NUM_OPTS]
+            group = sorted(group, key=lambda b: b[0])
+            for b_idx, (x, y, w, h, c) in enumerate(group):
+                boxes[col * NUM_ROWS_PER_COL + row, b_idx] = (x, y, w, h)
+    return boxes
+
+def _sq_dist(a, b):
+    """Squared distances between two point sets, float32[len(a), len(b)]."""
+    dx = a[:, 0, None] - b[None, :, 0]
+    dy = a[:, 1, None] - b[None, :, 1]
+    return dx * dx + dy * dy
+
+def _match_cells(pred, centers, tol):
+    """Index of the detected centre within tol of each predicted cell centre, else -1."""
+    dist = _sq_dist(pred.astype(np.float32), centers)
+    nearest = dist.argmin(axis=1)
+    return np.where(dist[np.arange(len(pred)), nearest] < tol * tol, nearest, -1)
+
+def _fit_cells(pred, centers, template, pitch, rounds):
+    """Match cells to contours and refit the template -> grid homography on the matches."""
+    for _ in range(rounds):
+        match = _match_cells(pred, centers, 0.45 * pitch)
+        ok = match >= 0
+        if ok.sum() < 8:
+            break
+        H, _ = cv2.findHomography(template[ok], centers[match[ok]], cv2.RANSAC, 0.3 * pitch)
+        if H is None:
+            break
+        pred = cv2.perspectiveTransform(template[:, None], H)[:, 0]
+    return pred, _match_cells(pred, centers, 0.45 * pitch)
+
+def _layout_guess(centers, dist, pitch, template):
+    """Cell centres placed from the grid's dominant angle and extent, ignoring contour order
+    (which a rotated photo scrambles)."""
+    step = centers[dist.argmin(axis=1)] - centers
+    theta = np.angle(np.exp(4j * np.arctan2(step[:, 1], step[:, 0])).mean()) / 4
+    rot = np.array([[np.cos(theta), np.sin(theta)], [-np.sin(theta), np.cos(theta)]], dtype=np.float32)
+    # contours without two neighbours within two pitches are specks, not bubbles
+    upright = centers[np.sort(dist, axis=1)[:, 1] < 2 * pitch] @ rot.T
+    lo, hi = upright.min(axis=0), upright.max(axis=0)
+    t_lo, t_hi = template.min(axis=0), template.max(axis=0)
+    return ((template - t_lo) * (hi - lo) / (t_hi - t_lo) + lo) @ rot
+
+def _template_boxes(boxes, detected, grid_shape, rounds):
+    """Bubble boxes from fitting the printed layout (bubble_template) to the detected bubbles.
+
+    Two starting fits, from contour order and from the grid's angle and extent, are refined
+    by matching contours to cells and refitting a homography; the one matching more contours
+    wins. Cells without a contour get a box of median size at the fitted centre, so a faint
+    or merged bubble is still read. Returns (boxes, contours matched) or (boxes, 0) unchanged
+    when the fit does not hold."""
+    if len(detected) < 8:
+        return boxes, 0
+    rects = np.array([b[:4] for b in detected], dtype=np.float32)
+    centers = rects[:, :2] + rects[:, 2:] / 2
+    dist = np.sqrt(_sq_dist(centers, centers))
+    np.fill_diagonal(dist, np.inf)
+    pitch = float(np.median(dist.min(axis=1)))
+    template = bubble_template()
+    starts = [_layout_guess(centers, dist, pitch, template)]
+    flat = boxes.reshape(-1, 4).astype(np.float32)
+    found = flat[:, 0] >= 0
+    if found.sum() >= 8:
+        H, _ = cv2.findHomography(template[found], flat[found, :2] + flat[found, 2:] / 2, cv2.RANSAC, 0.3 * pitch)
+        if H is not None:
+            starts.append(cv2.perspectiveTransform(template[:, None], H)[:, 0])
+    pred, match = max((_fit_cells(start, centers, template, pitch, rounds) for start in starts),
+                      key=lambda fit: np.count_nonzero(fit[1] >= 0))
+    matched = int(np.count_nonzero(match >= 0))
+    if matched < min(len(detected), NUM_QUESTIONS * NUM_OPTS) // 2:
+        return boxes, 0
+    w, h = np.median(rects[:, 2:], axis=0)
+    fitted = np.full((NUM_QUESTIONS * NUM_OPTS, 4), -1, dtype=np.int16)
+    for cell, (cx, cy) in enumerate(pred):
+        if match[cell] >= 0:
+            fitted[cell] = rects[match[cell]]
+        elif w / 2 <= cx < grid_shape[1] - w / 2 and h / 2 <= cy < grid_shape[0] - h / 2:
+            fitted[cell] = (cx - w / 2, cy - h / 2, w, h)
+    return fitted.reshape(NUM_QUESTIONS, NUM_OPTS, 4), matched
+
+def sample_boxes(gray, boxes):
+    """Mean intensity and share of pixels darker than DARK_PIXEL over the central 60% of
+    each box, float32[NUM_QUESTIONS, NUM_OPTS] each (NaN for missing / empty boxes).
+    Summed-area tables make every box four lookups instead of a slice and two means."""
+    height, width = gray.shape[:2]
+    x, y, w, h = (boxes[..., i].astype(np.float64) for i in range(4))
+    x0 = np.clip(np.floor(x + 0.2 * w), 0, width).astype(np.intp)
+    x1 = np.clip(np.floor(x + 0.8 * w), 0, width).astype(np.intp)
+    y0 = np.clip(np.floor(y + 0.2 * h), 0, height).astype(np.intp)
+    y1 = np.clip(np.floor(y + 0.8 * h), 0, height).astype(np.intp)
+    area = np.maximum(x1 - x0, 0) * np.maximum(y1 - y0, 0)
+    valid = (boxes[..., 0] >= 0) & (area > 0)
+    x0, x1, y0, y1 = (np.where(valid, v, 0) for v in (x0, x1, y0, y1))
+
+    def box_sums(image):
+        table = cv2.integral(image, sdepth=cv2.CV_64F)
+        return table[y1, x1] - table[y0, x1] - table[y1, x0] + table[y0, x0]
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean_val = np.where(valid, box_sums(gray) / area, np.nan).astype(np.float32)
+        black_ratio = np.where(valid, box_sums((gray < DARK_PIXEL).astype(np.uint8)) / area, np.nan).astype(np.float32)
+    return mean_val, black_ratio
+
+def measure_fills(image_path, id_layout=None, profile=None):
+    """Per-bubble fill measurements of one sheet: (mean intensity, share of dark pixels, trace).
+
+    Fills are float32[NUM_QUESTIONS, NUM_OPTS], NaN where no bubble was found. The trace holds
+    the grid box and each bubble's box (int16[NUM_QUESTIONS, NUM_OPTS, 4], -1 if missing):
+    a few KB that are enough to draw a debug overlay later without detecting again.
+    Box coordinates refer to the image as decoded by image_io.read_gray. With an ID layout
+    (default: OMR_ID_LAYOUT) the trace also holds the identity fields read off the sheet.
+    profile (see profiles.py) picks the resolution and how bubbles are assigned to cells."""
+    profile = profile if isinstance(profile, dict) else get_profile(profile)
+    with span("decode"):
+        img = read_gray(image_path, profile["decode_side"])
     if img is None:
         raise Exception("Image read failed!")
-    grid_img = create_standard_grid_crop_with_aspect_ratio(img, target_size=(800, 1000))
-    if grid_img is None:
-        raise Exception("Could not standardize OMR grid area")
-    gray = cv2.cvtColor(grid_img, cv2.COLOR_BGR2GRAY)
+    # fail fast: a blurry, badly exposed or gridless image stops before the costly stages
+    with span("quality"):
+        quality = gate(img)
+    id_layout = ID_LAYOUT if id_layout is None else id_layout
+    fields = None
+    if id_layout:
+        with span("id_fields"):
+            fields = read_id_fields(img, id_layout)
+    with span("grid"):
+        box, gray, contours = locate_grid(img, profile)
+    del img
+    with span("bubbles"):
+        mean_val, black_ratio, trace = locate_bubbles(gray, contours, profile)
+    trace["box"] = np.array(box, dtype=np.int32)
+    if quality is not None:
+        trace["quality"] = quality
+    if fields is not None:
+        trace["fields"] = fields
+    return mean_val, black_ratio, trace
+
+def locate_grid(img, profile):
+    """Grid stage of measure_fills: the grid box, the normalized 800x1000 grid and its
+    candidate bubble contours."""
+    box = find_grid_box(img, scale=profile["box_scale"], params=profile["params"])
+    if box is None:
+        raise SheetRejected.reason("no_grid", "Could not standardize OMR grid area", stage="detection")
+    gray = normalize_grid(img, box, target_size=(800, 1000))
     blur = cv2.GaussianBlur(gray, (5, 5), 0)
     thresh = cv2.adaptiveThreshold(blur, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY_INV, 13, 8)
     contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    return box, gray, contours
+
+def locate_bubbles(gray, contours, profile):
+    """Bubble stage of measure_fills: picks the bubble contours, assigns them to cells and
+    samples their fill; returns (mean intensity, share of dark pixels, trace)."""
+    p = profile["params"]
     rows = cluster_bubbles_by_row(
         contours,
-        min_area=50,
-        max_area=650,
-        min_aspect=0.65,
-        max_aspect=1.45,
+        min_area=p["bubble_min_area"],
+        max_area=p["bubble_max_area"],
+        min_aspect=p["bubble_min_aspect"],
+        max_aspect=p["bubble_max_aspect"],
         min_w=13,
         min_h=12,
-        min_circularity=0.7
+        min_circularity=p["bubble_min_circularity"],
+        row_threshold=p["row_threshold"]
     )
-    detected_bubbles = []
-    for row in rows:
-        for b in row:
-            detected_bubbles.append(b)
-    detected_bubbles.sort(key=lambda b: b[0])
-    bubbles_per_col = len(detected_bubbles) // NUM_COLS
-    questions = [[] for _ in range(NUM_QUESTIONS)]
-    for col in range(NUM_COLS):
-        col_bubbles = detected_bubbles[col * bubbles_per_col : (col + 1) * bubbles_per_col]
-        col_bubbles.sort(key=lambda b: b[1])
-        for row in range(NUM_ROWS_PER_COL):
-            group = col_bubbles[row * NUM_OPTS : (row + 1) * NUM_OPTS]
-            group = sorted(group, key=lambda b: b[0])
-            ans = []
-            for b_idx, (x, y, w, h, c) in enumerate(group):
-                roi = gray[int(y+0.2*h):int(y+0.8*h), int(x+0.2*w):int(x+0.8*w)]
-                if roi.size == 0:
-                    continue
-                black_ratio = np.mean(roi < 100)
-                mean_val = np.mean(roi)
-                if black_ratio > FILL_THRESH or mean_val < 140:
-                    ans.append(OPTION_LETTERS[b_idx])
-            qnum = col * NUM_ROWS_PER_COL + row
-            questions[qnum] = ans
-    
-    # Build section-wise dict
-    detected_sectionwise = {}
-    for section, (startq, endq) in SECTION_RANGES.items():
-        detected_sectionwise[section] = {}
-        for q in range(startq, endq+1):
-            idx = q - 1
-            val = questions[idx]
-            ans = ",".join(val) if len(val) > 1 else (val[0] if val else "")
-            detected_sectionwise[section][f"Q{q}"] = ans.lower()
-    
-    with open(answerkey_path, "r") as f:
-        answer_key = json.load(f)
-    # The answer_key is also sectionwise
-
-    def norm(ans): return "".join(sorted(ans.replace(",", "").replace(" ", "").lower()))
-
-    def lookup_key_answer(keysubs, qlabel):
-        # Try canonical formats: "Q1" then "1" then numeric without Q, case-insensitive keys
-        if not keysubs:
-            return ""
-        # direct
-        if qlabel in keysubs:
-            return keysubs[qlabel]
-        # try without leading 'Q' or 'q'
-        if qlabel.startswith("Q") and qlabel[1:] in keysubs:
-            return keysubs[qlabel[1:]]
-        # try lowercase key forms
-        low_map = {k.lower(): v for k, v in keysubs.items()}
-        if qlabel.lower() in low_map:
-            return low_map[qlabel.lower()]
-        if qlabel.lower().lstrip('q') in low_map:
-            return low_map[qlabel.lower().lstrip('q')]
-        return ""
-
-    section_scores = {}
-    total = 0
-    for section in SECTION_MAP:
-        subs = detected_sectionwise.get(section, {})
-        keysubs = answer_key.get(section, {})
-        count = 0
-        for q in subs:
-            stu_ans = norm(subs.get(q, ""))
-            raw_key_ans = lookup_key_answer(keysubs, q)
-            key_ans = norm(raw_key_ans)
-            if stu_ans and key_ans and stu_ans == key_ans:
-                count += 1
-        section_scores[section] = count
-        total += count
-    section_scores["Total"] = total
-
-    return detected_sectionwise, section_scores
+    detected_bubbles = [b for row in rows for b in row]
+    boxes = _contour_boxes(detected_bubbles)
+    trace = {"bubbles_found": len(detected_bubbles)}
+    if profile["strategy"] == "template":
+        boxes, trace["template_matched"] = _template_boxes(boxes, detected_bubbles, gray.shape, profile["refine"])
+    mean_val, black_ratio = sample_boxes(gray, boxes)
+    boxes[np.isnan(mean_val)] = -1
+    trace["boxes"] = boxes
+    return mean_val, black_ratio, trace
+
+def read_sheet(image_path, mode=None, id_layout=None, profile=None):
+    """Marked bubbles of one sheet, thresholding info (mode, threshold, margin, profile, and
+    the identity fields when an ID layout is set) and the trace needed to render a debug
+    overlay (see debug_overlay.py)."""
+    profile = get_profile(profile)
+    mean_val, black_ratio, trace = measure_fills(image_path, id_layout, profile)
+    with span("classify"):
+        marked, info = classify_fills(mean_val, black_ratio, mode or DEFAULT_THRESHOLD_MODE,
+                                      profile["params"]["fill_thresh"], profile["params"]["dark_mean"])
+    info["profile"] = profile["name"]
+    if "fields" in trace:
+        info["fields"] = trace.pop("fields")
+    if "quality" in trace:
+        info["quality"] = trace.pop("quality")
+    trace.update(mean_val=mean_val, black_ratio=black_ratio)
+    return marked, info, trace
+
+def detect_responses(image_path, mode=None, profile=None):
+    """Read the marked bubbles of one sheet as a bool[NUM_QUESTIONS, NUM_OPTS] tensor."""
+    return read_sheet(image_path, mode, profile=profile)[0]
+
+def responses_to_sectionwise(marked):
+    """bool[NUM_QUESTIONS, NUM_OPTS] -> {section: {"Qn": "a,b"}} as returned by the API."""
+    return SheetResponses.from_marked(marked).to_sectionwise()
+
+def omr_detect_and_score(image_path, answerkey_path, scheme=None, mode=None, profile=None):
+    marked = detect_responses(image_path, mode, profile)
+    # Precompiled key bitmask (bit i = option i); no key parsing on the hot path
+    key_bits = load_compiled_key(answerkey_path)
+    result = score_responses(marked, key_bits, scheme)
+    return responses_to_sectionwise(marked), section_scores_dict(result)
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""Scoring worker: leases detection jobs from the shared job store and writes results back.
+
+    OMR_JOB_STORE=sqlite:////data/jobs.db OMR_BLOB_STORE=file:///data/blobs python omr_worker.py
+
+Run as many as the host has cores, on as many hosts as share the stores; the API only
+queues jobs and waits for their results.
+"""
+import os
+import sys
+import time
+import socket
+import logging
+import argparse
+import threading
+
+from job_store import open_job_store
+from blob_store import open_blob_store
+from submissions import pack_marked
+from debug_overlay import pack_trace
+from quality import SheetRejected
+
+logger = logging.getLogger("omr_worker")
+
+DETECT = "detect"
+LEASE_SECONDS = float(os.getenv("OMR_LEASE_SECONDS", "60"))
+HEARTBEAT_SECONDS = 5
+
+
+def default_worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+
+
+def run_worker(jobs, blobs, worker_id=None, stop=None, poll=0.1, max_jobs=None):
+    """Lease and run detection jobs until `stop` is set (or max_jobs are done)."""
+    from scoring_workers import warm_up, detect_image_timed  # cv2 is only imported by workers
+    worker_id = worker_id or default_worker_id()
+    stop = stop or threading.Event()
+    _, warm_seconds = warm_up()
+    info = {"pid": os.getpid(), "warm_seconds": round(warm_seconds, 3)}
+    last_beat, done = 0, 0
+    while not stop.is_set() and (max_jobs is None or done < max_jobs):
+        if time.time() - last_beat >= HEARTBEAT_SECONDS:
+            jobs.heartbeat(worker_id, (DETECT,), dict(info, jobs_done=done))
+            last_beat = time.time()
+        job = jobs.lease(worker_id, (DETECT,), LEASE_SECONDS)
+        if job is None:
+            stop.wait(poll)
+            continue
+        try:
+            payload = job["payload"]
+            (marked, sheet_info, trace), spans = detect_image_timed(blobs.local_path(payload["image_sha256"]),
+                                                                   payload.get("mode"), payload.get("profile"))
+        except FileNotFoundError as e:
+            # blob not visible on this node (yet): let another worker try
+            jobs.fail(job["id"], worker_id, str(e), retry=True)
+        except SheetRejected as e:
+            # a verdict on the image, not a failure: the API answers it with the reasons
+            if not jobs.complete(job["id"], worker_id, {"rejected": e.quality}):
+                logger.warning(f"Lease on job {job['id']} was lost before completion")
+        except Exception as e:
+            # detection is deterministic, retrying the same image gives the same error
+            jobs.fail(job["id"], worker_id, str(e))
+        else:
+            result = {"marked": pack_marked(marked), "info": sheet_info, "trace": pack_trace(trace), "spans": spans}
+            if not jobs.complete(job["id"], worker_id, result):
+                logger.warning(f"Lease on job {job['id']} was lost before completion")
+        done += 1
+    return done
+
+
+def start_local_workers(jobs, blobs, count, stop):
+    """Worker threads inside this process, e.g. for the in-memory stores."""
+    threads = []
+    for i in range(count):
+        t = threading.Thread(target=run_worker, args=(jobs, blobs), kwargs={"stop": stop},
+                             name=f"omr-worker-{i}", daemon=True)
+        t.start()
+        threads.append(t)
+    return threads
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", default=os.getenv("OMR_JOB_STORE"), help="job store URL (default $OMR_JOB_STORE)")
+    parser.add_argument("--blobs", default=os.getenv("OMR_BLOB_STORE"), help="blob store URL (default $OMR_BLOB_STORE)")
+    parser.add_argument("--max-jobs", type=int, default=None, help="exit after this many jobs")
+    args = parser.parse_args(argv)
+    if not args.jobs or not args.blobs:
+        parser.error("--jobs and --blobs (or OMR_JOB_STORE and OMR_BLOB_STORE) are required")
+    logging.basicConfig(level=logging.INFO)
+    jobs, blobs = open_job_store(args.jobs), open_blob_store(args.blobs)
+    worker_id = default_worker_id()
+    logger.info(f"Worker {worker_id} leasing jobs from {args.jobs}")
+    try:
+        run_worker(jobs, blobs, worker_id, max_jobs=args.max_jobs)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,130 @@
+"""Processing profiles: how much work detection spends on one sheet.
+
+fast      live feedback on phone captures. Decodes down to ~800 px and finds the grid on a
+          half-size copy; bubbles are assigned in contour order.
+balanced  the default and the original path: ~1200 px decode, 800x1000 grid, contour order.
+accurate  final grading. Full-resolution decode, and bubbles are assigned by fitting the
+          printed bubble layout to the detected ones (template), which survives missed or
+          extra contours, rotation and perspective; cells without a contour are still read.
+
+tuned     written by tuner.py (OMR_TUNED_PROFILE): a base profile with detection parameters
+          searched against labelled sheets; only registered when that file exists.
+
+A request may name a profile; otherwise the set's profile (profile_<SET>.json next to the
+answer key) applies, then OMR_PROFILE. Kept free of OpenCV so the API can validate names.
+"""
+import os
+import json
+
+from image_io import MIN_DECODE_SIDE
+from fileio import atomic_write
+
+# Detection constants shared by the built-in profiles; tuner.py searches them
+DETECTION_PARAMS = {
+    # grid box: bubble-like contours on the decoded sheet (area in decoded px) and the
+    # percentiles of their edges the box spans, so stray marks outside the grid are cut
+    "grid_min_area": 100, "grid_max_area": 3000,
+    "grid_low_pct": 0.05, "grid_high_pct": 0.95,
+    # bubbles on the normalized 800x1000 grid
+    "bubble_min_area": 50, "bubble_max_area": 650,
+    "bubble_min_aspect": 0.65, "bubble_max_aspect": 1.45,
+    "bubble_min_circularity": 0.7,
+    "row_threshold": 20,    # contour order: a bubble this far below the last starts a new row
+    # fixed threshold mode (see thresholding.py)
+    "fill_thresh": 0.27, "dark_mean": 140,
+}
+
+PROFILES = {
+    # decode_side: smallest long side kept when decoding reduced (None: full resolution)
+    # box_scale:   scale of the copy the grid box is searched on
+    # strategy:    contour (sorted contour order) | template (fit of the printed layout)
+    # refine:      template only: rounds of matching contours to cells and refitting
+    # params:      detection constants (DETECTION_PARAMS)
+    "fast": {"decode_side": 800, "box_scale": 0.5, "strategy": "contour", "refine": 0, "params": DETECTION_PARAMS},
+    "balanced": {"decode_side": MIN_DECODE_SIDE, "box_scale": 1.0, "strategy": "contour", "refine": 0,
+                 "params": DETECTION_PARAMS},
+    "accurate": {"decode_side": None, "box_scale": 1.0, "strategy": "template", "refine": 3,
+                 "params": DETECTION_PARAMS},
+}
+BUILTIN_PROFILES = tuple(PROFILES)
+DEFAULT_PROFILE = os.getenv("OMR_PROFILE", "balanced")
+TUNED_PROFILE = os.getenv("OMR_TUNED_PROFILE")
+
+
+def load_tuned_profile(path):
+    """Register the profile tuner.py wrote to path (its base profile with the tuned params);
+    returns its name. Raises ValueError naming path if the file is not such a profile."""
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if not isinstance(data, dict):
+        raise ValueError(f"{path} is not a tuned profile (expected a JSON object)")
+    name = data.get("name", "tuned")
+    if not isinstance(name, str):
+        raise ValueError(f"{path}: name must be a string")
+    name = name.strip().lower()
+    if name in BUILTIN_PROFILES:
+        raise ValueError(f"Tuned profile cannot replace built-in profile {name!r}")
+    if data.get("base") not in BUILTIN_PROFILES:
+        raise ValueError(f"{path}: base must be one of {', '.join(BUILTIN_PROFILES)}, not {data.get('base')!r}")
+    if not isinstance(data.get("params"), dict):
+        raise ValueError(f"{path}: params must be an object of detection params")
+    unknown = set(data["params"]) - set(DETECTION_PARAMS)
+    if unknown:
+        raise ValueError(f"Unknown detection params in {path}: {sorted(unknown)}")
+    PROFILES[name] = dict(PROFILES[data["base"]], params=dict(DETECTION_PARAMS, **data["params"]),
+                          version=data.get("version"))
+    return name
+
+
+if TUNED_PROFILE and os.path.exists(TUNED_PROFILE):
+    try:
+        load_tuned_profile(TUNED_PROFILE)
+    except ValueError as e:
+        raise ValueError(f"OMR_TUNED_PROFILE: {e}") from e
+
+
+def get_profile(name=None):
+    """Settings of a profile by name (default: OMR_PROFILE); raises ValueError if unknown."""
+    name = (name or DEFAULT_PROFILE).strip().lower()
+    if name not in PROFILES:
+        raise ValueError(f"Unknown profile {name!r}; use one of {', '.join(PROFILES)}")
+    return dict(PROFILES[name], name=name)
+
+
+def set_profile_path(key_dir, set_name):
+    return os.path.join(key_dir, f"profile_{set_name.upper()}.json")
+
+
+def save_set_profile(key_dir, set_name, name):
+    profile = get_profile(name)["name"]
+    with atomic_write(set_profile_path(key_dir, set_name), "w", encoding="utf-8") as f:
+        json.dump({"profile": profile}, f)
+    return profile
+
+
+_set_profile_cache = {}
+
+
+def load_set_profile(key_dir, set_name):
+    """Profile name configured for a set, or None to use the default; raises ValueError
+    naming the file if it is malformed or names an unknown profile."""
+    path = set_profile_path(key_dir, set_name)
+    mtime = os.path.getmtime(path) if os.path.exists(path) else None
+    cached = _set_profile_cache.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    profile = None
+    if mtime is not None:
+        with open(path, "r", encoding="utf-8") as f:
+            try:
+                data = json.load(f)
+            except ValueError as e:
+                raise ValueError(f"{os.path.basename(path)} is not valid JSON ({e})")
+        if not isinstance(data, dict) or not isinstance(data.get("profile"), str):
+            raise ValueError(f'{os.path.basename(path)} must be {{"profile": "<name>"}}')
+        try:
+            profile = get_profile(data["profile"])["name"]
+        except ValueError as e:
+            raise ValueError(f"{os.path.basename(path)}: {e}")
+    _set_profile_cache[path] = (mtime, profile)
+    return profile
@@ -0,0 +1,225 @@
+"""Cheap image checks run on a small thumbnail before the expensive detection stages.
+
+A check takes a few milliseconds on a THUMB_SIDE px copy and answers whether a sheet is
+worth detecting: is it sharp and evenly exposed, is there a bubble grid in view (with a
+plausible number of bubbles), is it square to the frame and not cut off. Thresholds were
+calibrated on the bundled scans: a blur the eye barely notices (Gaussian sigma 2 at
+~1200 px) already drops the Laplacian variance of the thumbnail below MIN_SHARPNESS and
+makes the contour pipeline misread most questions, and so does washing the marks out.
+
+Each failed check is a reason {"code", "severity", "value", "limit", "message"}. "reject"
+reasons stop the sheet before detection (SheetRejected, a 422 with the reasons); "flag"
+reasons (skew, a grid close to the edge) are only reported, since the accurate profile
+copes with them. OMR_QUALITY_GATE=flag reports everything without rejecting, off skips
+the check. OpenCV is imported inside the functions, so the API can import this module.
+"""
+import io
+import os
+import time
+import threading
+
+import numpy as np
+
+from image_io import MAX_PIXELS, ImageTooLarge, decode_reduction, header_size
+
+QUALITY_GATE = os.getenv("OMR_QUALITY_GATE", "reject")   # reject | flag | off
+THUMB_SIDE = 480
+MIN_SHARPNESS = float(os.getenv("OMR_MIN_SHARPNESS", "400"))   # variance of the thumbnail's Laplacian
+MAX_SKEW_DEG = float(os.getenv("OMR_MAX_SKEW_DEG", "2.5"))      # contour order misreads rows beyond this
+MIN_GRID_BUBBLES = 200   # bubble-like contours in view; a sheet has 400 answer bubbles ...
+MAX_GRID_BUBBLES = 1000  # ... and a few hundred more look like noise or text, not a sheet
+MIN_PAPER = 120          # 95th percentile brightness: below it the sheet is underexposed
+MAX_CLIPPED = 0.4        # share of blown-out pixels (>= 250) ...
+MIN_INK = 110            # ... with the 5th percentile this light: overexposed, marks washed out
+MIN_EDGE_MARGIN = 0.008  # bubbles closer than this (share of the frame) to an edge: maybe cut off
+
+_MESSAGES = {
+    "blurry": "Image is out of focus",
+    "no_grid": "No bubble grid found",
+    "too_many_marks": "Too many bubble-like marks for an OMR sheet",
+    "underexposed": "Image is too dark",
+    "overexposed": "Image is overexposed; marks are washed out",
+    "skewed": "Sheet is tilted",
+    "cropped": "Bubble grid reaches the edge of the image; part of it may be cut off",
+}
+
+
+class SheetRejected(ValueError):
+    """A sheet failed a "reject" quality check; .quality holds the full report."""
+
+    def __init__(self, quality):
+        self.quality = quality
+        codes = ", ".join(r["code"] for r in quality["reasons"] if r["severity"] == "reject")
+        super().__init__(f"Sheet failed the image quality check ({codes})")
+
+    def __reduce__(self):
+        # rebuilt from the report when it crosses a process boundary
+        return SheetRejected, (self.quality,)
+
+    @classmethod
+    def reason(cls, code, message=None, **fields):
+        """Rejection for one reason found outside the thumbnail check (e.g. by detection)."""
+        reason = dict({"code": code, "severity": "reject", "message": message or _MESSAGES.get(code, code)}, **fields)
+        return cls({"ok": False, "reasons": [reason]})
+
+
+def thumbnail(gray, side=THUMB_SIDE):
+    import cv2
+    scale = side / max(gray.shape[:2])
+    if scale >= 1:
+        return gray
+    return cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+
+def decode_frame(data, side=THUMB_SIDE):
+    """Grayscale thumbnail of an encoded image (JPEG / PNG bytes), or None if undecodable.
+
+    The size comes from the header first: a frame over MAX_PIXELS raises ImageTooLarge
+    before anything is decoded (a few KB can declare a huge image), and a large JPEG is
+    decoded reduced in the DCT, as image_io.read_gray does for sheets."""
+    import cv2
+    size = header_size(io.BytesIO(data))
+    if size is None:
+        return None
+    width, height = size
+    if width * height > MAX_PIXELS:
+        raise ImageTooLarge(f"Frame is {width}x{height} ({width * height / 1e6:.1f} MP); "
+                            f"the limit is {MAX_PIXELS / 1e6:.0f} MP")
+    flag = {1: cv2.IMREAD_GRAYSCALE, 2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+            4: cv2.IMREAD_REDUCED_GRAYSCALE_4, 8: cv2.IMREAD_REDUCED_GRAYSCALE_8}[decode_reduction(size, side)]
+    gray = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flag)
+    if gray is None:
+        return None
+    return thumbnail(gray, side)
+
+
+def _bubble_centers(thumb):
+    """Centers of bubble-sized, roughly round contours; bubble size follows the thumbnail."""
+    import cv2
+    thresh = cv2.adaptiveThreshold(thumb, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY_INV, 11, 8)
+    contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    unit = max(thumb.shape[:2]) / THUMB_SIDE
+    centers = []
+    for c in contours:
+        x, y, w, h = cv2.boundingRect(c)
+        area = cv2.contourArea(c) / (unit * unit)
+        if 20 < area < 250 and 0.6 < w / h < 1.6:
+            centers.append((x + w / 2, y + h / 2))
+    return np.array(centers, dtype=np.float32).reshape(-1, 2)
+
+
+def _skew_deg(centers, samples=128):
+    """Tilt of the bubble rows in degrees: the median direction from a bubble to its
+    nearest neighbour on the same row (robust to stray marks, unlike an enclosing box),
+    over an even sample of at most `samples` bubbles."""
+    queries = centers[::max(1, len(centers) // samples)]
+    d = centers[None, :, :] - queries[:, None, :]
+    dist = np.hypot(d[..., 0], d[..., 1])
+    # neighbours to the right and closer to horizontal than 30 degrees
+    dist[(d[..., 0] <= 0) | (np.abs(d[..., 1]) > 0.58 * d[..., 0])] = np.inf
+    rows = np.arange(len(queries))
+    nearest = np.argmin(dist, axis=1)
+    has = np.isfinite(dist[rows, nearest])
+    if not has.any():
+        return 0.0
+    step = d[rows, nearest][has]
+    return float(np.degrees(np.median(np.arctan2(step[:, 1], step[:, 0]))))
+
+
+def check_quality(gray):
+    """Quality report of one grayscale sheet image: {"ok", "reasons", "score", measurements}.
+
+    ok is False when a "reject" reason was found. score ranks images of the same sheet
+    (sharper and straighter is better) and is 0 when there is any reason at all."""
+    import cv2
+    start = time.perf_counter()
+    thumb = thumbnail(gray)
+    sharpness = float(cv2.Laplacian(thumb, cv2.CV_64F).var())
+    # exposure from the histogram: cheaper than sorting the pixels for percentiles
+    cumulative = np.cumsum(np.bincount(thumb.ravel(), minlength=256)) / thumb.size
+    ink, paper = (float(np.searchsorted(cumulative, q)) for q in (0.05, 0.95))
+    clipped = float(1 - cumulative[249])
+    centers = _bubble_centers(thumb)
+    reasons = []
+
+    def fail(code, severity, value, limit):
+        reasons.append({"code": code, "severity": severity, "value": round(value, 3), "limit": limit,
+                        "message": _MESSAGES[code]})
+
+    if sharpness < MIN_SHARPNESS:
+        fail("blurry", "reject", sharpness, MIN_SHARPNESS)
+    if paper < MIN_PAPER:
+        fail("underexposed", "reject", paper, MIN_PAPER)
+    if clipped > MAX_CLIPPED and ink > MIN_INK:
+        fail("overexposed", "reject", clipped, MAX_CLIPPED)
+    skew = margin = None
+    if len(centers) < MIN_GRID_BUBBLES:
+        fail("no_grid", "reject", len(centers), MIN_GRID_BUBBLES)
+    elif len(centers) > MAX_GRID_BUBBLES:
+        fail("too_many_marks", "reject", len(centers), MAX_GRID_BUBBLES)
+    else:
+        skew = _skew_deg(centers)
+        if abs(skew) > MAX_SKEW_DEG:
+            fail("skewed", "flag", skew, MAX_SKEW_DEG)
+        height, width = thumb.shape[:2]
+        margin = float(min(centers[:, 0].min() / width, centers[:, 1].min() / height,
+                           1 - centers[:, 0].max() / width, 1 - centers[:, 1].max() / height))
+        if margin < MIN_EDGE_MARGIN:
+            fail("cropped", "flag", margin, MIN_EDGE_MARGIN)
+    score = 0.0
+    if not reasons:
+        score = min(sharpness / MIN_SHARPNESS, 10.0) * (1 - abs(skew) / (2 * MAX_SKEW_DEG))
+    return {"ok": not any(r["severity"] == "reject" for r in reasons), "reasons": reasons,
+            "score": round(score, 3), "sharpness": round(sharpness, 1), "bubbles": len(centers),
+            "skew_deg": None if skew is None else round(skew, 2),
+            "edge_margin": None if margin is None else round(margin, 4),
+            "paper": round(paper, 1), "ink": round(ink, 1), "clipped": round(clipped, 3),
+            "ms": round((time.perf_counter() - start) * 1000, 2)}
+
+
+def frame_quality(gray):
+    """check_quality for a live-capture frame: any reason, flagged or not, fails it (the
+    person holding the camera can fix it before the frame is scored)."""
+    quality = check_quality(gray)
+    quality["ok"] = not quality["reasons"]
+    return quality
+
+
+def gate(gray, mode=None):
+    """The fail-fast stage of detection: the quality report of a decoded sheet, or
+    SheetRejected in reject mode when a check failed; None with the gate off."""
+    mode = mode or QUALITY_GATE
+    if mode == "off":
+        return None
+    quality = check_quality(gray)
+    if mode == "reject" and not quality["ok"]:
+        raise SheetRejected(quality)
+    return quality
+
+
+class QualityStats:
+    """Counts of gated sheets by outcome and reason, for /metrics/quality (per API process)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checked = self.rejected = self.flagged = 0
+        self.reasons = {}
+        self._ms = 0.0
+
+    def record(self, quality, rejected=False):
+        if not quality:
+            return
+        with self._lock:
+            self.checked += 1
+            self.rejected += rejected
+            self.flagged += not rejected and bool(quality["reasons"])
+            self._ms += quality.get("ms", 0.0)
+            for reason in quality["reasons"]:
+                key = f"{reason['code']}:{reason['severity']}"
+                self.reasons[key] = self.reasons.get(key, 0) + 1
+
+    def snapshot(self):
+        with self._lock:
+            return {"gate": QUALITY_GATE, "checked": self.checked, "rejected": self.rejected,
+                    "flagged": self.flagged, "reasons": dict(sorted(self.reasons.items())),
+                    "mean_check_ms": round(self._ms / self.checked, 2) if self.checked else None}
@@ -0,0 +1,185 @@
+"""Compact detected responses: one byte per question, bit i set = option i marked.
+
+The same encoding as compiled answer keys, so scoring is a lookup on (bits & key) instead
+of comparing bool[NUM_QUESTIONS, NUM_OPTS] tensors; a sheet is 100 bytes. A cohort is one
+contiguous uint8[N, NUM_QUESTIONS] array and each SheetResponses a view of its row, so
+sheets go in and come back out without copies. The nested {section: {"Qn": "a,b"}} shape
+is only built at the API boundary (to_sectionwise). Kept free of OpenCV.
+"""
+import numpy as np
+
+from omr_layout import SECTION_RANGES, OPTION_LETTERS, NUM_QUESTIONS, NUM_OPTS
+
+# nibble -> its options as bools / as "a,c" text / number of options marked
+_OPTIONS = ((np.arange(16, dtype=np.uint8)[:, None] >> np.arange(NUM_OPTS, dtype=np.uint8)) & 1).astype(bool)
+_LETTERS = [",".join(l for l, on in zip(OPTION_LETTERS, row) if on) for row in _OPTIONS]
+POPCOUNT = _OPTIONS.sum(axis=1).astype(np.uint8)
+_HEX_DIGITS = np.frombuffer(b"0123456789abcdef", dtype=np.uint8)
+
+
+def pack_bits(marked):
+    """bool[..., NUM_QUESTIONS, NUM_OPTS] -> uint8[..., NUM_QUESTIONS]."""
+    return np.packbits(np.asarray(marked, dtype=bool), axis=-1, bitorder="little")[..., 0]
+
+
+def unpack_bits(bits):
+    """uint8[..., NUM_QUESTIONS] -> bool[..., NUM_QUESTIONS, NUM_OPTS]."""
+    bits = np.asarray(bits, dtype=np.uint8)[..., None]
+    return np.unpackbits(bits, axis=-1, count=NUM_OPTS, bitorder="little").view(bool)
+
+
+def pattern_counts(bits):
+    """Sheets per question and marked-option pattern, int64[NUM_QUESTIONS, 16], of a cohort
+    uint8[N, NUM_QUESTIONS]. Option, blank and multi-mark counts all follow from it
+    (see option_counts) without unpacking the cohort."""
+    bits = np.asarray(bits, dtype=np.uint8).reshape(-1, NUM_QUESTIONS) & 0xF
+    flat = (bits + np.arange(NUM_QUESTIONS, dtype=np.intp) * 16).ravel()
+    return np.bincount(flat, minlength=NUM_QUESTIONS * 16).reshape(NUM_QUESTIONS, 16)
+
+
+def option_counts(patterns):
+    """pattern_counts -> sheets marking each option, int64[NUM_QUESTIONS, NUM_OPTS]."""
+    return patterns @ _OPTIONS.astype(np.int64)
+
+
+def as_bits(responses):
+    """Bits of a SheetResponses / ResponseCohort, a uint8 bit array or a bool option tensor."""
+    if isinstance(responses, (SheetResponses, ResponseCohort)):
+        return responses.bits
+    responses = np.asarray(responses)
+    if responses.dtype == np.uint8 and responses.shape[-1:] == (NUM_QUESTIONS,):
+        return responses
+    return pack_bits(responses)
+
+
+def _hex_to_bits(text, out=None):
+    codes = np.frombuffer(text.encode("ascii"), dtype=np.uint8)
+    # '0'-'9' -> 0-9, 'a'-'f' / 'A'-'F' -> 10-15
+    values = np.where(codes > 0x39, (codes | 0x20) - 0x57, codes - 0x30)
+    if codes.size != NUM_QUESTIONS or (values > 15).any():
+        raise ValueError("Expected one hex digit per question")
+    if out is None:
+        return values.astype(np.uint8)
+    out[:] = values
+    return out
+
+
+class SheetResponses:
+    """One sheet's marked options as uint8[NUM_QUESTIONS] (often a row view of a cohort)."""
+    __slots__ = ("bits",)
+
+    def __init__(self, bits):
+        bits = np.asarray(bits, dtype=np.uint8)
+        if bits.shape != (NUM_QUESTIONS,):
+            raise ValueError(f"Expected {NUM_QUESTIONS} questions, got shape {bits.shape}")
+        self.bits = bits
+
+    @classmethod
+    def from_marked(cls, marked):
+        return cls(pack_bits(marked))
+
+    @classmethod
+    def from_hex(cls, text):
+        """Inverse of to_hex: the form stored in the submission log."""
+        return cls(_hex_to_bits(text))
+
+    def to_hex(self):
+        """100-char string, one hex digit (the question's bits) per question."""
+        return _HEX_DIGITS[self.bits & 0xF].tobytes().decode("ascii")
+
+    @property
+    def marked(self):
+        """bool[NUM_QUESTIONS, NUM_OPTS] option matrix (a new array)."""
+        return unpack_bits(self.bits)
+
+    def section(self, name):
+        """Bits of one section's questions; a view, not a copy."""
+        startq, endq = SECTION_RANGES[name]
+        return self.bits[startq - 1:endq]
+
+    def answer(self, qnum):
+        """Marked options of question qnum (1-based) as "a,b"; "" when blank."""
+        return _LETTERS[self.bits[qnum - 1] & 0xF]
+
+    def to_sectionwise(self):
+        """{section: {"Qn": "a,b"}} as returned by the API."""
+        letters = [_LETTERS[b] for b in (self.bits & 0xF).tolist()]
+        return {section: {f"Q{q}": letters[q - 1] for q in range(startq, endq + 1)}
+                for section, (startq, endq) in SECTION_RANGES.items()}
+
+    def __eq__(self, other):
+        return isinstance(other, SheetResponses) and np.array_equal(self.bits, other.bits)
+
+    def __repr__(self):
+        return f"SheetResponses({self.to_hex()!r})"
+
+
+class ResponseCohort:
+    """Responses of many sheets in one contiguous uint8[N, NUM_QUESTIONS] array.
+
+    Rows are filled in place (append packs straight into the next row), indexing returns
+    SheetResponses views and .bits is a view of the filled rows, ready for vectorized
+    scoring. Growing reallocates, so views taken before an append beyond the capacity keep
+    pointing at the old buffer; size the cohort up front when the count is known."""
+    __slots__ = ("_buffer", "size")
+
+    def __init__(self, capacity=64):
+        self._buffer = np.zeros((max(int(capacity), 1), NUM_QUESTIONS), dtype=np.uint8)
+        self.size = 0
+
+    @classmethod
+    def from_hex(cls, texts):
+        """Decode stored hex responses directly into the rows of a new cohort."""
+        texts = list(texts)
+        cohort = cls(len(texts))
+        for i, text in enumerate(texts):
+            _hex_to_bits(text, cohort._buffer[i])
+        cohort.size = len(texts)
+        return cohort
+
+    @classmethod
+    def from_bits(cls, bits):
+        """Wrap an existing uint8[N, NUM_QUESTIONS] array (e.g. memory-mapped) without copying."""
+        bits = np.asarray(bits)
+        if bits.dtype != np.uint8 or bits.ndim != 2 or bits.shape[1] != NUM_QUESTIONS:
+            raise ValueError(f"Expected uint8[N, {NUM_QUESTIONS}], got {bits.dtype}{list(bits.shape)}")
+        cohort = cls.__new__(cls)
+        cohort._buffer = bits
+        cohort.size = len(bits)
+        return cohort
+
+    def append(self, responses):
+        """Add one sheet (SheetResponses, bits or a bool option matrix); returns its row view."""
+        if self.size == len(self._buffer):
+            grown = np.zeros((2 * len(self._buffer), NUM_QUESTIONS), dtype=np.uint8)
+            grown[:self.size] = self._buffer[:self.size]
+            self._buffer = grown
+        row = self._buffer[self.size]
+        row[:] = as_bits(responses)
+        self.size += 1
+        return SheetResponses(row)
+
+    @property
+    def bits(self):
+        return self._buffer[:self.size]
+
+    @property
+    def marked(self):
+        """bool[N, NUM_QUESTIONS, NUM_OPTS] (a new array, 4x the size of bits)."""
+        return unpack_bits(self.bits)
+
+    def section(self, name):
+        """uint8[N, section length] view of one section's questions."""
+        startq, endq = SECTION_RANGES[name]
+        return self.bits[:, startq - 1:endq]
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        if not -self.size <= index < self.size:
+            raise IndexError(index)
+        return SheetResponses(self._buffer[index % self.size])
+
+    def __iter__(self):
+        return (SheetResponses(row) for row in self.bits)
@@ -0,0 +1,95 @@
+import os
+import csv
+import threading
+
+from scoring_engine import SECTION_NAMES
+
+CSV_HEADERS = ["Student Name", "Roll Number"] + SECTION_NAMES + [
+    "Marks Obtained", "Total Marks", "Percentage", "Set Name"]
+
+# path -> (inode, bytes indexed so far, [byte offset of each data row])
+_row_index = {}
+_index_lock = threading.Lock()
+
+
+def results_version(path):
+    """Cheap change token for a results CSV: grows with every appended row."""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return "0"
+    return f"{st.st_mtime_ns:x}-{st.st_size:x}"
+
+
+def append_row(path, row):
+    """Append one result row, writing the header first if the file is new."""
+    is_new = not os.path.exists(path)
+    with open(path, "a", newline="", encoding="utf-8") as fcsv:
+        writer = csv.writer(fcsv)
+        if is_new:
+            writer.writerow(CSV_HEADERS)
+        writer.writerow(row)
+
+
+def replace_row(path, roll_no, set_name, row):
+    """Replace the last row for (roll number, set) in place, or append if there is none.
+    Used when a student is rescanned, so the CSV keeps one row per student and set."""
+    if not os.path.exists(path):
+        return append_row(path, row)
+    with open(path, "r", newline="", encoding="utf-8") as f:
+        rows = list(csv.reader(f))
+    roll_idx, set_idx = CSV_HEADERS.index("Roll Number"), CSV_HEADERS.index("Set Name")
+    for i in range(len(rows) - 1, 0, -1):
+        if len(rows[i]) > set_idx and rows[i][roll_idx] == roll_no and rows[i][set_idx] == set_name:
+            rows[i] = row
+            break
+    else:
+        rows.append(row)
+    tmp = path + ".tmp"
+    with open(tmp, "w", newline="", encoding="utf-8") as f:
+        csv.writer(f).writerows(rows)
+    with _index_lock:
+        os.replace(tmp, path)
+        _row_index.pop(path, None)
+
+
+def _update_index(path):
+    st = os.stat(path)
+    size = st.st_size
+    inode, indexed, offsets = _row_index.get(path, (st.st_ino, 0, []))
+    if size < indexed or inode != st.st_ino:
+        # file was replaced (possibly by another process) or truncated: rebuild
+        indexed, offsets = 0, []
+    if size == indexed:
+        return offsets
+    with open(path, "rb") as f:
+        f.seek(indexed)
+        pos = indexed
+        for line in f:
+            if not line.endswith(b"\n"):
+                break  # partial row still being written
+            if pos > 0 and line.strip():
+                offsets.append(pos)
+            pos += len(line)
+    _row_index[path] = (st.st_ino, pos, offsets)
+    return offsets
+
+
+def read_page(path, page=1, page_size=50):
+    """One page of a results CSV. Row offsets are indexed incrementally, so a page read
+    only touches the bytes of that page (plus any rows appended since the last call)."""
+    if not os.path.exists(path):
+        return {"columns": CSV_HEADERS, "rows": [], "total_rows": 0}
+    start = (page - 1) * page_size
+    with _index_lock:
+        offsets = _update_index(path)
+        total = len(offsets)
+        first = offsets[start] if start < total else None
+    with open(path, "rb") as f:
+        columns = next(csv.reader([f.readline().decode("utf-8-sig")]), CSV_HEADERS)
+        lines = []
+        if first is not None:
+            f.seek(first)
+            for _ in range(min(page_size, total - start)):
+                lines.append(f.readline().decode("utf-8"))
+    return {"columns": columns, "rows": list(csv.reader(lines)), "total_rows": total}
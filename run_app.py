@@ -4,14 +4,30 @@ import threading
 import time
 import os
 import sys
+import urllib.request
+
+def wait_until_ready(port, timeout=120.0, interval=0.2):
+    """Poll the API's /ready endpoint until the scoring workers are warm"""
+    url = f"http://127.0.0.1:{port}/ready"
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=2) as r:
+                if r.status == 200:
+                    return True
+        except Exception:
+            pass
+        time.sleep(interval)
+    return False
 
 def start_streamlit():
-    """Start Streamlit in background"""
-    time.sleep(5)  # Wait for FastAPI to start
+    """Start Streamlit in background once the API reports ready"""
     try:
         # Get the port from environment variable
         port = os.environ.get("PORT", "8000")
         streamlit_port = str(int(port) + 1)
+        if not wait_until_ready(port):
+            print("API did not become ready in time, starting Streamlit anyway")
         
         subprocess.run([
             sys.executable, "-m", "streamlit", "run", "app.py",
@@ -0,0 +1,202 @@
+"""Admission control and priority lanes in front of the scoring engine.
+
+Every sheet waits for a detection slot in its request's lane before it is detected:
+"interactive" for single sheets and the small batches the Streamlit UI sends,
+"bulk" for large batches and scanned documents. Free slots go to the lanes in
+proportion to their weights (stride scheduling), so a bulk upload hundreds of sheets
+deep only ever holds its share of the workers while a teacher's sheet is waiting.
+Within a lane sheets go first come first served, except that no client holds more
+than CLIENT_LIMIT slots at once. A request arriving at a lane that already has its
+limit of unfinished requests is refused with 429 and a Retry-After estimated from the
+queue and recent detection times.
+
+Lane and client are carried in a context variable (like tracing's request trace), so
+the code between an endpoint and the detection call does not pass them along.
+"""
+import os
+import math
+import asyncio
+import contextlib
+import contextvars
+import collections
+
+from tracing import span
+
+INTERACTIVE, BULK = "interactive", "bulk"
+LANES = (INTERACTIVE, BULK)
+# Batches of at most this many sheets are interactive (the UI sends UI_BATCH_CHUNK = 4)
+INTERACTIVE_MAX_SHEETS = int(os.getenv("OMR_INTERACTIVE_MAX_SHEETS", "4"))
+WEIGHTS = {INTERACTIVE: float(os.getenv("OMR_INTERACTIVE_WEIGHT", "4")), BULK: 1.0}
+QUEUE_LIMITS = {INTERACTIVE: int(os.getenv("OMR_QUEUE_LIMIT_INTERACTIVE", "64")),
+                BULK: int(os.getenv("OMR_QUEUE_LIMIT_BULK", "32"))}
+SLOTS = int(os.getenv("OMR_SCHEDULER_SLOTS", "0"))         # 0: one per scoring worker
+CLIENT_LIMIT = int(os.getenv("OMR_CLIENT_CONCURRENCY", "0"))  # 0: half the slots, at least 1
+WAIT_WINDOW = 1000  # recent waits per lane kept for percentiles
+
+_lane = contextvars.ContextVar("omr_lane", default=(INTERACTIVE, None))
+
+
+class QueueFull(Exception):
+    def __init__(self, lane, retry_after):
+        super().__init__(f"The {lane} scoring queue is full; retry in {retry_after} s")
+        self.lane = lane
+        self.retry_after = retry_after
+
+
+@contextlib.contextmanager
+def lane(name, client=None):
+    """Detections inside the block wait in lane `name` on behalf of `client`."""
+    token = _lane.set((name, client))
+    try:
+        yield
+    finally:
+        _lane.reset(token)
+
+
+def lane_for(sheets=1, requested=None):
+    """The lane of a request scoring `sheets` sheets (None: unknown, e.g. a document).
+    A client may put its own work in the bulk lane, never take it out."""
+    if requested == BULK or sheets is None or sheets > INTERACTIVE_MAX_SHEETS:
+        return BULK
+    return INTERACTIVE
+
+
+class _Lane:
+    def __init__(self, name, weight, limit):
+        self.name = name
+        self.weight = weight
+        self.limit = limit
+        self.waiters = collections.deque()   # (future, client, enqueued at)
+        self.running = 0
+        self.in_flight = 0                    # requests admitted and not finished yet
+        self.pass_ = 0.0                      # stride scheduling: lowest pass goes next
+        self.admitted = self.rejected = self.served = 0
+        self.waits = collections.deque(maxlen=WAIT_WINDOW)
+
+
+class Scheduler:
+    """Weighted fair detection slots for the lanes, with per-client limits (one event loop)."""
+
+    def __init__(self, slots, client_limit=CLIENT_LIMIT, weights=WEIGHTS, queue_limits=QUEUE_LIMITS):
+        self.slots = max(1, slots)
+        self.client_limit = client_limit or max(1, (self.slots + 1) // 2)
+        self.lanes = {name: _Lane(name, weights[name], queue_limits[name]) for name in LANES}
+        self.running = 0
+        self.clients = collections.Counter()   # client -> slots held
+        self._service_s = None                 # moving average of slot hold times
+
+    def admit(self, lane_name):
+        """Let a request into its lane, or raise QueueFull when the lane already holds its limit
+        of unfinished requests. The place is taken now, before the request's sheets queue for
+        slots, so a burst cannot all get in; finish() gives it back when the request ends."""
+        lane_ = self.lanes[lane_name]
+        if lane_.in_flight >= lane_.limit:
+            lane_.rejected += 1
+            raise QueueFull(lane_name, self.retry_after(lane_name))
+        lane_.admitted += 1
+        lane_.in_flight += 1
+
+    def finish(self, lane_name):
+        self.lanes[lane_name].in_flight -= 1
+
+    @contextlib.contextmanager
+    def admission(self, lane_name):
+        """admit() for the request in the block, finish() however it ends."""
+        self.admit(lane_name)
+        try:
+            yield
+        finally:
+            self.finish(lane_name)
+
+    def retry_after(self, lane_name):
+        """Seconds until the lane's current queue should have drained, at its fair share."""
+        lane_ = self.lanes[lane_name]
+        busy = [l for l in self.lanes.values() if l.waiters or l is lane_]
+        share = lane_.weight / sum(l.weight for l in busy)
+        seconds = len(lane_.waiters) * (self._service_s or 1.0) / (self.slots * share)
+        return max(1, min(300, math.ceil(seconds)))
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        """Hold a detection slot in the current lane for the block."""
+        lane_name, client = _lane.get()
+        lane_ = self.lanes[lane_name]
+        loop = asyncio.get_running_loop()
+        enqueued = loop.time()
+        waiter = loop.create_future()
+        if not lane_.waiters and not lane_.running:
+            # an idle lane rejoins at the current virtual time instead of cashing in its idle time
+            lane_.pass_ = max(lane_.pass_, min((l.pass_ for l in self.lanes.values()
+                                                if l.waiters or l.running), default=0.0))
+        lane_.waiters.append((waiter, client, enqueued))
+        self._dispatch()
+        try:
+            with span("queue"):
+                await waiter
+        except BaseException:
+            if waiter.done() and not waiter.cancelled():
+                self._release(lane_, client, None)   # granted just as the wait was cancelled
+            else:
+                lane_.waiters = collections.deque(w for w in lane_.waiters if w[0] is not waiter)
+            raise
+        started = loop.time()
+        lane_.waits.append((started - enqueued) * 1000)
+        try:
+            yield
+        finally:
+            self._release(lane_, client, loop.time() - started)
+
+    def _release(self, lane_, client, held_s):
+        self.running -= 1
+        lane_.running -= 1
+        lane_.served += 1
+        if client is not None:
+            self.clients[client] -= 1
+            if not self.clients[client]:
+                del self.clients[client]
+        if held_s is not None:
+            self._service_s = held_s if self._service_s is None else 0.9 * self._service_s + 0.1 * held_s
+        self._dispatch()
+
+    def _next(self, lane_):
+        """Index of the lane's first waiter whose client is under its limit, or None."""
+        for i, (_, client, _) in enumerate(lane_.waiters):
+            if client is None or self.clients[client] < self.client_limit:
+                return i
+        return None
+
+    def _dispatch(self):
+        while self.running < self.slots:
+            # lowest pass first; on a tie the heavier lane
+            ready = [(l.pass_, -l.weight, l.name, l, i) for l in self.lanes.values() if l.waiters
+                     for i in [self._next(l)] if i is not None]
+            if not ready:
+                return
+            *_, lane_, i = min(ready)
+            waiter, client, _ = lane_.waiters[i]
+            del lane_.waiters[i]
+            lane_.pass_ += 1 / lane_.weight
+            self.running += 1
+            lane_.running += 1
+            if client is not None:
+                self.clients[client] += 1
+            waiter.set_result(None)
+
+    def snapshot(self):
+        def lane_stats(l):
+            waits = sorted(l.waits)
+
+            def pct(q):
+                return round(waits[min(len(waits) - 1, int(q * len(waits)))], 1) if waits else None
+
+            return {"weight": l.weight, "queue_limit": l.limit, "waiting": len(l.waiters), "running": l.running,
+                    "in_flight": l.in_flight,
+                    "admitted": l.admitted, "rejected": l.rejected, "served": l.served,
+                    "wait_ms": {"samples": len(waits), "p50": pct(0.5), "p95": pct(0.95),
+                                "max": round(waits[-1], 1) if waits else None,
+                                "mean": round(sum(waits) / len(waits), 1) if waits else None}}
+
+        return {"slots": self.slots, "running": self.running, "client_limit": self.client_limit,
+                "clients_running": len(self.clients),
+                "service_ms": None if self._service_s is None else round(self._service_s * 1000, 1),
+                "lanes": {name: lane_stats(l) for name, l in self.lanes.items()}}
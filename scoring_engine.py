@@ -0,0 +1,171 @@
+import os
+import json
+
+import numpy as np
+
+from omr_layout import SECTION_RANGES, NUM_QUESTIONS
+from responses import POPCOUNT, as_bits
+from fileio import atomic_write
+
+SECTION_NAMES = list(SECTION_RANGES)
+SECTION_STARTS = np.array([startq - 1 for startq, _ in SECTION_RANGES.values()])
+MULTI_ANSWER_MODES = ("exact", "partial", "any")
+
+# Reproduces the original behaviour: +1 for an exact match, nothing otherwise
+DEFAULT_SCHEME = {
+    "positive": 1.0,         # marks for a fully correct answer
+    "negative": 0.0,         # marks deducted for a wrong (attempted) answer
+    "multi_answer": "exact", # keys like "16 - a,b,c,d": exact | partial | any
+    "section_weights": {},   # {"SQL": 2.0} multiplies every question in the section
+    "dropped": [],           # question numbers removed from scoring and from the maximum
+    "bonus": []              # question numbers awarded full marks to everyone
+}
+
+
+def _scheme_number(value, field):
+    if isinstance(value, bool):
+        raise ValueError(f"{field} must be a number")
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{field} must be a number, not {value!r}") from None
+
+
+def validate_scheme(scheme):
+    """Merge a (partial) scheme over the defaults; raises ValueError on bad fields."""
+    if not isinstance(scheme, dict):
+        raise ValueError("Marking scheme must be a JSON object")
+    unknown = set(scheme) - set(DEFAULT_SCHEME)
+    if unknown:
+        raise ValueError(f"Unknown marking scheme fields: {sorted(unknown)}")
+    merged = dict(DEFAULT_SCHEME, **scheme)
+    merged["positive"] = _scheme_number(merged["positive"], "positive")
+    merged["negative"] = abs(_scheme_number(merged["negative"], "negative"))
+    if merged["multi_answer"] not in MULTI_ANSWER_MODES:
+        raise ValueError(f"multi_answer must be one of {MULTI_ANSWER_MODES}")
+    if not isinstance(merged["section_weights"], dict):
+        raise ValueError('section_weights must be an object like {"SQL": 2}')
+    for section in merged["section_weights"]:
+        if section not in SECTION_RANGES:
+            raise ValueError(f"Unknown section in section_weights: {section}")
+    merged["section_weights"] = {s: _scheme_number(w, f"section_weights.{s}") for s, w in merged["section_weights"].items()}
+    for field in ("dropped", "bonus"):
+        if not isinstance(merged[field], (list, tuple)):
+            raise ValueError(f"{field} must be a list of question numbers")
+        try:
+            qnums = sorted({int(str(q).lstrip("Qq")) for q in merged[field]})
+        except ValueError:
+            raise ValueError(f"{field} must be a list of question numbers") from None
+        if any(not 1 <= q <= NUM_QUESTIONS for q in qnums):
+            raise ValueError(f"{field} questions must be between 1 and {NUM_QUESTIONS}")
+        merged[field] = qnums
+    return merged
+
+
+def scheme_path(key_dir, set_name):
+    return os.path.join(key_dir, f"scheme_{set_name.upper()}.json")
+
+
+def save_scheme(key_dir, set_name, scheme):
+    scheme = validate_scheme(scheme)
+    with atomic_write(scheme_path(key_dir, set_name), "w", encoding="utf-8") as f:
+        json.dump(scheme, f, indent=2)
+    return scheme
+
+
+_scheme_cache = {}
+
+
+def load_scheme(key_dir, set_name):
+    """Marking scheme for a set (scheme_<SET>.json), falling back to DEFAULT_SCHEME."""
+    path = scheme_path(key_dir, set_name)
+    mtime = os.path.getmtime(path) if os.path.exists(path) else None
+    cached = _scheme_cache.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    scheme = dict(DEFAULT_SCHEME)
+    if mtime is not None:
+        with open(path, "r", encoding="utf-8") as f:
+            scheme = validate_scheme(json.load(f))
+    _scheme_cache[path] = (mtime, scheme)
+    return scheme
+
+
+def _question_weights(key_bits, scheme):
+    """Per-question section weight (0 for dropped / unkeyed questions) and the bonus mask."""
+    weights = np.ones(NUM_QUESTIONS, dtype=np.float32)
+    for section, w in scheme["section_weights"].items():
+        startq, endq = SECTION_RANGES[section]
+        weights[startq-1:endq] = w
+    bonus = np.zeros(NUM_QUESTIONS, dtype=bool)
+    bonus[np.array(scheme["bonus"], dtype=int) - 1] = True
+    counted = (key_bits != 0) | bonus
+    counted[np.array(scheme["dropped"], dtype=int) - 1] = False
+    return np.where(counted, weights, 0).astype(np.float32), bonus & counted
+
+
+def score_responses(responses, key_bits, scheme=None):
+    """Score responses against a key bitmask.
+
+    responses is a SheetResponses / ResponseCohort (see responses.py), their uint8 bits, or
+    a bool[..., NUM_QUESTIONS, NUM_OPTS] tensor; one sheet or a cohort alike. Returns a dict
+    of arrays: per-question marks and maxima, per-section scores (in SECTION_NAMES order),
+    totals and the maximum possible marks.
+    """
+    scheme = validate_scheme(scheme or {})
+    bits = as_bits(responses) & 0xF
+    key_bits = np.asarray(key_bits, dtype=np.uint8) & 0xF
+    weights, bonus = _question_weights(key_bits, scheme)
+    positive = weights * scheme["positive"]
+    penalty = weights * scheme["negative"]
+
+    # option counts are popcounts of the 4-bit masks
+    n_key = POPCOUNT[key_bits]
+    hits = POPCOUNT[bits & key_bits]
+    extras = POPCOUNT[bits & ~key_bits & 0xF]
+    attempted = (hits + extras) > 0
+    if scheme["multi_answer"] == "partial":
+        # fraction of the keyed options marked, as long as nothing outside the key is marked
+        credit = np.where(extras == 0, hits / np.maximum(n_key, 1), 0.0)
+    elif scheme["multi_answer"] == "any":
+        credit = ((hits > 0) & (extras == 0)).astype(np.float32)
+    else:
+        credit = ((hits == n_key) & (extras == 0) & attempted).astype(np.float32)
+    credit = np.where(n_key > 0, credit, 0.0)
+
+    marks = credit * positive - (attempted & (credit == 0)) * penalty
+    marks = np.where(bonus, positive, marks).astype(np.float32)
+    section_scores = np.add.reduceat(marks, SECTION_STARTS, axis=-1)
+    max_sections = np.add.reduceat(positive, SECTION_STARTS)
+    return {
+        "question_marks": marks,
+        "question_max": positive,
+        "section_scores": section_scores,
+        "total": section_scores.sum(axis=-1),
+        "max_section_scores": max_sections,
+        "max_total": float(max_sections.sum())
+    }
+
+
+def _number(x):
+    x = float(x)
+    return int(x) if x.is_integer() else round(x, 2)
+
+
+def section_scores_dict(result, index=None):
+    """One sheet's result as the {section: marks, "Total": marks} dict used by the API/CSV."""
+    sections = result["section_scores"] if index is None else result["section_scores"][index]
+    total = result["total"] if index is None else result["total"][index]
+    scores = {name: _number(v) for name, v in zip(SECTION_NAMES, sections)}
+    scores["Total"] = _number(total)
+    return scores
+
+
+def max_marks(key_bits, scheme=None):
+    """Maximum marks per section plus "Total" for a key under a scheme."""
+    scheme = validate_scheme(scheme or {})
+    weights, _ = _question_weights(key_bits, scheme)
+    sections = np.add.reduceat(weights * scheme["positive"], SECTION_STARTS)
+    scores = {name: _number(v) for name, v in zip(SECTION_NAMES, sections)}
+    scores["Total"] = _number(sections.sum())
+    return scores
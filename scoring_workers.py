@@ -0,0 +1,269 @@
+import os
+import time
+import asyncio
+import collections
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from job_store import open_job_store, DONE, FAILED
+from blob_store import open_blob_store
+from submissions import file_sha256, unpack_marked
+from thresholding import DEFAULT_THRESHOLD_MODE
+from debug_overlay import unpack_trace
+from image_io import estimate_sheet_bytes
+from profiles import get_profile
+from fileio import run_io
+from quality import SheetRejected
+import tracing
+
+# Deliberately no cv2 / omr_scoring import here: the API process only coordinates,
+# each scoring worker imports the OpenCV pipeline once in its initializer.
+
+logger = logging.getLogger("omr_api")
+
+# Set OMR_JOB_STORE to share scoring between processes / hosts through a job queue
+JOB_STORE_URL = os.getenv("OMR_JOB_STORE")
+JOB_TIMEOUT = float(os.getenv("OMR_JOB_TIMEOUT", "120"))
+WORKER_TTL = 30
+NUM_WORKERS = int(os.getenv("OMR_SCORING_WORKERS", str(max(1, min(4, os.cpu_count() or 1)))))
+# Memory each scoring worker may spend on sheets; a 20 MP photo needs ~20-30 MB
+WORKER_MEMORY_BYTES = int(float(os.getenv("OMR_WORKER_MEMORY_MB", "256")) * 2**20)
+
+_omr = None
+
+
+def _init_worker():
+    global _omr
+    import omr_scoring
+    _omr = omr_scoring
+
+
+def warm_up():
+    """Run the OpenCV calls of the pipeline once so the first real sheet does not pay for
+    lazy library initialisation; returns (pid, seconds spent)."""
+    start = time.perf_counter()
+    if _omr is None:
+        _init_worker()
+    import numpy as np
+    cv2 = _omr.cv2
+    img = np.full((200, 160, 3), 255, dtype=np.uint8)
+    cv2.circle(img, (80, 100), 10, (0, 0, 0), -1)
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    blur = cv2.GaussianBlur(gray, (5, 5), 0)
+    thresh = cv2.adaptiveThreshold(blur, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY_INV, 13, 8)
+    cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    cv2.resize(img, (80, 100), interpolation=cv2.INTER_LINEAR)
+    cv2.imencode(".jpg", img)
+    # a grid of bubbles takes the quality check through all its paths (first numpy calls cost ms)
+    sheet = np.full((800, 640), 255, dtype=np.uint8)
+    for y in range(40, 780, 36):
+        for x in range(30, 620, 28):
+            cv2.circle(sheet, (x, y), 9, 0, 2)
+    import quality
+    quality.check_quality(sheet)
+    return os.getpid(), time.perf_counter() - start
+
+
+def detect_image(image_path, mode=None, profile=None):
+    """(marked bool[NUM_QUESTIONS, NUM_OPTS], thresholding info, debug trace) for one sheet."""
+    if _omr is None:
+        _init_worker()
+    return _omr.read_sheet(image_path, mode, profile=profile)
+
+
+def detect_image_timed(image_path, mode=None, profile=None):
+    """detect_image plus the spans of its stages (tracing.py), for the request that asked."""
+    with tracing.collect() as trace:
+        result = detect_image(image_path, mode, profile)
+    return result, tracing.export(trace)
+
+
+def check_frame(data):
+    """quality.frame_quality of an encoded image (a live-capture frame); None if it does not decode.
+    Raises image_io.ImageTooLarge for a frame over the pixel limit."""
+    import quality
+    gray = quality.decode_frame(data)
+    return None if gray is None else quality.frame_quality(gray)
+
+
+class MemoryBudget:
+    """Admit sheets in arrival order while their estimated peak memory fits in the budget.
+
+    A sheet larger than the whole budget is admitted only when nothing else is running;
+    sheets behind it wait rather than overtake it, so it cannot be starved."""
+
+    def __init__(self, budget_bytes):
+        self.budget = budget_bytes
+        self.in_use = 0
+        self._queue = collections.deque()
+        self._cond = None
+
+    async def acquire(self, nbytes):
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        nbytes = min(nbytes, self.budget)
+        ticket = object()
+        async with self._cond:
+            self._queue.append(ticket)
+            try:
+                await self._cond.wait_for(
+                    lambda: self._queue[0] is ticket and self.in_use + nbytes <= self.budget)
+            finally:
+                self._queue.remove(ticket)
+                self._cond.notify_all()
+            self.in_use += nbytes
+        return nbytes
+
+    async def release(self, nbytes):
+        async with self._cond:
+            self.in_use -= nbytes
+            self._cond.notify_all()
+
+    def status(self):
+        return {"budget_mb": round(self.budget / 2**20, 1), "in_use_mb": round(self.in_use / 2**20, 1),
+                "waiting": len(self._queue)}
+
+
+class ScoringPool:
+    """Pool of warm scoring workers. OMR_SCORING_WORKERS=0 scores on a thread in-process."""
+
+    def __init__(self, workers=NUM_WORKERS):
+        self.workers = workers
+        self.memory = MemoryBudget(WORKER_MEMORY_BYTES * max(workers, 1))
+        self._executor = None
+        self._warm_futures = []
+        self.started_at = None
+        self.warm_seconds = None
+
+    def start(self):
+        self.started_at = time.perf_counter()
+        if self.workers > 0:
+            # spawn: workers start clean and import only what scoring needs
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker
+            )
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="omr-score")
+        self._warm_futures = [self._executor.submit(warm_up) for _ in range(max(self.workers, 1))]
+        for fut in self._warm_futures:
+            fut.add_done_callback(self._on_warm)
+
+    def _on_warm(self, fut):
+        if fut.exception() is not None:
+            logger.error(f"Scoring worker failed to warm up: {fut.exception()}")
+        if self.ready() and self.warm_seconds is None:
+            self.warm_seconds = time.perf_counter() - self.started_at
+            logger.info(f"Scoring pool warm: {self.workers or 'in-process'} worker(s) in {self.warm_seconds:.2f}s")
+
+    def ready(self):
+        return bool(self._warm_futures) and all(f.done() and f.exception() is None for f in self._warm_futures)
+
+    def status(self):
+        return {
+            "workers": self.workers,
+            "warm": self.ready(),
+            "warm_seconds": None if self.warm_seconds is None else round(self.warm_seconds, 3),
+            "memory": self.memory.status()
+        }
+
+    async def detect(self, image_path, image_sha=None, mode=None, profile=None):
+        """Detect marked bubbles off the event loop; returns (bool[NUM_QUESTIONS, NUM_OPTS], info, trace)."""
+        loop = asyncio.get_running_loop()
+        estimate = await run_io(estimate_sheet_bytes, image_path, get_profile(profile)["decode_side"])
+        with tracing.span("admit"):
+            nbytes = await self.memory.acquire(estimate)
+        try:
+            result, spans = await loop.run_in_executor(self._executor, detect_image_timed, image_path, mode, profile)
+            tracing.merge(spans)
+            return result
+        finally:
+            await self.memory.release(nbytes)
+
+    async def check_frame(self, data):
+        """check_frame on a scoring worker: frames are small, so no memory budget."""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, check_frame, data)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class JobQueueScorer:
+    """Same interface as ScoringPool, but detection runs on whichever worker leases the job.
+
+    Jobs are keyed by image hash, threshold mode and profile, so the same scan is only ever detected once no matter how
+    many API processes receive it. Ready once at least one worker has sent a heartbeat."""
+
+    def __init__(self, jobs, blobs, local_workers=0):
+        self.jobs = jobs
+        self.blobs = blobs
+        self.local_workers = local_workers
+        self._stop = threading.Event()
+
+    def start(self):
+        if self.local_workers:
+            from omr_worker import start_local_workers
+            start_local_workers(self.jobs, self.blobs, self.local_workers, self._stop)
+
+    def ready(self):
+        return bool(self.jobs.workers(WORKER_TTL))
+
+    def status(self):
+        workers = self.jobs.workers(WORKER_TTL)
+        return {"workers": len(workers), "warm": bool(workers), "jobs": self.jobs.stats()}
+
+    def _submit(self, image_path, image_sha, mode, profile):
+        image_sha = image_sha or file_sha256(image_path)
+        if not self.blobs.exists(image_sha):
+            self.blobs.put_file(image_path, image_sha)
+        # a re-tuned profile keeps its name; its version keeps old results from being reused
+        version = get_profile(profile).get("version")
+        job_id = f"detect:{mode}:{profile}{f'@v{version}' if version else ''}:{image_sha}"
+        return job_id, self.jobs.submit("detect", {"image_sha256": image_sha, "mode": mode, "profile": profile}, job_id)
+
+    async def detect(self, image_path, image_sha=None, mode=None, profile=None):
+        mode = mode or DEFAULT_THRESHOLD_MODE
+        profile = get_profile(profile)["name"]
+        # hashing, blob upload and the job store (sqlite) are blocking I/O
+        with tracing.span("submit"):
+            job_id, job = await run_io(self._submit, image_path, image_sha, mode, profile)
+        # a job already done was detected for an earlier request: its stages are not ours
+        reused = job["state"] == DONE
+        deadline = time.monotonic() + JOB_TIMEOUT
+        delay = 0.01
+        while job["state"] not in (DONE, FAILED):
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"no worker finished job {job_id} within {JOB_TIMEOUT:.0f}s")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.25)
+            job = await run_io(self.jobs.get, job_id)
+        if job["state"] == FAILED:
+            raise RuntimeError(job["error"])
+        result = job["result"]
+        if "rejected" in result:
+            raise SheetRejected(result["rejected"])
+        if not reused:
+            tracing.merge(result.get("spans"))
+        return unpack_marked(result["marked"]), result["info"], unpack_trace(result["trace"])
+
+    async def check_frame(self, data):
+        # a round trip through the job store would cost more than the check: this imports
+        # OpenCV into the API process on the first live-capture frame
+        return await asyncio.to_thread(check_frame, data)
+
+    def shutdown(self):
+        self._stop.set()
+
+
+def make_scorer(blob_store_url):
+    """ScoringPool by default; a JobQueueScorer when OMR_JOB_STORE is set."""
+    if not JOB_STORE_URL:
+        return ScoringPool()
+    jobs = open_job_store(JOB_STORE_URL)
+    default_local = 1 if JOB_STORE_URL.startswith("memory://") else 0
+    local_workers = int(os.getenv("OMR_LOCAL_WORKERS", str(default_local)))
+    return JobQueueScorer(jobs, open_blob_store(blob_store_url), local_workers)
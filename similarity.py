@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""Answer-pattern similarity across a cohort: pairs of students who may have copied.
+
+Two honest students who know the material give the same right answers; what copying
+leaves behind is the same *wrong* answers. For every pair of sheets of a set this counts
+the questions both got wrong with the identical marks (exact errors in common, EEIC) and
+the questions they answered differently (D), and ranks pairs by EEIC / D (the Harpp-Hogan
+index): many shared errors and few differences. The ratio is compared with the whole
+cohort's, so `z` says how unusual a pair is for this exam.
+
+Each sheet's 100 answer nibbles (responses.py bits) are packed into 7 uint64 words. Per
+pair, XOR and an OR-fold of each nibble leave one bit per question answered differently;
+AND with the sheet's wrong-answer mask gives the differing wrong answers. The per-nibble
+bits of all words are summed into nibble counters (at most 7 each, no carries) and
+counted once per pair, so numpy 1.x needs no popcount instruction. Pairs are processed in
+blocks of BLOCK x BLOCK sheets to bound memory, keeping a running top list.
+
+    python similarity.py scores.csv [--set A] [--top 20]
+    python similarity.py --synthetic 20000     # timing on a random cohort
+"""
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+from omr_layout import NUM_QUESTIONS
+from scoring_engine import score_responses
+
+BLOCK = int(os.getenv("OMR_SIMILARITY_BLOCK", "256"))  # sheets; blocks this size stay in cache
+TOP_PAIRS = 20
+MIN_COMMON_WRONG = 3   # pairs sharing fewer identical wrong answers are never reported
+# Pairs this many standard deviations above the cohort's mean index are flagged. On random
+# cohorts the most similar pair reaches z ~5 (100 sheets) to ~10 (20k); a sheet half copied
+# from another scores ~25
+FLAG_Z = float(os.getenv("OMR_SIMILARITY_FLAG_Z", "15"))
+
+WORDS = -(-NUM_QUESTIONS // 16)   # 16 nibbles per uint64
+_LOW = np.uint64(0x1111111111111111)
+_BYTE_NIBBLES = np.uint64(0x0F0F0F0F0F0F0F0F)
+_BYTE_SUM = np.uint64(0x0101010101010101)
+_ONE, _TWO, _FOUR, _TOP_BYTE = (np.uint64(n) for n in (1, 2, 4, 56))
+
+
+def pack_nibbles(nibbles):
+    """uint8[N, NUM_QUESTIONS] of values 0..15 -> uint64[N, WORDS], one nibble per question."""
+    nibbles = np.asarray(nibbles, dtype=np.uint8) & 0xF
+    padded = np.zeros((len(nibbles), WORDS * 16), dtype=np.uint8)
+    padded[:, :NUM_QUESTIONS] = nibbles
+    packed = padded[:, 0::2] | (padded[:, 1::2] << 4)
+    return np.ascontiguousarray(packed).view("<u8")
+
+
+def _nibble_sum(counters):
+    """Sum of the 16 nibble counters of each uint64 (each at most 15, sum at most 255)."""
+    counters = (counters & _BYTE_NIBBLES) + ((counters >> _FOUR) & _BYTE_NIBBLES)
+    return ((counters * _BYTE_SUM) >> _TOP_BYTE).astype(np.int32)
+
+
+def _pair_counts(a_rows, a_cols, wrong_rows):
+    """(differing questions, differing questions the row sheet got wrong) for every pair
+    of a block, int32[rows, cols] each."""
+    shape = (len(a_rows), len(a_cols))
+    x, y = np.empty(shape, np.uint64), np.empty(shape, np.uint64)
+    differ, differ_wrong = np.zeros(shape, np.uint64), np.zeros(shape, np.uint64)
+    for w in range(WORDS):
+        np.bitwise_xor(a_rows[:, w, None], a_cols[None, :, w], out=x)
+        # fold each nibble onto its low bit: set when the question was answered differently
+        np.bitwise_or(x, np.right_shift(x, _ONE, out=y), out=x)
+        np.bitwise_or(x, np.right_shift(x, _TWO, out=y), out=x)
+        np.bitwise_and(x, _LOW, out=x)
+        differ += x
+        np.bitwise_and(x, wrong_rows[:, w, None], out=x)
+        differ_wrong += x
+    return _nibble_sum(differ), _nibble_sum(differ_wrong)
+
+
+def wrong_answers(bits, key_bits, scheme=None):
+    """bool[N, NUM_QUESTIONS]: attempted and given no credit (dropped questions excluded)."""
+    result = score_responses(bits, key_bits, scheme)
+    attempted = (np.asarray(bits, dtype=np.uint8) & 0xF) != 0
+    return attempted & (result["question_marks"] <= 0) & (result["question_max"] > 0)
+
+
+def scan(bits, key_bits, scheme=None, top=TOP_PAIRS, block=BLOCK, min_common_wrong=MIN_COMMON_WRONG):
+    """The `top` most similar pairs of a set's sheets, uint8[N, NUM_QUESTIONS] bits.
+
+    Returns {"pairs": [{"a", "b" (row indices), "common_wrong", "differ", "index", "z"}],
+    "cohort": {"sheets", "pairs", "index_mean", "index_std"}}."""
+    bits = np.asarray(bits, dtype=np.uint8) & 0xF
+    n = len(bits)
+    wrong = wrong_answers(bits, key_bits, scheme)
+    dropped = np.asarray(score_responses(np.zeros((1, NUM_QUESTIONS), np.uint8), key_bits, scheme)["question_max"]) <= 0
+    # dropped questions read as blank for everyone, so they neither match nor differ
+    answers = pack_nibbles(np.where(dropped, 0, bits))
+    wrong_words = pack_nibbles(wrong.astype(np.uint8))
+    errors = wrong.sum(axis=1).astype(np.int32)
+
+    best = np.empty(0, dtype=[("index", np.float64), ("a", np.int64), ("b", np.int64),
+                              ("common_wrong", np.int32), ("differ", np.int32)])
+    total = total_sq = 0.0
+    pairs = 0
+    for i0 in range(0, n, block):
+        rows = slice(i0, min(n, i0 + block))
+        for j0 in range(i0, n, block):
+            cols = slice(j0, min(n, j0 + block))
+            differ, differ_wrong = _pair_counts(answers[rows], answers[cols], wrong_words[rows])
+            common_wrong = errors[rows, None] - differ_wrong
+            index = common_wrong / np.maximum(differ, 1)
+            valid = np.ones(index.shape, dtype=bool)
+            if i0 == j0:
+                valid = np.triu(valid, k=1)   # each pair once, no sheet against itself
+            pairs += int(valid.sum())
+            total += float(index[valid].sum())
+            total_sq += float(np.square(index[valid]).sum())
+            candidates = valid & (common_wrong >= min_common_wrong)
+            if len(best) == top:
+                candidates &= index > best["index"].min()
+            r, c = np.nonzero(candidates)
+            if not len(r):
+                continue
+            found = np.empty(len(r), dtype=best.dtype)
+            found["index"], found["a"], found["b"] = index[r, c], r + i0, c + j0
+            found["common_wrong"], found["differ"] = common_wrong[r, c], differ[r, c]
+            best = np.concatenate([best, found])
+            best = best[np.argsort(-best["index"], kind="stable")[:top]]
+    mean = total / pairs if pairs else 0.0
+    std = float(np.sqrt(max(total_sq / pairs - mean * mean, 0.0))) if pairs else 0.0
+    return {
+        "pairs": [{"a": int(p["a"]), "b": int(p["b"]), "common_wrong": int(p["common_wrong"]),
+                   "differ": int(p["differ"]), "index": round(float(p["index"]), 3),
+                   "z": round((float(p["index"]) - mean) / std, 2) if std else None} for p in best],
+        "cohort": {"sheets": n, "pairs": pairs, "index_mean": round(mean, 4), "index_std": round(std, 4)},
+    }
+
+
+def set_report(store, exam, set_name, key_bits, scheme=None, top=TOP_PAIRS):
+    """scan() of one set of the columnar results store, pairs named by roll number."""
+    data = store.read(exam, set_name, ("bits",))
+    start = time.perf_counter()
+    report = scan(data["bits"], key_bits, scheme, top)
+    rolls = [r.decode("utf-8") if isinstance(r, bytes) else str(r) for r in data["roll"]]
+    for pair in report["pairs"]:
+        pair["roll_a"], pair["roll_b"] = rolls[pair.pop("a")], rolls[pair.pop("b")]
+        pair["flagged"] = pair["z"] is not None and pair["z"] >= FLAG_Z
+    report["cohort"]["seconds"] = round(time.perf_counter() - start, 3)
+    return report
+
+
+def synthetic_cohort(n, copiers=5, seed=0):
+    """Random sheets answering each question right with a per-student ability, plus
+    `copiers` pairs where the second sheet copies 90% of the first; returns (bits, key, pairs)."""
+    rng = np.random.default_rng(seed)
+    key = (1 << rng.integers(0, 4, NUM_QUESTIONS)).astype(np.uint8)
+    ability = rng.uniform(0.3, 0.9, (n, 1))
+    right = rng.random((n, NUM_QUESTIONS)) < ability
+    guesses = (1 << rng.integers(0, 4, (n, NUM_QUESTIONS))).astype(np.uint8)
+    bits = np.where(right, key, guesses)
+    bits[rng.random((n, NUM_QUESTIONS)) < 0.05] = 0
+    pairs = []
+    for k in range(copiers):
+        a, b = 2 * k, 2 * k + 1 + n // 2
+        copied = rng.random(NUM_QUESTIONS) < 0.9
+        bits[b, copied] = bits[a, copied]
+        pairs.append((a, b))
+    return bits.astype(np.uint8), key, pairs
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Flag pairs of students with unusually similar answers")
+    parser.add_argument("csv_filename", nargs="?", default="scores.csv", help="exam (results CSV) to scan")
+    parser.add_argument("--set", dest="set_name", help="only this set")
+    parser.add_argument("--top", type=int, default=TOP_PAIRS)
+    parser.add_argument("--synthetic", type=int, help="scan a random cohort of this many sheets instead")
+    args = parser.parse_args(argv)
+    if args.synthetic:
+        bits, key, planted = synthetic_cohort(args.synthetic)
+        start = time.perf_counter()
+        report = scan(bits, key, top=args.top)
+        seconds = time.perf_counter() - start
+        found = {(p["a"], p["b"]) for p in report["pairs"]}
+        print(f"{args.synthetic} sheets, {report['cohort']['pairs']} pairs in {seconds:.1f}s; "
+              f"planted pairs in the top {args.top}: {len(found & set(planted))}/{len(planted)}")
+        return 0
+    from columnar import ColumnarStore
+    from answer_keys import load_compiled_key
+    from scoring_engine import load_scheme
+    upload_dir = os.getenv("UPLOAD_DIR", "uploaded_omr")
+    key_dir = os.getenv("ANSWERKEY_DIR", "answer_keys")
+    store = ColumnarStore(os.path.join(upload_dir, "columnar"))
+    for set_name in store.sets(args.csv_filename):
+        if args.set_name and set_name != args.set_name.upper():
+            continue
+        key_file = os.path.join(key_dir, f"answers_{set_name}.json")
+        if not os.path.exists(key_file):
+            print(f"Set {set_name}: no answer key, skipped")
+            continue
+        report = set_report(store, args.csv_filename, set_name, load_compiled_key(key_file),
+                            load_scheme(key_dir, set_name), args.top)
+        print(f"Set {set_name}: {report['cohort']}")
+        for pair in report["pairs"]:
+            print(f"  {pair['roll_a']} ~ {pair['roll_b']}: {pair['common_wrong']} identical wrong, "
+                  f"{pair['differ']} different, index {pair['index']}, z {pair['z']}"
+                  + ("  FLAGGED" if pair["flagged"] else ""))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -7,15 +7,21 @@ PORT=${PORT:-8000}
 echo "Starting FastAPI backend on port $PORT..."
 uvicorn main:app --host 0.0.0.0 --port $PORT --workers 1 &
 
-# Wait for backend to start
-echo "Waiting for backend to start..."
-sleep 15
+# Wait for backend to become ready (scoring workers warm), up to 60s
+echo "Waiting for backend to become ready..."
+READY=0
+for i in $(seq 1 300); do
+    if curl -sf http://localhost:$PORT/ready > /dev/null 2>&1; then
+        READY=1
+        break
+    fi
+    sleep 0.2
+done
 
-# Check if backend is running
-if curl -f http://localhost:$PORT/health > /dev/null 2>&1; then
-    echo "Backend is running successfully on port $PORT!"
+if [ "$READY" = "1" ]; then
+    echo "Backend is ready on port $PORT!"
 else
-    echo "Backend failed to start, but continuing..."
+    echo "Backend failed to become ready, but continuing..."
 fi
 
 # Start Streamlit frontend on a different port
@@ -0,0 +1,103 @@
+import os
+import json
+import time
+import hashlib
+import threading
+
+from responses import SheetResponses
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def submission_params(csv_filename=None, threshold_mode=None, profile=None):
+    """The request options a stored result depends on besides roll number, set and image."""
+    return {"csv_file": csv_filename or "scores.csv", "threshold_mode": threshold_mode, "profile": profile}
+
+
+def default_idempotency_key(roll_no, set_name, image_sha256, params=None):
+    """roll number + set + image hash: a retried upload of the same scan maps to the same key.
+    Non-default `params` add a short hash of them, so the same scan scored into another
+    results file or with another threshold mode / profile is a separate submission."""
+    key = f"{roll_no.strip()}:{set_name}:{image_sha256[:32]}"
+    if params is not None and params != submission_params():
+        key += ":" + hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()[:12]
+    return key
+
+
+def pack_marked(marked):
+    """bool[100, 4] -> 100-char hex string (one nibble per question) for compact storage."""
+    return SheetResponses.from_marked(marked).to_hex()
+
+
+def unpack_marked(text):
+    return SheetResponses.from_hex(text).marked
+
+
+class SubmissionStore:
+    """Append-only JSONL log of scored submissions with in-memory hash indexes.
+
+    Looking up an idempotency key or the latest version for (roll number, set) is a
+    dict lookup; lines appended by other processes are picked up incrementally.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._by_key = {}
+        self._latest = {}
+        self._offset = 0
+        self._lock = threading.Lock()
+        self._refresh()
+
+    def _refresh(self):
+        try:
+            size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            return
+        if size <= self._offset:
+            return
+        with open(self.path, "rb") as f:
+            f.seek(self._offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # partial line still being written
+                self._offset += len(line)
+                if line.strip():
+                    self._index(json.loads(line))
+
+    def _index(self, record):
+        self._by_key[record["idempotency_key"]] = record
+        ident = (record["roll_no"], record["set"])
+        current = self._latest.get(ident)
+        if current is None or record["version"] >= current["version"]:
+            self._latest[ident] = record
+
+    def get(self, idempotency_key):
+        with self._lock:
+            self._refresh()
+            return self._by_key.get(idempotency_key)
+
+    def latest(self, roll_no, set_name):
+        with self._lock:
+            self._refresh()
+            return self._latest.get((roll_no, set_name))
+
+    def add(self, record):
+        """Store a newly scored submission; assigns the next version for its roll number + set.
+        Callers writing from several processes hold a shared file_lock around this."""
+        with self._lock:
+            self._refresh()
+            existing = self._by_key.get(record["idempotency_key"])
+            if existing is not None:
+                return existing
+            previous = self._latest.get((record["roll_no"], record["set"]))
+            record = dict(record, version=previous["version"] + 1 if previous else 1, created_at=time.time())
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record) + "\n")
+            self._refresh()
+            return record
@@ -0,0 +1,60 @@
+import numpy as np
+
+from analytics import CohortAnalytics, csv_aggregates
+from answer_keys import compile_key
+from results import append_row
+from scoring_engine import SECTION_NAMES, max_marks, score_responses
+
+KEY = compile_key({"Python": {"Q1": "a", "Q2": "b"}, "EDA": {"Q21": "c"}})
+
+
+def test_first_use_backfills_existing_csv_rows(tmp_path):
+    exam = tmp_path / "exam.csv"
+    for roll, total in (("1", 2), ("2", 1), ("3", 3)):
+        sections = [total if s == "Python" else 0 for s in SECTION_NAMES]
+        append_row(str(exam), [roll, roll] + sections + [total, 3, round(total / 3 * 100, 2), "A"])
+    calls = []
+
+    def backfill(name):
+        calls.append(name)
+        return csv_aggregates(str(tmp_path / name), section_maxima=lambda set_name: maxima)
+
+    maxima = [max_marks(KEY)[s] for s in SECTION_NAMES]
+    analytics = CohortAnalytics(str(tmp_path / "analytics"), backfill=backfill)
+    report = analytics.report("exam.csv")["A"]
+    assert report["students"] == 3 and report["mean"] == 2 and report["students_with_responses"] == 0
+    assert report["sections"]["Python"]["mean"] == 2 and "questions" not in report
+    assert report["sections"]["Python"]["max"] == 2 and report["sections"]["EDA"]["max"] == 1
+    # without the set's key the section maxima are unknown, not 0
+    unknown = csv_aggregates(str(exam))["A"].summary()
+    assert unknown["sections"]["Python"]["max"] is None and unknown["max_total"] == 3
+
+    # new sheets add to the backfilled rows; question stats cover the sheets with responses
+    sheet = np.zeros((100, 4), dtype=bool)
+    sheet[0, 0] = True
+    analytics.record("exam.csv", "A", sheet, score_responses(sheet, KEY), KEY)
+    report = analytics.report("exam.csv")["A"]
+    assert report["students"] == 4 and report["students_with_responses"] == 1
+    assert report["questions"][0]["difficulty"] == 1 and report["questions"][0]["options"]["a"] == 1
+
+    # the snapshot now exists, so another process doesn't backfill again
+    analytics.flush()
+    again = CohortAnalytics(str(tmp_path / "analytics"), backfill=backfill)
+    assert again.overall("exam.csv")["students"] == 4 and calls == ["exam.csv"]
+
+
+def test_snapshots_are_saved_in_batches_and_merged_across_processes(tmp_path):
+    sheet = np.zeros((100, 4), dtype=bool)
+    sheet[0, 0] = True
+    result = score_responses(sheet, KEY)
+    first = CohortAnalytics(str(tmp_path), save_every=3, save_seconds=3600)
+    second = CohortAnalytics(str(tmp_path), save_every=3, save_seconds=3600)
+    first.record("exam.csv", "A", sheet, result, KEY)  # the first snapshot is written at once
+    first.record("exam.csv", "A", sheet, result, KEY)
+    assert second.overall("exam.csv")["students"] == 1 and first.overall("exam.csv")["students"] == 2
+    # another process saves meanwhile: the unsaved sheet is applied on top of its snapshot
+    second.record("exam.csv", "B", sheet, result, KEY)
+    second.flush()
+    assert first.overall("exam.csv")["students"] == 3
+    first.flush()
+    assert CohortAnalytics(str(tmp_path)).report("exam.csv")["A"]["students"] == 2
@@ -0,0 +1,56 @@
+import numpy as np
+
+import columnar
+from analytics import SetAggregate
+from answer_keys import compile_key
+from columnar import ColumnarStore
+from responses import pack_bits
+from scoring_engine import score_responses
+
+KEY = compile_key({"Python": {"Q1": "a", "Q2": "b"}, "EDA": {"Q21": "c"}})
+
+
+def fill(store, rolls, seed=0):
+    rng = np.random.default_rng(seed)
+    marked = rng.random((len(rolls), 100, 4)) < 0.3
+    for roll, sheet in zip(rolls, marked):
+        store.append("exam.csv", "a", roll, sheet, score_responses(sheet, KEY))
+    return pack_bits(marked)
+
+
+def test_reads_latest_row_per_roll_before_and_after_compaction(tmp_path):
+    store = ColumnarStore(str(tmp_path))
+    first = fill(store, ["1", "2", "3"])
+    rescan = fill(store, ["2"], seed=1)
+    expected = {"1": first[0], "2": rescan[0], "3": first[2]}
+    before = store.read("exam.csv", "A", ("bits",))
+    assert dict(zip(before["roll"].astype(str), before["bits"])).keys() == expected.keys()
+    assert store.compact("exam.csv", "A") == 3
+    after = store.read("exam.csv", "A", ("bits", "total"))
+    assert store.stats("exam.csv", "A") == {"segments": [3], "delta_rows": 0}
+    assert isinstance(after["bits"], np.memmap)  # one segment, nothing dropped: no copy
+    for roll, bits in zip(after["roll"].astype(str), after["bits"]):
+        assert (bits == expected[roll]).all()
+
+
+def test_compaction_is_size_tiered(tmp_path, monkeypatch):
+    store = ColumnarStore(str(tmp_path))
+    fill(store, [str(i) for i in range(40)])
+    store.compact("exam.csv", "A")
+    fill(store, ["x", "y"], seed=2)
+    store.compact("exam.csv", "A")
+    # 40 rows are more than TIER_FACTOR x 2: the big segment is left alone
+    assert store.stats("exam.csv", "A")["segments"] == [40, 2]
+    monkeypatch.setattr(columnar, "TIER_FACTOR", 100)
+    fill(store, ["z"], seed=3)
+    store.compact("exam.csv", "A")
+    assert store.stats("exam.csv", "A")["segments"] == [43]
+
+
+def test_aggregate_rescores_from_columns(tmp_path):
+    store = ColumnarStore(str(tmp_path))
+    bits = fill(store, [str(i) for i in range(25)])
+    agg = store.aggregate("exam.csv", "A", KEY)
+    direct = SetAggregate()
+    direct.update(bits, score_responses(bits, KEY), KEY)
+    assert agg.summary() == direct.summary()
@@ -0,0 +1,87 @@
+import os
+import zlib
+
+import pytest
+
+from documents import PDFReader, iter_pages, page_count, parse_roster, write_pdf
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "..", "data")
+
+
+def jpeg(i):
+    with open(os.path.join(DATA_DIR, "Set A", f"Img{i}.jpeg"), "rb") as f:
+        return f.read()
+
+
+def test_pdf_pages_are_copied_out_unchanged(tmp_path):
+    pages = [jpeg(1), jpeg(2), jpeg(3)]
+    write_pdf(tmp_path / "stack.pdf", pages)
+    assert page_count(tmp_path / "stack.pdf") == 3
+    assert [(n, ext, data, err) for n, ext, data, err in iter_pages(tmp_path / "stack.pdf")] == \
+        [(1, ".jpg", pages[0], None), (2, ".jpg", pages[1], None), (3, ".jpg", pages[2], None)]
+
+
+def test_pdf_with_object_streams_and_xref_stream(tmp_path):
+    # PDF 1.5 layout: page tree objects packed into a compressed object stream, no trailer
+    image = jpeg(4)
+    packed = [b"<< /Type /Pages /Kids [3 0 R] /Count 1 /Resources << /XObject << /Im0 4 0 R >> >> >>",
+              b"<< /Type /Page /Parent 2 0 R >>"]
+    header, body = b"", b""
+    for num, obj in zip((2, 3), packed):
+        header += b"%d %d " % (num, len(body))
+        body += obj + b"\n"
+    objstm = zlib.compress(header + body)
+    out = b"%PDF-1.5\n"
+    out += b"1 0 obj\n<< /Type /Catalog /Pages 2 0 R >>\nendobj\n"
+    out += b"4 0 obj\n<< /Subtype /Image /Width 1 /Height 1 /Filter [/DCTDecode] /Length 5 0 R >>\nstream\r\n"
+    out += image + b"\nendstream\nendobj\n5 0 obj\n%d\nendobj\n" % len(image)
+    out += b"6 0 obj\n<< /Type /ObjStm /N 2 /First %d /Filter /FlateDecode /Length %d >>\nstream\n" % (
+        len(header), len(objstm)) + objstm + b"\nendstream\nendobj\n"
+    out += b"7 0 obj\n<< /Type /XRef /Root 1 0 R /Size 8 /Length 0 >>\nstream\n\nendstream\nendobj\n%%EOF\n"
+    (tmp_path / "packed.pdf").write_bytes(out)
+    with PDFReader(tmp_path / "packed.pdf") as pdf:
+        pages = list(pdf.pages())
+        assert len(pages) == 1 and pdf.page_jpeg(pages[0]) == image
+
+
+def test_non_jpeg_page_is_reported_not_fatal(tmp_path):
+    write_pdf(tmp_path / "stack.pdf", [jpeg(1)])
+    data = (tmp_path / "stack.pdf").read_bytes().replace(b"/DCTDecode", b"/CCITTFaxDecode")
+    (tmp_path / "fax.pdf").write_bytes(data)
+    [(number, ext, image, error)] = iter_pages(tmp_path / "fax.pdf")
+    assert image is None and "CCITTFaxDecode" in error
+
+
+@pytest.mark.parametrize("damage", [
+    (b"/Root 1 0 R", b"/Size 9"),               # trailer without a catalog
+    (b"/Pages 2 0 R", b"/Pages 9 0 R"),         # catalog points at a missing object
+    (b"/Kids [", b"/Kids 3 0 R ["),             # Kids is not an array
+    (b"trailer\n<<", b"trailer\n["),            # trailer is not a dictionary
+])
+def test_malformed_pdf_raises_value_error(tmp_path, damage):
+    write_pdf(tmp_path / "stack.pdf", [jpeg(1)])
+    data = (tmp_path / "stack.pdf").read_bytes().replace(*damage)
+    (tmp_path / "bad.pdf").write_bytes(data)
+    with pytest.raises(ValueError, match="PDF"):
+        list(iter_pages(tmp_path / "bad.pdf"))
+    with pytest.raises(ValueError):
+        page_count(tmp_path / "bad.pdf")
+
+
+def test_bad_image_stream_is_reported_per_page(tmp_path):
+    write_pdf(tmp_path / "stack.pdf", [jpeg(1), jpeg(2)])
+    data = (tmp_path / "stack.pdf").read_bytes().replace(b"/Length %d" % len(jpeg(1)), b"/Length -1", 1)
+    (tmp_path / "bad.pdf").write_bytes(data)
+    pages = list(iter_pages(tmp_path / "bad.pdf"))
+    assert "stream length" in pages[0][3] and pages[1][2] == jpeg(2)
+
+
+def test_parse_roster():
+    assert parse_roster(b"\xef\xbb\xbfName,Roll No\nAsha,1\n\nBen,2\n") == [(None, "Asha", "1"), (None, "Ben", "2")]
+    assert parse_roster("student,roll,page\nAsha,1,3\n") == [(3, "Asha", "1")]
+    with pytest.raises(ValueError):
+        parse_roster("name,page\nAsha,1\n")
+    with pytest.raises(ValueError, match="too few columns"):
+        parse_roster("name,roll\nAlice\n")
+    with pytest.raises(ValueError):
+        parse_roster("name,roll,page\nAsha,1,1\nBen,2,1\n")
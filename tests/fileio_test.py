@@ -0,0 +1,38 @@
+import os
+import asyncio
+import threading
+
+import pytest
+
+from fileio import LoopLagMonitor, atomic_create, atomic_write, run_io
+
+
+def test_atomic_write_replaces_only_on_success(tmp_path):
+    path = tmp_path / "key.json"
+    path.write_text("old")
+    with pytest.raises(RuntimeError):
+        with atomic_write(str(path)) as f:
+            f.write("half")
+            raise RuntimeError("disk full")
+    assert path.read_text() == "old" and os.listdir(tmp_path) == ["key.json"]
+    with atomic_write(str(path)) as f:
+        f.write("new")
+    assert path.read_text() == "new"
+    with pytest.raises(FileExistsError):
+        with atomic_create(str(path)) as f:
+            f.write("other")
+    assert path.read_text() == "new" and os.listdir(tmp_path) == ["key.json"]
+
+
+def test_run_io_keeps_the_loop_responsive():
+    async def scenario():
+        monitor = LoopLagMonitor(interval=0.01)
+        monitor.start()
+        await asyncio.sleep(0.02)
+        worker = await run_io(lambda: (threading.Event().wait(0.2), threading.current_thread().name)[1])
+        monitor.stop()
+        return worker, monitor.snapshot()
+
+    worker, lag = asyncio.run(scenario())
+    assert worker.startswith("omr-io")
+    assert lag["samples"] >= 5 and lag["max_ms"] < 150
@@ -0,0 +1,53 @@
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+import omr_scoring
+from id_fields import decode_field, parse_id_layout
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "..", "data")
+
+
+def id_sheet(out, roll="240517", set_code="B", band=340, double=None):
+    """A real answer sheet with a printed header band holding roll number and set code bubbles."""
+    img = cv2.imread(os.path.join(DATA_DIR, "Set A", "Img2.jpeg"), cv2.IMREAD_GRAYSCALE)
+    page = np.full((img.shape[0] + band, img.shape[1]), 255, np.uint8)
+    page[band:] = img
+    for pos, digit in enumerate(roll):
+        for d in range(10):
+            filled = str(d) == digit or (double is not None and pos == double[0] and d == double[1])
+            cv2.circle(page, (60 + pos * 34, 25 + d * 30), 11, 0, -1 if filled else 2)
+    for i, sym in enumerate("ABCD"):
+        cv2.circle(page, (700 + i * 40, 60), 12, 0, -1 if sym == set_code else 2)
+    cv2.imwrite(str(out), page)
+    height, width = page.shape
+    return parse_id_layout({
+        "roll_no": {"region": [30 / width, 5 / height, 260 / width, 320 / height], "positions": len(roll)},
+        "set_code": {"region": [670 / width, 35 / height, 880 / width, 85 / height], "orientation": "rows"}})
+
+
+def test_reads_roll_number_and_set_code_without_disturbing_answers(tmp_path):
+    layout = id_sheet(tmp_path / "sheet.png")
+    marked, info, _ = omr_scoring.read_sheet(str(tmp_path / "sheet.png"), "local", layout)
+    assert info["fields"]["roll_no"] == {"value": "240517", "complete": True, "unread_positions": []}
+    assert info["fields"]["set_code"]["value"] == "B"
+    plain = omr_scoring.read_sheet(os.path.join(DATA_DIR, "Set A", "Img2.jpeg"), "local")[0]
+    assert (marked == plain).all()
+
+
+def test_double_marked_digit_is_unread(tmp_path):
+    layout = id_sheet(tmp_path / "sheet.png", double=(2, 7))
+    fields = omr_scoring.read_sheet(str(tmp_path / "sheet.png"), "local", layout)[1]["fields"]
+    assert fields["roll_no"]["value"] == "24?517" and fields["roll_no"]["unread_positions"] == [3]
+
+
+def test_decode_field_and_layout_validation():
+    field = {"positions": 2, "symbols": "ABCD"}
+    mean_val = np.array([[200, 60, 205, 198], [201, 199, 202, 197]], dtype=np.float32)
+    assert decode_field(mean_val, field) == {"value": "B?", "complete": False, "unread_positions": [2]}
+    with pytest.raises(ValueError):
+        parse_id_layout({"roll_no": {"region": [0.5, 0.1, 0.2, 0.3]}})
+    with pytest.raises(ValueError):
+        parse_id_layout({"student": {"region": [0, 0, 1, 1]}})
@@ -0,0 +1,84 @@
+import os
+import glob
+import threading
+
+import pytest
+
+from job_store import open_job_store, SQLiteJobStore, MemoryJobStore, MAX_ATTEMPTS
+from blob_store import LocalBlobStore, MemoryBlobStore
+import omr_worker
+from omr_worker import run_worker
+from submissions import unpack_marked
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "..", "data")
+
+
+@pytest.fixture(params=["sqlite", "memory"])
+def jobs(request, tmp_path):
+    if request.param == "sqlite":
+        return SQLiteJobStore(str(tmp_path / "jobs.db"))
+    return MemoryJobStore()
+
+
+def test_submit_is_idempotent_and_leases_are_exclusive(jobs):
+    first = jobs.submit("detect", {"image_sha256": "ab"}, "detect:ab")
+    assert jobs.submit("detect", {"image_sha256": "ab"}, "detect:ab")["created_at"] == first["created_at"]
+    job = jobs.lease("w1", ("detect",))
+    assert job["id"] == "detect:ab" and job["attempts"] == 1
+    assert jobs.lease("w2", ("detect",)) is None
+    assert not jobs.complete("detect:ab", "w2", {"marked": "0"})
+    assert jobs.complete("detect:ab", "w1", {"marked": "0"})
+    assert jobs.get("detect:ab")["state"] == "done" and jobs.get("detect:ab")["result"] == {"marked": "0"}
+
+
+def test_expired_lease_is_taken_over_then_fails(jobs):
+    jobs.submit("detect", {}, "j")
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        job = jobs.lease(f"w{attempt}", ("detect",), lease_seconds=-1)
+        assert job["attempts"] == attempt
+    assert jobs.lease("w9", ("detect",)) is None
+    assert jobs.get("j")["state"] == "failed"
+    # resubmitting a failed job queues it again
+    assert jobs.submit("detect", {}, "j")["state"] == "queued"
+
+
+def test_sqlite_store_is_shared_between_connections(tmp_path):
+    url = "sqlite://" + str(tmp_path / "jobs.db")
+    a, b = open_job_store(url), open_job_store(url)
+    a.submit("detect", {"n": 1}, "x")
+    leased = []
+    threads = [threading.Thread(target=lambda s=s: leased.append(s.lease(str(id(s)), ("detect",))))
+               for s in (a, b, a, b)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sum(job is not None for job in leased) == 1
+    b.heartbeat("w", ("detect",))
+    assert [w["id"] for w in a.workers()] == ["w"]
+
+
+def test_blob_stores_are_content_addressed(tmp_path):
+    src = tmp_path / "sheet.jpg"
+    src.write_bytes(b"scan")
+    for blobs in (LocalBlobStore(str(tmp_path / "blobs")), MemoryBlobStore()):
+        sha = blobs.put_file(str(src))
+        assert blobs.put(b"scan") == sha and blobs.exists(sha)
+        with open(blobs.local_path(sha), "rb") as f:
+            assert f.read() == b"scan"
+
+
+def test_worker_scores_leased_job(monkeypatch):
+    monkeypatch.setattr(omr_worker, "HEARTBEAT_SECONDS", 0)  # beat before every lease
+    jobs, blobs = MemoryJobStore(), MemoryBlobStore()
+    image = sorted(glob.glob(os.path.join(DATA_DIR, "Set A", "Img1.jpeg")))[0]
+    sha = blobs.put_file(image)
+    jobs.submit("detect", {"image_sha256": sha}, "detect:" + sha)
+    jobs.submit("detect", {"image_sha256": "missing"}, "detect:missing")
+    assert run_worker(jobs, blobs, "w", max_jobs=2) == 2
+    assert unpack_marked(jobs.get("detect:" + sha)["result"]["marked"]).shape == (100, 4)
+    # an unknown blob is retried elsewhere rather than failed outright
+    assert jobs.get("detect:missing")["state"] == "queued"
+    # the heartbeat keeps describing the worker, not the last sheet it read
+    [worker] = jobs.workers()
+    assert set(worker["info"]) == {"pid", "warm_seconds", "jobs_done"} and worker["info"]["jobs_done"] == 1
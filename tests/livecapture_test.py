@@ -0,0 +1,87 @@
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+from image_io import ImageTooLarge
+from livecapture import CaptureSession
+from quality import decode_frame, frame_quality
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "..", "data")
+
+
+def _frame(img, blur=0, angle=0, side=1000):
+    """A phone frame made from a scan: downscaled, optionally out of focus or tilted."""
+    scale = side / max(img.shape[:2])
+    img = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    if blur:
+        img = cv2.GaussianBlur(img, (0, 0), blur)
+    if angle:
+        h, w = img.shape[:2]
+        turn = cv2.getRotationMatrix2D((w / 2, h / 2), angle, 1.0)
+        img = cv2.warpAffine(img, turn, (w, h), borderValue=(255, 255, 255))
+    return cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 85])[1].tobytes()
+
+
+def test_recorded_sequence_scores_the_steady_sharp_frame():
+    img = cv2.imread(os.path.join(DATA_DIR, "Set A", "Img1.jpeg"))
+    empty = cv2.imencode(".jpg", np.full((800, 600, 3), 220, np.uint8))[1].tobytes()
+    frames = [empty, _frame(img, blur=3), _frame(img, angle=6), _frame(img, side=1100), _frame(img),
+              _frame(img, side=900)]
+    session = CaptureSession(stable=3)
+    events = [session.add(data, frame_quality(decode_frame(data))) for data in frames]
+    codes = [[r["code"] for r in e["reasons"]] for e in events]
+    assert codes[0] == ["blurry", "no_grid"] and "blurry" in codes[1] and codes[2] == ["skewed"]
+    assert [e["ok"] for e in events[3:]] == [True, True, True] and session.ready()
+    seq, data, quality = session.take()
+    best = max(events, key=lambda e: e["score"])
+    assert seq == best["seq"] and data == frames[seq - 1] and quality["score"] == best["score"]
+    # scored once: waits for the next sheet
+    assert session.take(force=True) is None and not session.ready()
+    session.rearm()
+    assert session.take(force=True) is None
+    assert session.stats()["rejected"]["skewed"] == 1
+
+
+def test_live_capture_websocket(tmp_path, monkeypatch):
+    monkeypatch.setenv("UPLOAD_DIR", str(tmp_path / "uploads"))
+    monkeypatch.setenv("ANSWERKEY_DIR", str(tmp_path / "keys"))
+    monkeypatch.setenv("OMR_SCORING_WORKERS", "1")
+    from fastapi.testclient import TestClient
+    import main
+
+    img = cv2.imread(os.path.join(DATA_DIR, "Set A", "Img1.jpeg"))
+    with TestClient(main.app) as client:
+        with open(os.path.join(DATA_DIR, "Key (Set A and B).xlsx"), "rb") as f:
+            assert client.post("/import-answerkeys", files={"file": ("key.xlsx", f.read())}).status_code == 200
+        # a set without a key is refused before any frame is sent
+        with client.websocket_connect("/live-capture?omr_set=Q") as ws:
+            assert ws.receive_json()["type"] == "error"
+            assert ws.receive()["type"] == "websocket.close"
+
+        with client.websocket_connect("/live-capture?omr_set=A") as ws:
+            ws.send_bytes(_frame(img, blur=3))
+            rejected = ws.receive_json()
+            assert rejected["type"] == "frame" and not rejected["ok"]
+            for _ in range(3):
+                ws.send_bytes(_frame(img))
+                assert ws.receive_json()["ok"]
+            event = ws.receive_json()
+            assert event["type"] == "result" and event["result"]["score"] > 0 and event["rejected"]["blurry"] == 1
+            ws.send_text('{"action": "capture"}')
+            assert ws.receive_json()["type"] == "error"  # scored once until "next"
+    # a preview records nothing and leaves no frame behind
+    stage_dir = tmp_path / "uploads" / "unidentified"
+    assert not stage_dir.exists() or not os.listdir(stage_dir)
+    assert not os.path.exists(tmp_path / "uploads" / "scores.csv")
+
+
+def test_decode_frame_checks_the_header_first():
+    # ~40 KB of PNG declaring 50 MP: rejected before anything is decoded
+    ok, png = cv2.imencode(".png", np.zeros((5000, 10000), np.uint8))
+    with pytest.raises(ImageTooLarge):
+        decode_frame(png.tobytes())
+    ok, jpeg = cv2.imencode(".jpg", np.full((3000, 4000), 200, np.uint8))
+    assert max(decode_frame(jpeg.tobytes()).shape) <= 480
+    assert decode_frame(b"not an image") is None
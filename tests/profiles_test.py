@@ -0,0 +1,43 @@
+import os
+
+import cv2
+import pytest
+
+import omr_scoring
+from profiles import get_profile, load_set_profile, save_set_profile
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "..", "data")
+SHEET = os.path.join(DATA_DIR, "Set A", "Img1.jpeg")
+
+
+def test_profiles_agree_on_a_clean_scan():
+    readings = {name: omr_scoring.read_sheet(SHEET, profile=name) for name in ("fast", "balanced", "accurate")}
+    assert (readings["fast"][0] == readings["accurate"][0]).all()
+    assert (readings["balanced"][0] == readings["accurate"][0]).all()
+    assert readings["accurate"][1]["profile"] == "accurate"
+    assert readings["accurate"][2]["template_matched"] == 400
+
+
+def test_accurate_profile_survives_rotation(tmp_path):
+    # contour order scrambles the rows of a tilted photo; the template fit does not
+    upright = omr_scoring.read_sheet(SHEET, profile="accurate")[0]
+    img = cv2.imread(SHEET)
+    height, width = img.shape[:2]
+    turn = cv2.getRotationMatrix2D((width / 2, height / 2), 8, 1.0)
+    cv2.imwrite(str(tmp_path / "tilted.png"), cv2.warpAffine(img, turn, (width, height), borderValue=(255, 255, 255)))
+    accurate = omr_scoring.read_sheet(str(tmp_path / "tilted.png"), profile="accurate")[0]
+    balanced = omr_scoring.read_sheet(str(tmp_path / "tilted.png"), profile="balanced")[0]
+    assert (accurate == upright).all(axis=1).mean() >= 0.95
+    assert (balanced == upright).all(axis=1).mean() < 0.8
+
+
+def test_set_profile_storage(tmp_path):
+    assert load_set_profile(str(tmp_path), "a") is None
+    assert save_set_profile(str(tmp_path), "a", " Accurate ") == "accurate"
+    assert load_set_profile(str(tmp_path), "A") == "accurate"
+    with pytest.raises(ValueError):
+        get_profile("turbo")
+    for bad in ("{not json", '["accurate"]', '{"profile": 3}', '{"profile": "turbo"}'):
+        (tmp_path / "profile_B.json").write_text(bad)
+        with pytest.raises(ValueError, match="profile_B.json"):
+            load_set_profile(str(tmp_path), "b")
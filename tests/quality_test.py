@@ -0,0 +1,38 @@
+import os
+import pickle
+
+import cv2
+import numpy as np
+import pytest
+
+import omr_scoring
+from quality import SheetRejected, check_quality, gate
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "..", "data")
+
+
+def _codes(quality):
+    return {r["code"]: r["severity"] for r in quality["reasons"]}
+
+
+def test_gate_rejects_unreadable_images_before_detection(tmp_path):
+    gray = cv2.imread(os.path.join(DATA_DIR, "Set A", "Img1.jpeg"), cv2.IMREAD_GRAYSCALE)
+    good = check_quality(gray)
+    assert good["ok"] and good["score"] > 0 and not good["reasons"]
+
+    assert _codes(check_quality(cv2.GaussianBlur(gray, (0, 0), 4)))["blurry"] == "reject"
+    assert _codes(check_quality((gray * 0.25).astype(np.uint8)))["underexposed"] == "reject"
+    assert _codes(check_quality(np.full((1200, 900), 230, np.uint8)))["no_grid"] == "reject"
+    tilted = cv2.warpAffine(gray, cv2.getRotationMatrix2D((gray.shape[1] / 2, gray.shape[0] / 2), 5, 1.0),
+                            gray.shape[::-1], borderValue=255)
+    skewed = check_quality(tilted)
+    assert skewed["ok"] and _codes(skewed) == {"skewed": "flag"}
+
+    assert gate(tilted, "flag")["reasons"] and gate(gray, "off") is None
+    blank = str(tmp_path / "blank.png")
+    cv2.imwrite(blank, np.full((1200, 900), 230, np.uint8))
+    with pytest.raises(SheetRejected) as e:
+        omr_scoring.read_sheet(blank)
+    # crosses the scoring pool's process boundary intact
+    rejected = pickle.loads(pickle.dumps(e.value))
+    assert str(rejected) == str(e.value) and _codes(rejected.quality)["no_grid"] == "reject"
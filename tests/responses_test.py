@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+from answer_keys import compile_key
+from responses import ResponseCohort, SheetResponses, pack_bits
+from scoring_engine import score_responses, section_scores_dict
+
+KEY = compile_key({"Python": {"Q1": "a", "Q2": "b,c"}, "Statistics": {"Q100": "d"}})
+
+
+def test_sheet_round_trips_and_sections_are_views():
+    marked = np.zeros((100, 4), dtype=bool)
+    marked[0, 0] = marked[1, [1, 2]] = marked[99, 3] = True
+    sheet = SheetResponses.from_marked(marked)
+    assert sheet.to_hex() == "16" + "0" * 97 + "8"
+    assert SheetResponses.from_hex(sheet.to_hex()) == sheet
+    assert (sheet.marked == marked).all()
+    assert np.shares_memory(sheet.section("Statistics"), sheet.bits)
+    sectionwise = sheet.to_sectionwise()
+    assert sectionwise["Python"]["Q2"] == "b,c" and sectionwise["Python"]["Q3"] == ""
+    assert sectionwise["Statistics"]["Q100"] == sheet.answer(100) == "d"
+    with pytest.raises(ValueError):
+        SheetResponses.from_hex("g" * 100)
+
+
+def test_cohort_rows_are_views_and_score_like_bool_tensors():
+    rng = np.random.default_rng(0)
+    marked = rng.random((5, 100, 4)) < 0.3
+    cohort = ResponseCohort.from_hex(SheetResponses.from_marked(m).to_hex() for m in marked)
+    assert np.array_equal(cohort.bits, pack_bits(marked))
+    assert all(np.shares_memory(sheet.bits, cohort.bits) for sheet in cohort)
+    wrapped = ResponseCohort.from_bits(cohort.bits)
+    assert np.shares_memory(wrapped.bits, cohort.bits)
+    scheme = {"negative": 0.25, "multi_answer": "partial"}
+    packed, plain = score_responses(cohort, KEY, scheme), score_responses(marked, KEY, scheme)
+    assert all(np.array_equal(packed[k], plain[k]) for k in plain)
+    assert section_scores_dict(score_responses(cohort[2], KEY, scheme)) == section_scores_dict(plain, 2)
+
+
+def test_cohort_grows_in_place():
+    cohort = ResponseCohort(capacity=1)
+    for i in range(3):
+        cohort.append(np.full(100, i, dtype=np.uint8))
+    assert len(cohort) == 3 and cohort.bits[:, 0].tolist() == [0, 1, 2]
+    assert cohort[-1].bits[0] == 2
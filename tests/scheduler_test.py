@@ -0,0 +1,85 @@
+import asyncio
+
+import pytest
+
+from scheduler import BULK, INTERACTIVE, QueueFull, Scheduler, lane, lane_for
+
+
+def test_lanes_share_slots_by_weight_and_client_limit():
+    async def run():
+        scheduler = Scheduler(1, weights={INTERACTIVE: 4, BULK: 1}, queue_limits={INTERACTIVE: 2, BULK: 100})
+        order = []
+
+        async def sheet(name, lane_name, client=None):
+            with scheduler.admission(lane_name), lane(lane_name, client):
+                async with scheduler.slot():
+                    order.append(name)
+                    await asyncio.sleep(0.001)
+
+        bulk = [asyncio.create_task(sheet(f"b{i}", BULK)) for i in range(10)]
+        await asyncio.sleep(0)
+        interactive = [asyncio.create_task(sheet(f"i{i}", INTERACTIVE)) for i in range(2)]
+        await asyncio.sleep(0)
+        # 2 unfinished interactive requests: the next one is turned away
+        with pytest.raises(QueueFull) as e:
+            scheduler.admit(INTERACTIVE)
+        assert e.value.retry_after >= 1
+        with scheduler.admission(BULK):
+            pass
+        await asyncio.gather(*bulk, *interactive)
+        # the first bulk sheet already held the slot; the interactive ones go next, not after 9 more
+        assert order.index("i1") <= 3
+        snap = scheduler.snapshot()["lanes"]
+        assert snap[INTERACTIVE]["served"] == 2 and snap[INTERACTIVE]["rejected"] == 1
+        assert snap[BULK]["wait_ms"]["samples"] == 10 and snap[BULK]["waiting"] == 0
+
+        # one client may hold one of the two slots: another client's sheet overtakes its second
+        scheduler = Scheduler(2, client_limit=1)
+        order = []
+        tasks = [asyncio.create_task(sheet(name, BULK, client)) for name, client in
+                 (("a1", "a"), ("a2", "a"), ("b1", "b"))]
+        await asyncio.gather(*tasks)
+        assert order == ["a1", "b1", "a2"]
+
+        # a sheet whose request goes away while queued gives up its place
+        scheduler = Scheduler(1)
+        first = asyncio.create_task(sheet("x", BULK))
+        await asyncio.sleep(0)
+        waiting = asyncio.create_task(sheet("y", BULK))
+        await asyncio.sleep(0)
+        waiting.cancel()
+        await asyncio.gather(first, waiting, return_exceptions=True)
+        assert scheduler.running == 0 and not scheduler.lanes[BULK].waiters
+
+    asyncio.run(run())
+
+
+def test_concurrent_burst_is_admitted_up_to_the_limit():
+    async def run():
+        scheduler = Scheduler(1, queue_limits={INTERACTIVE: 3, BULK: 100})
+        admitted = asyncio.Event()
+
+        async def request():
+            # admitted requests hold their place until they finish, before any slot is taken
+            with scheduler.admission(INTERACTIVE):
+                await admitted.wait()
+                async with scheduler.slot():
+                    pass
+            return True
+
+        tasks = [asyncio.create_task(request()) for _ in range(8)]
+        await asyncio.sleep(0)
+        assert scheduler.running == 0 and scheduler.lanes[INTERACTIVE].in_flight == 3
+        admitted.set()
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        assert results.count(True) == 3 and sum(isinstance(r, QueueFull) for r in results) == 5
+        snap = scheduler.snapshot()["lanes"][INTERACTIVE]
+        assert snap["in_flight"] == 0 and snap["admitted"] == 3 and snap["rejected"] == 5
+
+    asyncio.run(run())
+
+
+def test_lane_for():
+    assert lane_for(1) == lane_for(4) == INTERACTIVE
+    assert lane_for(5) == lane_for(None) == lane_for(1, "bulk") == BULK
+    assert lane_for(1, "interactive") == INTERACTIVE
@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+from answer_keys import compile_key
+from scoring_engine import score_responses, section_scores_dict, max_marks, validate_scheme
+
+KEY = compile_key({"Python": {"Q1": "a", "Q2": "b", "Q3": "a,b,c,d"}, "EDA": {"Q21": "c"}})
+
+
+def sheet(**answers):
+    marked = np.zeros((100, 4), dtype=bool)
+    for q, letters in answers.items():
+        for letter in letters:
+            marked[int(q[1:]) - 1, "abcd".index(letter)] = True
+    return marked
+
+
+def test_default_scheme_counts_exact_matches():
+    result = score_responses(sheet(q1="a", q2="c", q3="abcd", q21="c"), KEY)
+    assert section_scores_dict(result) == {"Python": 2, "EDA": 1, "SQL": 0, "Power BI": 0, "Statistics": 0, "Total": 3}
+    assert max_marks(KEY)["Total"] == 4
+
+
+def test_negative_partial_weights_and_bonus():
+    scheme = {"negative": 0.5, "multi_answer": "partial", "section_weights": {"EDA": 2}, "bonus": [2]}
+    result = score_responses(sheet(q1="b", q3="ab", q21="c"), KEY, scheme)
+    scores = section_scores_dict(result)
+    assert scores["Python"] == -0.5 + 1 + 0.5
+    assert scores["EDA"] == 2
+    assert max_marks(KEY, scheme)["Total"] == 5
+
+
+def test_cohort_matches_single_sheets():
+    sheets = np.stack([sheet(q1="a"), sheet(q2="b", q21="d"), sheet()])
+    cohort = score_responses(sheets, KEY, {"negative": 1, "dropped": [21]})
+    for i in range(len(sheets)):
+        single = score_responses(sheets[i], KEY, {"negative": 1, "dropped": [21]})
+        assert section_scores_dict(cohort, i) == section_scores_dict(single)
+
+
+@pytest.mark.parametrize("scheme", [{"section_weights": [2]}, {"section_weights": 2}, {"section_weights": {"SQL": "x"}},
+                                    {"negative": "half"}, {"bonus": 3}, {"dropped": ["Qx"]}, ["negative"]])
+def test_malformed_schemes_raise_value_error(scheme):
+    with pytest.raises(ValueError):
+        validate_scheme(scheme)
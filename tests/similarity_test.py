@@ -0,0 +1,37 @@
+import numpy as np
+
+import similarity
+from omr_layout import NUM_QUESTIONS
+
+
+def _brute_force(bits, wrong):
+    pairs = {}
+    for a in range(len(bits)):
+        for b in range(a + 1, len(bits)):
+            same = bits[a] == bits[b]
+            pairs[a, b] = (int((same & wrong[a]).sum()), int((~same).sum()))
+    return pairs
+
+
+def test_blocked_scan_matches_pairwise_and_finds_copiers():
+    bits, key, planted = similarity.synthetic_cohort(150, copiers=3, seed=3)
+    report = similarity.scan(bits, key, top=8, block=32)
+    expected = _brute_force(bits, similarity.wrong_answers(bits, key))
+    assert report["cohort"]["pairs"] == len(expected) == 150 * 149 // 2
+    for pair in report["pairs"]:
+        assert (pair["common_wrong"], pair["differ"]) == expected[pair["a"], pair["b"]]
+    ranked = sorted((v[0] / max(v[1], 1) for v in expected.values() if v[0] >= similarity.MIN_COMMON_WRONG),
+                    reverse=True)
+    assert [p["index"] for p in report["pairs"]] == [round(r, 3) for r in ranked[:8]]
+    assert {(p["a"], p["b"]) for p in report["pairs"][:3]} == set(planted)
+    assert report["pairs"][0]["z"] > similarity.FLAG_Z > report["pairs"][3]["z"]
+
+
+def test_dropped_questions_neither_match_nor_differ():
+    key = np.full(NUM_QUESTIONS, 1, np.uint8)
+    bits = np.full((2, NUM_QUESTIONS), 2, np.uint8)   # both wrong everywhere
+    bits[1, :50] = 4                                  # ... with different marks on half
+    full = similarity.scan(bits, key)["pairs"][0]
+    assert (full["common_wrong"], full["differ"]) == (50, 50)
+    dropped = similarity.scan(bits, key, {"dropped": list(range(1, 11))})["pairs"][0]
+    assert (dropped["common_wrong"], dropped["differ"]) == (50, 40)
@@ -1,7 +1,10 @@
 import requests
+import json
 import time
+import os
 
 BASE = "http://127.0.0.1:8000"
+DATA_DIR = os.path.join(os.path.dirname(__file__), "..", "data")
 
 def test_health():
     r = requests.get(f"{BASE}/health", timeout=5)
@@ -9,12 +12,23 @@ def test_health():
     data = r.json()
     assert data.get("status") == "healthy"
 
+def test_ready():
+    r = requests.get(f"{BASE}/ready", timeout=5)
+    assert r.status_code == 200
+    data = r.json()
+    assert data["status"] == "ready" and data["warm"] is True
+
 def test_create_csv():
     fname = f"smoke_test_{int(time.time())}.csv"
     r = requests.post(f"{BASE}/create-csv", data={"filename": fname})
     assert r.status_code == 200
     data = r.json()
     assert "filename" in data
+    assert requests.post(f"{BASE}/create-csv", data={"filename": fname}).status_code == 400
+
+def test_event_loop_metrics():
+    data = requests.get(f"{BASE}/metrics/event-loop").json()
+    assert data["loop_lag"]["samples"] > 0 and data["io"]["threads"] > 0
 
 def test_create_answerkey():
     block = "Python\n1 - a\n2 - b\n"
@@ -23,3 +37,205 @@ def test_create_answerkey():
     data = r.json()
     assert "Saved sectionwise key" in data.get("message","") or "questions" in data.get("message","")
     assert "Saved sectionwise key" in data.get("message","") or "questions" in data.get("message","")
+
+def test_import_answerkeys_xlsx():
+    with open(os.path.join(DATA_DIR, "Key (Set A and B).xlsx"), "rb") as f:
+        r = requests.post(f"{BASE}/import-answerkeys", files={"file": ("Key (Set A and B).xlsx", f.read())})
+    assert r.status_code == 200
+    data = r.json()
+    assert data["imported"] == {"A": 100, "B": 100}
+    assert data["issues"] == {"A": [], "B": []}
+    r = requests.get(f"{BASE}/answer-key-sets")
+    assert {"A", "B"} <= set(r.json()["sets"])
+
+def test_marking_scheme_roundtrip():
+    scheme = {"negative": 0.25, "multi_answer": "partial", "section_weights": {"SQL": 2}, "dropped": [5]}
+    r = requests.post(f"{BASE}/marking-scheme/S", json=scheme)
+    assert r.status_code == 200
+    r = requests.get(f"{BASE}/marking-scheme/S")
+    assert r.json()["scheme"]["dropped"] == [5]
+    r = requests.post(f"{BASE}/marking-scheme/S", json={"multi_answer": "bogus"})
+    assert r.status_code == 400
+
+def test_analytics_empty_exam():
+    r = requests.get(f"{BASE}/analytics", params={"csv_filename": "no_such_exam.csv"})
+    assert r.status_code == 200
+    data = r.json()
+    assert data["overall"] == {"students": 0}
+    assert data["sets"] == {}
+
+def test_score_batch_and_results_paging():
+    with open(os.path.join(DATA_DIR, "Key (Set A and B).xlsx"), "rb") as f:
+        requests.post(f"{BASE}/import-answerkeys", files={"file": ("key.xlsx", f.read())})
+    fname = f"smoke_batch_{int(time.time() * 1000)}.csv"
+    files = []
+    for i in (1, 2):
+        with open(os.path.join(DATA_DIR, "Set A", f"Img{i}.jpeg"), "rb") as f:
+            files.append(("files", (f"Img{i}.jpeg", f.read(), "image/jpeg")))
+    data = {"student_names": ["Smoke One", "Smoke Two"], "roll_nos": ["901", "902"], "omr_set": "A", "csv_filename": fname}
+    r = requests.post(f"{BASE}/score-batch", files=files, data=data, timeout=60)
+    assert r.status_code == 200
+    results = r.json()["results"]
+    assert [x["ok"] for x in results] == [True, True]
+    r = requests.get(f"{BASE}/results", params={"csv_filename": fname, "page": 2, "page_size": 1})
+    page = r.json()
+    assert page["total_rows"] == 2
+    assert page["rows"][0][:2] == ["Smoke Two", "902"]
+    assert requests.get(f"{BASE}/results-version", params={"csv_filename": fname}).json()["version"] == page["version"]
+    running = requests.get(f"{BASE}/analytics", params={"csv_filename": fname}).json()
+    exact = requests.get(f"{BASE}/analytics", params={"csv_filename": fname, "exact": "true"}).json()
+    assert exact["exact"] is True and exact["overall"] == running["overall"]
+    assert exact["sets"]["A"]["questions"] == running["sets"]["A"]["questions"]
+    similar = requests.get(f"{BASE}/analytics/similarity", params={"csv_filename": fname}).json()
+    assert similar["sets"]["A"]["cohort"]["pairs"] == 1
+
+def test_evaluate_is_idempotent():
+    with open(os.path.join(DATA_DIR, "Key (Set A and B).xlsx"), "rb") as f:
+        requests.post(f"{BASE}/import-answerkeys", files={"file": ("key.xlsx", f.read())})
+    fname = f"smoke_idem_{int(time.time() * 1000)}.csv"
+    roll = str(int(time.time() * 1000))
+    with open(os.path.join(DATA_DIR, "Set B", "Img14.jpeg"), "rb") as f:
+        image = f.read()
+    form = {"student_name": "Idem Student", "roll_no": roll, "omr_set": "B"}
+    assert requests.post(f"{BASE}/upload-omr", files={"file": ("s.jpeg", image)}, data=form).status_code == 200
+    first = requests.post(f"{BASE}/evaluate", data=dict(form, csv_filename=fname), timeout=60).json()
+    again = requests.post(f"{BASE}/evaluate", data=dict(form, csv_filename=fname), timeout=60).json()
+    assert first["duplicate"] is False and again["duplicate"] is True
+    assert again["score"] == first["score"] and again["version"] == 1
+    page = requests.get(f"{BASE}/results", params={"csv_filename": fname}).json()
+    assert page["total_rows"] == 1
+    # the same scan into another results file is its own submission; a reused key is a conflict
+    other = requests.post(f"{BASE}/evaluate", data=dict(form, csv_filename="other_" + fname), timeout=60).json()
+    assert other["duplicate"] is False and other["idempotency_key"] != first["idempotency_key"]
+    reused = requests.post(f"{BASE}/evaluate", data=dict(form, csv_filename=fname, threshold_mode="adaptive",
+                                                          idempotency_key=first["idempotency_key"]), timeout=60)
+    assert reused.status_code == 409 and "threshold_mode" in reused.json()["detail"]
+
+def test_threshold_mode_reports_margin():
+    with open(os.path.join(DATA_DIR, "Key (Set A and B).xlsx"), "rb") as f:
+        requests.post(f"{BASE}/import-answerkeys", files={"file": ("key.xlsx", f.read())})
+    with open(os.path.join(DATA_DIR, "Set A", "Img13.jpeg"), "rb") as f:
+        files = [("files", ("Img13.jpeg", f.read(), "image/jpeg"))]
+    data = {"student_names": ["Thresh"], "roll_nos": [str(int(time.time() * 1000))], "omr_set": "A",
+            "csv_filename": "smoke_threshold.csv", "threshold_mode": "local"}
+    result = requests.post(f"{BASE}/score-batch", files=files, data=data, timeout=60).json()["results"][0]
+    assert result["detection"]["mode"] == "local" and result["detection"]["margin"] > 0.1
+    r = requests.post(f"{BASE}/score-batch", files=files, data=dict(data, roll_nos=[str(int(time.time() * 1000))]),
+                      timeout=60)
+    spans = [part.split(";")[0] for part in r.headers["Server-Timing"].split(", ")]
+    assert {"save", "detect", "score", "record", "total"} <= set(spans)
+    slow = requests.get(f"{BASE}/debug/slow").json()
+    assert slow["requests"] > 0 and isinstance(slow["entries"], list)
+    r = requests.post(f"{BASE}/score-batch", files=files, data=dict(data, threshold_mode="bogus"), timeout=60)
+    assert r.status_code == 400
+
+def test_debug_overlay_for_submission():
+    with open(os.path.join(DATA_DIR, "Key (Set A and B).xlsx"), "rb") as f:
+        requests.post(f"{BASE}/import-answerkeys", files={"file": ("key.xlsx", f.read())})
+    with open(os.path.join(DATA_DIR, "Set A", "Img3.jpeg"), "rb") as f:
+        files = [("files", ("Img3.jpeg", f.read(), "image/jpeg"))]
+    data = {"student_names": ["Debug"], "roll_nos": [str(int(time.time() * 1000))], "omr_set": "A",
+            "csv_filename": "smoke_debug.csv"}
+    result = requests.post(f"{BASE}/score-batch", files=files, data=data, timeout=60).json()["results"][0]
+    r = requests.get(f"{BASE}{result['debug_url']}", timeout=30)
+    assert r.status_code == 200 and r.headers["content-type"] == "image/png"
+    assert r.content[:8] == b"\x89PNG\r\n\x1a\n"
+    assert requests.get(f"{BASE}/debug/no-such-submission").status_code == 404
+
+def test_quality_gate_rejects_blurred_sheet():
+    import cv2
+    with open(os.path.join(DATA_DIR, "Key (Set A and B).xlsx"), "rb") as f:
+        requests.post(f"{BASE}/import-answerkeys", files={"file": ("key.xlsx", f.read())})
+    img = cv2.GaussianBlur(cv2.imread(os.path.join(DATA_DIR, "Set A", "Img3.jpeg")), (0, 0), 4)
+    files = [("files", ("blurred.jpeg", cv2.imencode(".jpg", img)[1].tobytes(), "image/jpeg"))]
+    data = {"student_names": ["Blurred"], "roll_nos": [str(int(time.time() * 1000))], "omr_set": "A",
+            "csv_filename": "smoke_quality.csv"}
+    result = requests.post(f"{BASE}/score-batch", files=files, data=data, timeout=60).json()["results"][0]
+    assert result["ok"] is False and "blurry" in [r["code"] for r in result["error"]["reasons"]]
+    stats = requests.get(f"{BASE}/metrics/quality").json()
+    assert stats["rejected"] >= 1 and stats["reasons"]["blurry:reject"] >= 1
+
+def test_scheduler_lanes():
+    with open(os.path.join(DATA_DIR, "Key (Set A and B).xlsx"), "rb") as f:
+        requests.post(f"{BASE}/import-answerkeys", files={"file": ("key.xlsx", f.read())})
+    before = requests.get(f"{BASE}/metrics/scheduler").json()["lanes"]
+    with open(os.path.join(DATA_DIR, "Set A", "Img2.jpeg"), "rb") as f:
+        files = [("files", ("Img2.jpeg", f.read(), "image/jpeg"))]
+    data = {"student_names": ["Lane"], "roll_nos": [str(int(time.time() * 1000))], "omr_set": "A",
+            "csv_filename": "smoke_lanes.csv"}
+    r = requests.post(f"{BASE}/score-batch", files=files, data=data, headers={"X-OMR-Lane": "bulk"}, timeout=60)
+    assert r.json()["results"][0]["ok"]
+    after = requests.get(f"{BASE}/metrics/scheduler").json()["lanes"]
+    assert after["bulk"]["served"] == before["bulk"]["served"] + 1
+    assert after["interactive"]["served"] == before["interactive"]["served"]
+    assert after["bulk"]["wait_ms"]["samples"] >= 1 and after["bulk"]["in_flight"] == 0
+
+def test_upload_limits():
+    # a PNG header claiming 20000 x 20000 pixels: refused from the header, nothing is decoded
+    huge = b"\x89PNG\r\n\x1a\n" + b"\x00\x00\x00\x0dIHDR" + (20000).to_bytes(4, "big") * 2 + b"\x08\x00\x00\x00\x00"
+    data = {"student_name": "Huge", "roll_no": "limits", "omr_set": "A"}
+    r = requests.post(f"{BASE}/upload-omr", files={"file": ("huge.png", huge, "image/png")}, data=data)
+    assert r.status_code == 413
+    r = requests.post(f"{BASE}/upload-omr", files={"file": ("junk.jpg", b"not an image", "image/jpeg")}, data=data)
+    assert r.status_code == 400
+
+def test_score_document_pdf_with_roster(tmp_path):
+    from documents import write_pdf
+    with open(os.path.join(DATA_DIR, "Key (Set A and B).xlsx"), "rb") as f:
+        requests.post(f"{BASE}/import-answerkeys", files={"file": ("key.xlsx", f.read())})
+    pages = []
+    for i in (2, 3, 4):
+        with open(os.path.join(DATA_DIR, "Set A", f"Img{i}.jpeg"), "rb") as f:
+            pages.append(f.read())
+    write_pdf(tmp_path / "stack.pdf", pages)
+    stamp = str(int(time.time() * 1000))
+    roster = f"Name,Roll No,Page\nAsha,{stamp}1,1\nBen,{stamp}2,2\nNobody,{stamp}9,4\n"
+    with open(tmp_path / "stack.pdf", "rb") as f:
+        r = requests.post(f"{BASE}/score-document", files={"file": ("stack.pdf", f.read()), "roster": ("r.csv", roster)},
+                          data={"omr_set": "A", "csv_filename": "smoke_document.csv"}, timeout=120)
+    body = r.json()
+    assert r.status_code == 200 and body["pages"] == 3 and body["roster_pages_missing"] == [4]
+    by_page = {res["page"]: res for res in body["results"]}
+    assert by_page[1]["ok"] and by_page[1]["roll_no"] == stamp + "1" and by_page[2]["name"] == "Ben"
+    assert not by_page[3]["ok"] and "roster" in by_page[3]["error"]
+
+def test_sheet_layout_and_required_metadata():
+    assert requests.get(f"{BASE}/sheet-layout").json() == {"id_fields": None}
+    with open(os.path.join(DATA_DIR, "Set A", "Img5.jpeg"), "rb") as f:
+        files = [("files", ("Img5.jpeg", f.read(), "image/jpeg"))]
+    result = requests.post(f"{BASE}/score-batch", files=files, data={"omr_set": "A"}, timeout=60).json()["results"][0]
+    assert not result["ok"] and "Roll number is required" in result["error"]
+    data = {"roll_nos": ["7"], "student_names": ["No Set"]}
+    result = requests.post(f"{BASE}/score-batch", files=files, data=data, timeout=60).json()["results"][0]
+    assert not result["ok"] and "Set is required" in result["error"]
+
+def test_catalog_etag_and_change_stream():
+    r = requests.get(f"{BASE}/csv-files", timeout=5)
+    etag = r.headers["ETag"]
+    assert requests.get(f"{BASE}/csv-files", headers={"If-None-Match": etag}, timeout=5).status_code == 304
+    version = requests.get(f"{BASE}/catalog", timeout=5).json()["version"]
+    events = requests.get(f"{BASE}/catalog/events", params={"since": version}, stream=True, timeout=10)
+    fname = f"catalog_{time.time_ns()}.csv"
+    requests.post(f"{BASE}/create-csv", data={"filename": fname})
+    lines = events.iter_lines(decode_unicode=True)
+    data = next(line for line in lines if line.startswith("data: "))
+    events.close()
+    assert fname in json.loads(data[len("data: "):])["files"]
+    r = requests.get(f"{BASE}/csv-files", headers={"If-None-Match": etag}, timeout=5)
+    assert r.status_code == 200 and r.headers["ETag"] != etag and fname in r.json()["files"]
+
+def test_processing_profile_per_set_and_request():
+    requests.post(f"{BASE}/create-bulk-answerkey", data={"set_name": "P", "block": "Python\n1 - a\n2 - b\n"})
+    assert requests.post(f"{BASE}/processing-profile/P", data={"profile": "turbo"}).status_code == 400
+    assert requests.post(f"{BASE}/processing-profile/P", data={"profile": "accurate"}).json()["profile"] == "accurate"
+    assert requests.get(f"{BASE}/processing-profile/p").json()["effective"] == "accurate"
+    with open(os.path.join(DATA_DIR, "Set A", "Img10.jpeg"), "rb") as f:
+        files = [("files", ("Img10.jpeg", f.read(), "image/jpeg"))]
+    roll = str(time.time_ns())
+    data = {"student_names": ["Profile"], "roll_nos": [roll], "omr_set": "P", "csv_filename": "smoke_profile.csv"}
+    result = requests.post(f"{BASE}/score-batch", files=files, data=data, timeout=60).json()["results"][0]
+    assert result["detection"]["profile"] == "accurate"
+    assert requests.get(BASE + result["debug_url"], timeout=60).status_code == 200
+    data["roll_nos"] = [roll + "1"]
+    result = requests.post(f"{BASE}/score-batch", files=files, data=dict(data, profile="fast"), timeout=60).json()
+    assert result["results"][0]["detection"]["profile"] == "fast"
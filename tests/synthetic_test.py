@@ -0,0 +1,35 @@
+import json
+
+import numpy as np
+
+import omr_scoring
+import synthetic
+from responses import SheetResponses, pack_bits
+
+
+def test_rendered_sheets_read_back_as_drawn(tmp_path):
+    for preset, profile in (("clean", "balanced"), ("scan", "balanced"), ("phone", "accurate")):
+        sheet = synthetic.make_sheet(1, synthetic.distortions(preset))
+        path = tmp_path / f"{preset}.jpeg"
+        path.write_bytes(sheet.data)
+        marked = omr_scoring.read_sheet(str(path), profile=profile)[0]
+        assert (pack_bits(marked) == sheet.bits).all(), preset
+    assert (sheet.bits == 0).any() and sheet.params["zoom"] > 1
+
+
+def test_datasets_are_reproducible_with_labels(tmp_path):
+    spec = synthetic.distortions("hard", blur=0, jpeg_quality=(70, 80))
+    assert spec["jpeg_quality"] == (70, 80) and synthetic.parse_override("zoom=0.9-1") == ("zoom", (0.9, 1.0))
+    first = synthetic.make_sheet(7, spec, seed=3)
+    again = next(synthetic.generate(1, spec, seed=3, start=7))
+    assert first.data == again.data and (first.bits == again.bits).all()
+    assert first.params["blur"] == 0 and 70 <= first.params["jpeg_quality"] <= 80
+
+    labels = synthetic.write_dataset(str(tmp_path), 3, spec, seed=3, workers=1, log=None)
+    assert sorted(labels) == ["sheet_000000.jpeg", "sheet_000001.jpeg", "sheet_000002.jpeg"]
+    assert json.loads((tmp_path / "labels.json").read_text()) == labels
+    manifest = json.loads((tmp_path / "manifest.json").read_text())
+    assert manifest["sheets"] == 3 and set(manifest["params"]) == set(labels)
+    sheet = synthetic.make_sheet(2, spec, seed=3)
+    assert (tmp_path / sheet.name).read_bytes() == sheet.data
+    assert np.array_equal(SheetResponses.from_hex(labels[sheet.name]).bits, sheet.bits)
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from thresholding import classify_fills, otsu_split
+
+
+def sheet(paper=200.0, ink=40.0, gradient=0.0, seed=0):
+    """Fill matrices for a sheet with option (q % 4) marked; gradient darkens later columns."""
+    rng = np.random.default_rng(seed)
+    mean_val = np.full((100, 4), paper, dtype=np.float32) + rng.normal(0, 3, (100, 4)).astype(np.float32)
+    truth = np.zeros((100, 4), dtype=bool)
+    truth[np.arange(100), np.arange(100) % 4] = True
+    mean_val[truth] = ink
+    mean_val *= (1 - gradient * (np.arange(100) // 20) / 4)[:, None].astype(np.float32)
+    black_ratio = np.where(mean_val < 100, 0.9, 0.0).astype(np.float32)
+    return mean_val, black_ratio, truth
+
+
+def test_otsu_split_separates_two_clusters():
+    threshold, separation = otsu_split(np.r_[np.full(300, 0.02), np.full(100, 0.7)])
+    assert 0.02 < threshold < 0.7 and separation == pytest.approx(0.68)
+
+
+def test_adaptive_modes_follow_a_dark_sheet_fixed_cutoffs_do_not():
+    mean_val, black_ratio, truth = sheet(paper=130, ink=25)
+    fixed, info = classify_fills(mean_val, black_ratio, "fixed")
+    assert fixed.all()  # every blank bubble is darker than the fixed mean cutoff
+    assert info["threshold"] is None and info["ambiguous"] > 0  # ... and within the band of it
+    for mode in ("adaptive", "local"):
+        marked, info = classify_fills(mean_val, black_ratio, mode)
+        assert (marked == truth).all() and info["margin"] > 0.5 and info["ambiguous"] == 0
+
+
+def test_local_mode_handles_uneven_lighting():
+    mean_val, black_ratio, truth = sheet(paper=220, ink=90, gradient=0.5)
+    assert (classify_fills(mean_val, black_ratio, "fixed")[0] != truth).any()
+    marked, info = classify_fills(mean_val, black_ratio, "local")
+    assert (marked == truth).all() and info["margin"] > 0.3
+
+
+def test_blank_sheet_and_missing_bubbles():
+    mean_val, black_ratio, _ = sheet(ink=200)
+    mean_val[:10] = np.nan
+    marked, info = classify_fills(mean_val, black_ratio, "local")
+    assert not marked.any() and info["margin"] is None
+    with pytest.raises(ValueError):
+        classify_fills(mean_val, black_ratio, "otsu")
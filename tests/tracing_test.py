@@ -0,0 +1,39 @@
+import time
+
+import tracing
+from tracing import SlowLog, collect, export, merge, note_input, request_trace, span
+
+
+def test_spans_merge_and_slow_log(monkeypatch):
+    with span("outside"):
+        pass  # no request: nothing to record into
+    with collect() as worker:
+        with span("decode"):
+            time.sleep(0.002)
+        with span("grid"):
+            pass
+    spans = export(worker)
+    assert [s[0] for s in spans] == ["decode", "grid"] and spans[0][2] >= 2
+
+    monkeypatch.setattr(tracing, "SAMPLE", 1.0)
+    log = SlowLog(slow_ms=1, keep=2)
+    for path in ("/a", "/b", "/c"):
+        with request_trace("POST", path) as trace:
+            with span("detect"):
+                merge(spans)
+            with span("key"):
+                pass
+            with span("key"):
+                pass
+            note_input(image="x.jpg", mode="fixed")
+            time.sleep(0.002)
+        header = trace.server_timing(trace.elapsed_ms())
+        log.record(trace, 200, trace.elapsed_ms())
+    assert header.startswith("decode;dur=") and ';desc="x2"' in header.split("key;")[1] and "total;dur=" in header
+    # detection spans end where the request saw the result
+    start = {s[0]: s for s in trace.spans}
+    assert start["grid"][1] + start["grid"][2] <= start["detect"][1] + start["detect"][2] + 0.1
+    snap = log.snapshot()
+    assert snap["requests"] == snap["slow"] == 3 and [e["path"] for e in snap["entries"]] == ["/c", "/b"]
+    assert snap["entries"][0]["replay"] == [{"image": "x.jpg", "mode": "fixed"}]
+    assert set(snap["entries"][0]["totals_ms"]) == {"decode", "grid", "detect", "key"}
@@ -0,0 +1,44 @@
+import json
+
+import pytest
+
+import profiles
+import tuner
+from profiles import DETECTION_PARAMS, get_profile, load_tuned_profile
+
+
+def test_tuner_search_and_versioned_profile(tmp_path):
+    sheets = tuner.sample_images()[:2]
+    sheets, labels = tuner.load_labels(_accurate_labels(tmp_path, sheets), sheets)
+    best, baseline, results, stats = tuner.tune(
+        sheets, labels, rounds=1, counts={"grid": 1, "bubbles": 2, "classify": 3}, workers=1, log=lambda *_: None)
+    assert len(results) == 6 and baseline["params"] == DETECTION_PARAMS
+    assert best["accuracy"] >= baseline["accuracy"]
+    # one grid variant: the grid stage ran once per sheet, later candidates reused it
+    assert stats["grid_runs"] == len(sheets) and stats["grid_hits"] == len(sheets)
+
+    out = str(tmp_path / "tuned.json")
+    assert tuner.write_profile(out, best, baseline, "balanced", "fixed", 100, "test", 2, 6) == 1
+    assert tuner.write_profile(out, best, baseline, "balanced", "fixed", 100, "test", 2, 6) == 2
+    assert json.load(open(tmp_path / "tuned.v1.json"))["version"] == 1
+    try:
+        assert load_tuned_profile(out) == "tuned"
+        tuned = get_profile("tuned")
+        assert tuned["version"] == 2 and tuned["params"] == best["params"]
+        assert tuned["decode_side"] == get_profile("balanced")["decode_side"]
+    finally:
+        profiles.PROFILES.pop("tuned", None)
+    for bad in ({"params": {}, "version": 1}, {"base": "balanced", "params": [1]}, ["balanced"]):
+        (tmp_path / "bad.json").write_text(json.dumps(bad))
+        with pytest.raises(ValueError, match="bad.json"):
+            load_tuned_profile(str(tmp_path / "bad.json"))
+    assert "tuned" not in profiles.PROFILES
+
+
+def _accurate_labels(tmp_path, sheets):
+    import omr_scoring
+    from responses import SheetResponses
+    path = tmp_path / "labels.json"
+    path.write_text(json.dumps({tuner._label_key(s): SheetResponses.from_marked(
+        omr_scoring.read_sheet(s, profile="accurate")[0]).to_hex() for s in sheets}))
+    return str(path)
@@ -0,0 +1,103 @@
+import os
+
+import numpy as np
+
+from omr_layout import NUM_COLS, NUM_ROWS_PER_COL, NUM_OPTS
+
+# fixed: the original global cutoffs
+# adaptive: two-class (Otsu) split of this sheet's bubble darkness
+# local: like adaptive, after normalising each bubble against nearby blank paper / bubbles
+THRESHOLD_MODES = ("fixed", "adaptive", "local")
+DEFAULT_THRESHOLD_MODE = os.getenv("OMR_THRESHOLD_MODE", "fixed")
+
+FILL_THRESH = 0.27      # fixed: share of pixels darker than DARK_PIXEL
+DARK_PIXEL = 100
+DARK_MEAN = 140         # fixed: mean ROI intensity below which a bubble is marked
+MIN_SEPARATION = 0.2    # class means closer than this: the sheet has one class, not two
+MIN_DARKNESS = 0.35     # ... and that class counts as marked only if darker than this
+AMBIGUOUS_BAND = 0.05   # darkness this close to the threshold is reported as ambiguous
+BAND_ROWS = 5           # local: background is estimated per column over bands of rows
+
+
+def otsu_split(values):
+    """Threshold maximising between-class variance of a 1-D sample (exact, no histogram)."""
+    v = np.sort(values)
+    n = len(v)
+    if n < 2 or v[0] == v[-1]:
+        return (float(v[0]) if n else 0.0), 0.0
+    csum = np.cumsum(v)
+    k = np.arange(1, n)
+    lo_mean = csum[:-1] / k
+    hi_mean = (csum[-1] - csum[:-1]) / (n - k)
+    between = k * (n - k) * (hi_mean - lo_mean) ** 2
+    i = int(np.argmax(between))
+    return float((v[i] + v[i + 1]) / 2), float(hi_mean[i] - lo_mean[i])
+
+
+def _upper_quartile(values, axis=-1):
+    """Nearest-rank 75th percentile; a partial sort is several times cheaper than np.percentile."""
+    k = (values.shape[axis] - 1) * 3 // 4
+    return np.take(np.partition(values, k, axis=axis), k, axis=axis)
+
+
+def darkness(mean_val, local=False):
+    """1 - intensity / paper reference, in [0, 1]; NaN where no bubble was found.
+
+    The reference is the brightness of blank bubbles: the 75th percentile over the sheet, or
+    with local=True over each column's bands of BAND_ROWS rows (floored at 3/4 of the sheet
+    value, so a band that is almost all marked cannot pass for background)."""
+    found = ~np.isnan(mean_val)
+    if not found.any():
+        return np.full(mean_val.shape, np.nan, dtype=np.float32)
+    sheet_ref = _upper_quartile(mean_val[found])
+    ref = sheet_ref
+    if local:
+        bands = np.where(found, mean_val, sheet_ref).reshape(
+            NUM_COLS, NUM_ROWS_PER_COL // BAND_ROWS, BAND_ROWS * NUM_OPTS)
+        band_ref = np.maximum(_upper_quartile(bands), 0.75 * sheet_ref)
+        ref = np.repeat(band_ref, BAND_ROWS * NUM_OPTS, axis=1).reshape(mean_val.shape)
+    return np.clip(1 - mean_val / np.maximum(ref, 1), 0, 1).astype(np.float32)
+
+
+def fill_margin(dark, marked):
+    """Gap between the lightest marked and the darkest unmarked bubble (negative: overlap)."""
+    found = ~np.isnan(dark)
+    on, off = dark[found & marked], dark[found & ~marked]
+    if not len(on) or not len(off):
+        return None
+    return float(on.min() - off.max())
+
+
+def classify_fills(mean_val, black_ratio, mode="fixed", fill_thresh=FILL_THRESH, dark_mean=DARK_MEAN):
+    """Marked bubbles from the fill matrices of one sheet; returns (bool[100, 4], info).
+    fill_thresh / dark_mean override the fixed mode's cutoffs (a profile's params).
+
+    info reports the threshold used and the margin it achieved, so sheets read with little
+    margin can be sent for review instead of silently misread."""
+    if mode not in THRESHOLD_MODES:
+        raise ValueError(f"Unknown threshold mode {mode!r}; use one of {', '.join(THRESHOLD_MODES)}")
+    found = ~np.isnan(mean_val)
+    dark = darkness(mean_val, local=(mode == "local"))
+    if mode == "fixed":
+        with np.errstate(invalid="ignore"):
+            marked = found & ((black_ratio > fill_thresh) | (mean_val < dark_mean))
+        threshold = None
+    else:
+        threshold, separation = otsu_split(dark[found])
+        if separation < MIN_SEPARATION:
+            # blank (or completely filled) sheet: no second class to split off
+            threshold = MIN_DARKNESS
+        with np.errstate(invalid="ignore"):
+            marked = found & (dark > threshold)
+    info = {"mode": mode, "threshold": None if threshold is None else round(threshold, 4)}
+    margin = fill_margin(dark, marked)
+    info["margin"] = None if margin is None else round(margin, 4)
+    with np.errstate(invalid="ignore"):
+        if threshold is None:
+            # fixed: close to either cutoff (intensity scaled to [0, 1] like darkness)
+            near = (np.abs(black_ratio - fill_thresh) < AMBIGUOUS_BAND) | (
+                np.abs(mean_val - dark_mean) / 255 < AMBIGUOUS_BAND)
+        else:
+            near = np.abs(dark - threshold) < AMBIGUOUS_BAND
+    info["ambiguous"] = int(np.count_nonzero(found & near))
+    return marked, info
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""Per-request span timings: where a slow request spent its time.
+
+The API's middleware opens a RequestTrace for every HTTP request; code on the request's
+path marks its stages with `with span("detect"):`. Scoring workers collect their own
+stages (decode, quality, grid, bubbles, classify) with collect() and send them back with
+the result, where merge() adds them to the request. Every response carries the spans as a
+Server-Timing header (shown by browser dev tools and curl -v); requests slower than
+OMR_TRACE_SLOW_MS are kept, with their spans, in a ring buffer served at /debug/slow.
+
+With OMR_TRACE_SAMPLE > 0 that share of requests also records its input sheets (stored
+image, hash, threshold mode, profile), so a slow one can be replayed offline:
+
+    curl -s http://localhost:8000/debug/slow > slow.json
+    python tracing.py replay slow.json [--blobs file:///data/blobs]
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import contextlib
+import contextvars
+import collections
+import threading
+
+SLOW_MS = float(os.getenv("OMR_TRACE_SLOW_MS", "500"))
+SLOW_KEEP = int(os.getenv("OMR_TRACE_SLOW_KEEP", "100"))
+SAMPLE = float(os.getenv("OMR_TRACE_SAMPLE", "0"))   # share of requests that record their inputs
+MAX_SPANS = 256  # per request; a large batch keeps its first spans and counts the rest
+
+_current = contextvars.ContextVar("omr_trace", default=None)
+
+
+class RequestTrace:
+    """Spans of one request (or of one detection on a worker) as (name, start ms, ms)."""
+
+    def __init__(self, method=None, path=None, sampled=False):
+        self.method = method
+        self.path = path
+        self.sampled = sampled
+        self.start = time.perf_counter()
+        self.spans = []
+        self.dropped = 0
+        self.inputs = []
+
+    def add(self, name, start, ms):
+        if len(self.spans) < MAX_SPANS:
+            self.spans.append((name, round((start - self.start) * 1000, 2), round(ms, 2)))
+        else:
+            self.dropped += 1
+
+    def elapsed_ms(self):
+        return (time.perf_counter() - self.start) * 1000
+
+    def totals(self):
+        """{span name: (total ms, count)} in first-seen order; parallel spans add up."""
+        totals = {}
+        for name, _, ms in self.spans:
+            total, count = totals.get(name, (0.0, 0))
+            totals[name] = (total + ms, count + 1)
+        return totals
+
+    def server_timing(self, total_ms):
+        parts = [f'{name};dur={ms:.1f}' + (f';desc="x{count}"' if count > 1 else "")
+                 for name, (ms, count) in self.totals().items()]
+        return ", ".join(parts + [f"total;dur={total_ms:.1f}"])
+
+
+@contextlib.contextmanager
+def span(name):
+    """Time the block as a span of the current request; a no-op outside one."""
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(name, start, (time.perf_counter() - start) * 1000)
+
+
+@contextlib.contextmanager
+def request_trace(method, path):
+    """Open the trace of one request for the code it runs (the middleware's side)."""
+    trace = RequestTrace(method, path, sampled=SAMPLE > 0 and random.random() < SAMPLE)
+    token = _current.set(trace)
+    try:
+        yield trace
+    finally:
+        _current.reset(token)
+
+
+@contextlib.contextmanager
+def collect():
+    """Record spans outside any request (on a scoring worker); yields the trace whose
+    export() is sent back with the result."""
+    trace = RequestTrace()
+    token = _current.set(trace)
+    try:
+        yield trace
+    finally:
+        _current.reset(token)
+
+
+def export(trace):
+    return [list(s) for s in trace.spans]
+
+
+def merge(spans, prefix=""):
+    """Add spans recorded elsewhere (a worker) to the current request, as if they had
+    just finished: their starts keep their spacing and the last one ends now."""
+    trace = _current.get()
+    if trace is None or not spans:
+        return
+    end = max(start + ms for _, start, ms in spans)
+    base = time.perf_counter() - end / 1000
+    for name, start, ms in spans:
+        trace.add(prefix + name, base + start / 1000, ms)
+
+
+def note_input(**ref):
+    """Remember an input sheet of the current request for replay, when it is sampled."""
+    trace = _current.get()
+    if trace is not None and trace.sampled:
+        trace.inputs.append(ref)
+
+
+class SlowLog:
+    """The last `keep` requests slower than `slow_ms`, with their spans, newest first."""
+
+    def __init__(self, slow_ms=SLOW_MS, keep=SLOW_KEEP):
+        self.slow_ms = slow_ms
+        self._entries = collections.deque(maxlen=keep)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.slow = 0
+
+    def record(self, trace, status, total_ms):
+        with self._lock:
+            self.requests += 1
+            if total_ms < self.slow_ms:
+                return
+            self.slow += 1
+            entry = {"method": trace.method, "path": trace.path, "status": status,
+                     "at": round(time.time(), 3), "total_ms": round(total_ms, 2),
+                     "spans": [{"name": n, "start_ms": s, "ms": ms} for n, s, ms in trace.spans],
+                     "totals_ms": {n: round(ms, 2) for n, (ms, _) in trace.totals().items()}}
+            if trace.dropped:
+                entry["spans_dropped"] = trace.dropped
+            if trace.inputs:
+                entry["replay"] = list(trace.inputs)
+            self._entries.append(entry)
+
+    def snapshot(self, limit=None):
+        with self._lock:
+            entries = list(reversed(self._entries))[:limit]
+            return {"slow_ms": self.slow_ms, "sample": SAMPLE, "requests": self.requests,
+                    "slow": self.slow, "entries": entries}
+
+
+def replay(entries, blobs=None, log=print):
+    """Detect each recorded input again here, with the worker-side spans; returns
+    [(entry, ref, spans)] for refs whose image could be found."""
+    from scoring_workers import warm_up, detect_image
+    warm_up()
+    replayed = []
+    for entry in entries:
+        for ref in entry.get("replay", ()):
+            path = ref.get("image")
+            if (not path or not os.path.exists(path)) and blobs is not None and ref.get("image_sha256"):
+                path = blobs.local_path(ref["image_sha256"])
+            if not path or not os.path.exists(path):
+                log(f"skip {entry['method']} {entry['path']}: image not found ({ref.get('image')})")
+                continue
+            with collect() as trace:
+                start = time.perf_counter()
+                detect_image(path, ref.get("mode"), ref.get("profile"))
+                trace.add("detect", start, (time.perf_counter() - start) * 1000)
+            spans = {n: round(ms, 1) for n, (ms, _) in trace.totals().items()}
+            recorded = {k: round(v, 1) for k, v in entry["totals_ms"].items()}
+            log(f"{entry['method']} {entry['path']} ({entry['total_ms']:.0f} ms) {os.path.basename(path)}\n"
+                f"  recorded {recorded}\n  replayed {spans}")
+            replayed.append((entry, ref, spans))
+    return replayed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay the sampled inputs of slow requests")
+    parser.add_argument("command", choices=("replay",))
+    parser.add_argument("slow", help="JSON saved from /debug/slow")
+    parser.add_argument("--blobs", help="blob store to find images by hash (e.g. file:///data/blobs)")
+    args = parser.parse_args(argv)
+    with open(args.slow) as f:
+        data = json.load(f)
+    blobs = None
+    if args.blobs:
+        from blob_store import open_blob_store
+        blobs = open_blob_store(args.blobs)
+    entries = data["entries"] if isinstance(data, dict) else data
+    # the pipeline records into the imported module, not into this script's copy of it
+    from tracing import replay as replay_imported
+    if not replay_imported(entries, blobs):
+        print("no replayable inputs (set OMR_TRACE_SAMPLE on the server to record them)", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
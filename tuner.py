@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+"""Search detection parameters (profiles.DETECTION_PARAMS) against labelled sheets.
+
+    python tuner.py                              # labels: the accurate profile's reading
+    python tuner.py --labels labels.json         # {"Set A/Img1.jpeg": "<100 hex digits>", ...}
+    python tuner.py label --out labels.json      # write the accurate reading to check by hand
+    python tuner.py --budget-ms 60 --base balanced --out tuned_profile.json
+
+Candidates are scored by the share of questions read exactly as labelled, among those
+whose modelled latency per sheet (mean over the sheets) stays within --budget-ms. The best
+is written as a versioned profile (the previous file is kept as <name>.v<N>.json) that
+profiles.py registers as "tuned" at startup when OMR_TUNED_PROFILE points at it.
+
+Each parameter belongs to the pipeline stage that first reads it (STAGES). Worker
+processes cache every stage's output per sheet and upstream parameters, and candidates are
+handed out grouped by their grid parameters, so evaluating one recomputes only the stages
+whose parameters changed; a candidate's latency is the sum of its stages' measured times.
+Later rounds sample around the best candidate so far in a shrinking range.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import datetime
+import multiprocessing
+import collections
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from profiles import DETECTION_PARAMS, get_profile
+from thresholding import DEFAULT_THRESHOLD_MODE
+from responses import SheetResponses
+from fileio import atomic_write
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(ROOT, "data")
+
+# stage -> the params it reads, in pipeline order
+STAGES = {
+    "grid": ("grid_min_area", "grid_max_area", "grid_low_pct", "grid_high_pct"),
+    "bubbles": ("bubble_min_area", "bubble_max_area", "bubble_min_aspect", "bubble_max_aspect",
+                "bubble_min_circularity", "row_threshold"),
+    "classify": ("fill_thresh", "dark_mean"),
+}
+# param -> (low, high) searched; ints stay ints
+SPACE = {
+    "grid_min_area": (60, 200), "grid_max_area": (1500, 5000),
+    "grid_low_pct": (0.01, 0.1), "grid_high_pct": (0.9, 0.99),
+    "bubble_min_area": (30, 120), "bubble_max_area": (450, 900),
+    "bubble_min_aspect": (0.5, 0.8), "bubble_max_aspect": (1.25, 1.7),
+    "bubble_min_circularity": (0.5, 0.85), "row_threshold": (10, 30),
+    "fill_thresh": (0.15, 0.45), "dark_mean": (110, 170),
+}
+CACHE_SIZES = {"decode": 64, "grid": 64, "bubbles": 4096}
+
+
+def sample_images():
+    import glob
+    return sorted(glob.glob(os.path.join(DATA_DIR, "Set *", "*.jpeg")))
+
+
+def _sample(rng, names, center=None, shrink=1.0):
+    """Random values for params `names`, within `shrink` of the range around center."""
+    out = {}
+    for name in names:
+        low, high = SPACE[name]
+        if center is not None:
+            half = (high - low) * shrink / 2
+            low, high = max(low, center[name] - half), min(high, center[name] + half)
+        value = rng.uniform(low, high)
+        out[name] = int(round(value)) if isinstance(DETECTION_PARAMS[name], int) else round(value, 3)
+    return out
+
+
+def _pick(params, stage):
+    return {name: params[name] for name in STAGES[stage]}
+
+
+def design(rng, counts, incumbent, shrink):
+    """Candidates as {grid params: {bubble params: [classify params]}}: counts[stage] values
+    per stage, the incumbent's always among them, the rest sampled around it."""
+    def variants(stage):
+        found = {tuple(_pick(incumbent, stage).items())}
+        for _ in range(counts[stage] * 4):
+            if len(found) >= counts[stage]:
+                break
+            found.add(tuple(_sample(rng, STAGES[stage], incumbent if shrink < 1 else None, shrink).items()))
+        return [dict(v) for v in found]
+
+    return {tuple(g.items()): {tuple(b.items()): variants("classify") for b in variants("bubbles")}
+            for g in variants("grid")}
+
+
+# --- worker side: stage caches live for the whole process ---------------------------------
+
+_caches = {stage: collections.OrderedDict() for stage in CACHE_SIZES}
+_stats = collections.Counter()
+
+
+def _cached(stage, key, compute):
+    """(value, ms to compute it) of a stage; value None when the stage raised."""
+    cache = _caches[stage]
+    if key in cache:
+        cache.move_to_end(key)
+        _stats[f"{stage}_hits"] += 1
+        return cache[key]
+    _stats[f"{stage}_runs"] += 1
+    start = time.perf_counter()
+    try:
+        value = compute()
+    except Exception:
+        value = None
+    cache[key] = (value, (time.perf_counter() - start) * 1000)
+    if len(cache) > CACHE_SIZES[stage]:
+        cache.popitem(last=False)
+    return cache[key]
+
+
+def _fills(path, profile, grid, bubbles):
+    """(mean_val, black_ratio) of one sheet or None, and the ms its stages took."""
+    import omr_scoring
+    from image_io import read_gray
+    decode_key = (path, profile["decode_side"])
+    img, decode_ms = _cached("decode", decode_key, lambda: read_gray(path, profile["decode_side"]))
+    if img is None:
+        return None, decode_ms
+    grid_key = decode_key + (profile["box_scale"], grid)
+    located, grid_ms = _cached("grid", grid_key, lambda: omr_scoring.locate_grid(img, profile))
+    if located is None:
+        return None, decode_ms + grid_ms
+    _, gray, contours = located
+    fills, bubble_ms = _cached("bubbles", grid_key + (profile["strategy"], profile["refine"], bubbles),
+                               lambda: omr_scoring.locate_bubbles(gray, contours, profile)[:2])
+    return fills, decode_ms + grid_ms + bubble_ms
+
+
+def evaluate(base, mode, sheets, labels, grid, bubble_variants):
+    """Score every candidate sharing these grid params; returns (results, cache stats)."""
+    from thresholding import classify_fills
+    _stats.clear()
+    results = []
+    for bubbles, classify_variants in bubble_variants:
+        params = dict(DETECTION_PARAMS, **dict(grid), **dict(bubbles))
+        profile = dict(get_profile(base), params=params)
+        fills = [_fills(path, profile, grid, bubbles) for path in sheets]
+        for classify in classify_variants:
+            correct, failures, ms = 0, 0, []
+            for (found, stage_ms), label in zip(fills, labels):
+                if found is None:
+                    failures += 1
+                    ms.append(stage_ms)
+                    continue
+                start = time.perf_counter()
+                marked, _ = classify_fills(*found, mode, classify["fill_thresh"], classify["dark_mean"])
+                ms.append(stage_ms + (time.perf_counter() - start) * 1000)
+                correct += int(np.count_nonzero(SheetResponses.from_marked(marked).bits == label))
+            results.append({"params": dict(params, **classify),
+                            "accuracy": correct / (len(sheets) * labels.shape[1]),
+                            "failures": failures, "mean_ms": float(np.mean(ms)),
+                            "p95_ms": float(np.percentile(ms, 95))})
+    return results, dict(_stats)
+
+
+def _read_accurate(path):
+    import omr_scoring
+    try:
+        marked = omr_scoring.read_sheet(path, profile="accurate")[0]
+    except Exception:
+        return None
+    return SheetResponses.from_marked(marked).to_hex()
+
+
+# --- driver ----------------------------------------------------------------------------------
+
+def _label_key(path):
+    return os.path.relpath(path, DATA_DIR).replace(os.sep, "/")
+
+
+def load_labels(path, sheets):
+    """Sheets that have a label and their labels, uint8[N, NUM_QUESTIONS] bits."""
+    with open(path, "r", encoding="utf-8") as f:
+        labels = json.load(f)
+    kept = [s for s in sheets if _label_key(s) in labels or s in labels]
+    bits = [SheetResponses.from_hex(labels.get(_label_key(s), labels.get(s))).bits for s in kept]
+    return kept, np.array(bits, dtype=np.uint8).reshape(len(kept), -1)
+
+
+def pseudo_labels(pool, sheets):
+    """The accurate profile's reading of each sheet (sheets it cannot read are dropped)."""
+    readings = list(pool.map(_read_accurate, sheets))
+    kept = [s for s, r in zip(sheets, readings) if r is not None]
+    bits = [SheetResponses.from_hex(r).bits for r in readings if r is not None]
+    return kept, np.array(bits, dtype=np.uint8).reshape(len(kept), -1)
+
+
+def _best(results, budget_ms):
+    feasible = [r for r in results if r["mean_ms"] <= budget_ms]
+    return max(feasible, key=lambda r: (r["accuracy"], -r["failures"], -r["mean_ms"]), default=None)
+
+
+def tune(sheets, labels, base="balanced", mode=None, budget_ms=100.0, rounds=3,
+         counts=None, workers=None, seed=0, log=print):
+    """Search the params; returns (best result or None, baseline result, all results, cache stats)."""
+    mode = mode or DEFAULT_THRESHOLD_MODE
+    counts = dict({"grid": 3, "bubbles": 6, "classify": 8}, **(counts or {}))
+    if mode != "fixed":
+        counts["classify"] = 1  # only the fixed mode reads the classify params
+    workers = workers or os.cpu_count() or 1
+    rng = random.Random(seed)
+    baseline_params = dict(get_profile(base)["params"])
+    incumbent, seen, results, stats = baseline_params, set(), [], collections.Counter()
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(workers, mp_context=ctx) as pool:
+        for round_no in range(rounds):
+            shrink = 1.0 if round_no == 0 else 0.5 ** round_no
+            tasks = []
+            for grid, bubble_map in design(rng, counts, incumbent, shrink).items():
+                variants = []
+                for bubbles, classifies in bubble_map.items():
+                    fresh = [c for c in classifies if (grid, bubbles, tuple(c.items())) not in seen]
+                    seen.update((grid, bubbles, tuple(c.items())) for c in fresh)
+                    if fresh:
+                        variants.append((bubbles, fresh))
+                # one task per grid variant keeps its cached grid stage on one worker;
+                # split further only when there are fewer grid variants than workers
+                chunks = max(1, -(-workers // max(1, counts["grid"])))
+                for i in range(chunks):
+                    if variants[i::chunks]:
+                        tasks.append(pool.submit(evaluate, base, mode, sheets, labels, grid, variants[i::chunks]))
+            for task in tasks:
+                found, task_stats = task.result()
+                results.extend(found)
+                stats.update(task_stats)
+            best = _best(results, budget_ms)
+            if best is not None:
+                incumbent = best["params"]
+            log(f"round {round_no + 1}: {len(results)} candidates, best accuracy "
+                f"{best['accuracy']:.4f} at {best['mean_ms']:.1f} ms/sheet" if best else
+                f"round {round_no + 1}: {len(results)} candidates, none within {budget_ms} ms/sheet")
+    baseline = next(r for r in results if r["params"] == baseline_params)
+    return _best(results, budget_ms), baseline, results, dict(stats)
+
+
+def write_profile(path, best, baseline, base, mode, budget_ms, labels_source, sheets, evaluated):
+    """Write the tuned profile, keeping the previous version next to it; returns the version."""
+    version = 1
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            previous = json.load(f)
+        version = previous.get("version", 0) + 1
+        stem, ext = os.path.splitext(path)
+        with atomic_write(f"{stem}.v{previous.get('version', 0)}{ext}", "w", encoding="utf-8") as f:
+            json.dump(previous, f, indent=2)
+    changed = {k: v for k, v in best["params"].items() if v != DETECTION_PARAMS[k]}
+    profile = {
+        "name": "tuned", "version": version, "base": base, "params": changed,
+        "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "tuning": {
+            "threshold_mode": mode, "budget_ms": budget_ms, "labels": labels_source,
+            "sheets": sheets, "candidates": evaluated,
+            "accuracy": round(best["accuracy"], 5), "failures": best["failures"],
+            "mean_ms": round(best["mean_ms"], 2), "p95_ms": round(best["p95_ms"], 2),
+            "baseline": {"accuracy": round(baseline["accuracy"], 5), "failures": baseline["failures"],
+                         "mean_ms": round(baseline["mean_ms"], 2)},
+        },
+    }
+    with atomic_write(path, "w", encoding="utf-8") as f:
+        json.dump(profile, f, indent=2)
+    return version
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tune detection parameters against labelled sheets")
+    parser.add_argument("command", nargs="?", default="tune", choices=("tune", "label"))
+    parser.add_argument("--labels", help="JSON {image path relative to data/: hex responses}")
+    parser.add_argument("--base", default="balanced", help="profile whose decode / strategy is tuned")
+    parser.add_argument("--mode", default=None, help="threshold mode (default: OMR_THRESHOLD_MODE)")
+    parser.add_argument("--budget-ms", type=float, default=100.0, help="mean detection ms per sheet allowed")
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--grid", type=int, default=3, help="grid-stage variants per round")
+    parser.add_argument("--bubbles", type=int, default=6, help="bubble-stage variants per grid variant")
+    parser.add_argument("--classify", type=int, default=8, help="threshold variants per bubble variant")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=os.getenv("OMR_TUNED_PROFILE", "tuned_profile.json"))
+    args = parser.parse_args(argv)
+
+    sheets = sample_images()
+    if args.command == "label":
+        with ProcessPoolExecutor(args.workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            kept, bits = pseudo_labels(pool, sheets)
+        with atomic_write(args.out, "w", encoding="utf-8") as f:
+            json.dump({_label_key(s): SheetResponses(b).to_hex() for s, b in zip(kept, bits)}, f, indent=2)
+        print(f"wrote {len(kept)} labels to {args.out}")
+        return 0
+
+    if args.labels:
+        sheets, labels = load_labels(args.labels, sheets)
+        source = os.path.basename(args.labels)
+    else:
+        with ProcessPoolExecutor(args.workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            sheets, labels = pseudo_labels(pool, sheets)
+        source = "accurate profile"
+    if not sheets:
+        print("no labelled sheets")
+        return 1
+    mode = args.mode or DEFAULT_THRESHOLD_MODE
+    start = time.perf_counter()
+    best, baseline, results, stats = tune(
+        sheets, labels, args.base, mode, args.budget_ms, args.rounds,
+        {"grid": args.grid, "bubbles": args.bubbles, "classify": args.classify}, args.workers, args.seed)
+    print(f"{len(results)} candidates on {len(sheets)} sheets in {time.perf_counter() - start:.1f} s; "
+          f"stage cache: " + ", ".join(f"{k} {v}" for k, v in sorted(stats.items())))
+    print(f"baseline ({args.base}): accuracy {baseline['accuracy']:.4f}, {baseline['failures']} failed, "
+          f"{baseline['mean_ms']:.1f} ms/sheet")
+    if best is None:
+        print(f"no candidate within {args.budget_ms} ms/sheet; nothing written")
+        return 1
+    print(f"best: accuracy {best['accuracy']:.4f}, {best['failures']} failed, {best['mean_ms']:.1f} ms/sheet")
+    version = write_profile(args.out, best, baseline, args.base, mode, args.budget_ms, source,
+                            len(sheets), len(results))
+    print(f"wrote {args.out} (version {version}); start the API with OMR_TUNED_PROFILE={args.out} "
+          f"and OMR_PROFILE=tuned to use it")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())